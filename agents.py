@@ -3,64 +3,357 @@ from typing import Annotated, List
 from kani import AIParam, ai_function, ChatMessage
 
 # local imports
-from kani_streamlit import StreamlitKani
+from kani_streamlit import StreamlitKani, token_lengths
+import kg_driver
+from query_cache import query_cache
+from query_guard import query_guard, QueryRejected
+from plan_reuse import plan_reuse
+from cypher_utils import parameterize
+from result_store import ResultStore
+from result_format import compact_rows
+from monarch_search import monarch_search
+from example_retrieval import ExampleRetriever
+import assets
+import telemetry
+import schema_snapshot
+import hierarchy_index
+import llm_scheduler
 
 # streamlit and pandas for extra functionality
 import streamlit as st
-from neo4j import GraphDatabase
+from neo4j import Query
+from neo4j.exceptions import ClientError, DriverError, Neo4jError
+import asyncio
 import json
 import textwrap
-import httpx
+import time
 import os
 
 
 
 class KGAgent(StreamlitKani):
-    """Base class for agents that interact with the knowledge graph. NOTE: set NEO4J_BOLT to e.g. bolt://localhost:7687 in .env file."""
+    """Base class for agents that interact with the knowledge graph. NOTE: set NEO4J_BOLT to e.g. bolt://localhost:7687 in .env file; all agents share the process-wide driver pool in kg_driver.py."""
     def __init__(self, engine, max_response_tokens = 10000, system_prompt = "You have access to a neo4j knowledge graph, and can run cypher queries against it."):
 
         super().__init__(engine, system_prompt = system_prompt)
 
-        # dev instance of KG
+        # dev instance of KG; the driver itself is shared by all agents in the process (see kg_driver.py)
         self.neo4j_uri = os.environ["NEO4J_BOLT"]  # default bolt protocol port
-        self.neo4j_driver = GraphDatabase.driver(self.neo4j_uri)
 
         self.max_response_tokens = max_response_tokens
+        # records are pulled from the server in batches of this size, so oversized results can be cut off early
+        self.fetch_size = 100
+        # while fetching, a result's size is estimated from its JSON length, assuming at most this many characters per token
+        self.max_chars_per_token = 6
+        # most queries query_kg_batch will run at once
+        self.max_batch_queries = 10
+        # large results are kept here for paging with fetch_page; enough for every query of a full batch to overflow, plus a few earlier results
+        self.result_store = ResultStore(max_results = self.max_batch_queries + 5)
 
 
 
     @ai_function()
-    def query_kg(self, query: Annotated[str, AIParam(desc="Cypher query to run.")],):
-        """Run a cypher query against the database."""
+    async def query_kg(self, query: Annotated[str, AIParam(desc="Cypher query to run.")],):
+        """Run a cypher query against the database. Results are a list of records, or, when smaller, a table: `columns` names the fields of each of the `rows`, and long values repeated across rows are replaced by `@N` references, defined once in `repeated_values`."""
 
-        with self.neo4j_driver.session() as session:
-            result = session.run(query)
-            data = [record.data() for record in result]
+        outcome = await self._run_query(query, self.max_response_tokens)
+        if "error" in outcome:
+            return f"ERROR: {outcome['error']}"
 
-        result = json.dumps(data)
-        # if self.message_token_len reports more than 10000 tokens in the result, we need to ask the agent to make the request smaller
-        tokens = self.message_token_len(ChatMessage.user(result))
-        if tokens > self.max_response_tokens:
-            return f"ERROR: The result contained {tokens} tokens, greater than the maximum allowable of {self.max_response_tokens}. Please try a smaller query."
-        else:
-            return result
+        result = json.dumps(outcome["rows"])
+        for note in outcome.get("notes", []):
+            result = f"{result}\n\nNOTE: {note}"
+        return result
+
+
+
+    @ai_function()
+    async def query_kg_batch(self, queries: Annotated[List[str], AIParam(desc="Cypher queries to run; independent of each other.")],):
+        """Run several independent cypher queries at once, e.g. the parts of a multi-part question. Results are keyed by the index of each query, and share one size limit; a query that fails has an "error" in place of its rows. Rows are encoded as by query_kg."""
+
+        if len(queries) > self.max_batch_queries:
+            return f"ERROR: At most {self.max_batch_queries} queries can be run in one batch; {len(queries)} were given."
+
+        # the queries share the response budget, so each gets an equal slice of it
+        budget = self.max_response_tokens // max(len(queries), 1)
+        outcomes = await asyncio.gather(*(self._run_query(query, budget) for query in queries))
+
+        return json.dumps({str(i): outcome for i, outcome in enumerate(outcomes)})
+
+
+
+    @ai_function()
+    async def fetch_page(self, handle: Annotated[str, AIParam(desc="Result handle given with a truncated query result.")],
+                         offset: Annotated[int, AIParam(desc="Index of the first row to return.")],):
+        """Get more rows of a large query result, without running the query again. Rows are encoded as by query_kg: a list of records, or a table of `columns` and `rows`, with `@N` references to `repeated_values`."""
+
+        stored = self.result_store.get(handle)
+        if stored is None:
+            return f"ERROR: The result {handle!r} is not available (it may have been replaced by newer results). Please run the query again."
+        if offset < 0 or offset >= len(stored.rows):
+            return f"ERROR: The offset must be between 0 and {len(stored.rows) - 1} for result {handle!r}."
+
+        # the store is only used from the agent's event loop (it isn't thread-safe), but tokenizing can run in a thread
+        count, _ = await asyncio.get_running_loop().run_in_executor(None, self._fit_rows, stored.rows[offset:], self.max_response_tokens)
+        if count == 0:
+            return f"ERROR: The row at offset {offset} alone exceeds the maximum allowable of {self.max_response_tokens} tokens. Please return fewer properties in the query."
+
+        end = offset + count
+        result = json.dumps(compact_rows(stored.rows[offset:end]))
+        if end < len(stored.rows):
+            return f"{result}\n\nNOTE: These are rows {offset} to {end - 1} of {handle!r}. Call fetch_page with offset {end} for the next page."
+        if not stored.complete:
+            return f"{result}\n\nNOTE: These are the last stored rows of {handle!r}; the query had more results than can be stored. Use SKIP {end} in the query to see more."
+        return f"{result}\n\nNOTE: These are the last rows of {handle!r}."
+
+
+
+    async def _run_query(self, query, max_tokens):
+        """Run one agent-written query within a token budget. Returns {"rows": [...], "notes": [...]} on success, or {"error": "..."} with feedback for the agent.
+        Rows beyond the budget are kept in the agent's result store, for paging with fetch_page."""
+
+        # the guard adds a LIMIT if the agent forgot one; the agent is told so it can page with SKIP if needed
+        query, limit_note = query_guard.enforce_limit(query)
+
+        try:
+            # awaiting the shared pool keeps the event loop free for other sessions while the query runs
+            data, overflow, complete = await self._fetch_within_budget(query, max_tokens)
+        except QueryRejected as e:
+            return {"error": str(e)}
+        except ClientError as e:
+            if "TransactionTimedOut" not in (e.code or ""):
+                return {"error": f"{e.code}: {e.message}"}
+            return {"error": f"The query did not finish within the {query_guard.tx_timeout:g} second time limit. Please try a more specific query, e.g. starting from nodes matched by `id`, with bounded variable-length relationships."}
+        except (Neo4jError, DriverError) as e:
+            # transient, database and connection errors are reported per query, so one failure doesn't lose the rest of a batch
+            return {"error": f"The query could not be run ({type(e).__name__}: {e}). It may succeed if run again."}
+
+        notes = []
+        if limit_note:
+            notes.append(limit_note)
+        if overflow:
+            handle = self.result_store.add(query, data + overflow, complete)
+            total = f"{len(data) + len(overflow)}" if complete else f"at least {len(data) + len(overflow)}"
+            notes.append(f"The result has {total} rows; only the first {len(data)} fit within the maximum allowable of {max_tokens} tokens. Rather than re-running the query, call fetch_page with handle {handle!r} and offset {len(data)} to see the next page.")
+
+        # tabular results are sent with their column names once, rather than on every row
+        with telemetry.span("result.serialize", self.metrics):
+            outcome = {"rows": compact_rows(data)}
+        if notes:
+            outcome["notes"] = notes
+        return outcome
+
+
+
+    def _fit_rows(self, rows, max_tokens):
+        """Return (count, tokens): how many leading rows fit within max_tokens, and the tokens they use. Tokens are counted a batch at a time, then row by row within the batch where the cutoff falls."""
+
+        def tokens(rows):
+            # the shared token length cache is thread-safe, so it can be used from executor threads
+            return token_lengths.message_len(self.engine, ChatMessage.user(json.dumps(rows)))
+
+        count = 0
+        used = 0
+        for start in range(0, len(rows), self.fetch_size):
+            batch = rows[start:start + self.fetch_size]
+            batch_tokens = tokens(batch)
+            if used + batch_tokens <= max_tokens:
+                count += len(batch)
+                used += batch_tokens
+                continue
+
+            for row in batch:
+                row_tokens = tokens([row])
+                if used + row_tokens > max_tokens:
+                    return count, used
+                count += 1
+                used += row_tokens
+
+        return count, used
+
+
+
+    async def _fetch_within_budget(self, query, max_tokens):
+        """Stream the records of a query, keeping a running estimate of their size. Once the rows are surely over the budget, they are only kept (up to the result store's limit) for paging; the rest of the result is then discarded on the server.
+        The rows are tokenized afterwards, in an executor thread, to find exactly how many fit the budget.
+        Returns (rows within the budget, overflow rows, whether the whole result was read).
+        Literals are lifted into parameters so Neo4j can reuse cached plans across entities. Queries are checked against their EXPLAIN plan first (raising QueryRejected if too expensive) and run under the guard's transaction timeout.
+        Results are served from and saved to the process-wide query cache."""
+
+        parameterized, parameters = parameterize(query)
+
+        # a rebuild of the graph is noticed within schema_snapshot.CHECK_INTERVAL seconds, dropping cached results
+        schema_snapshot.refresh()
+        cache_key = query_cache.make_key(parameterized, parameters, max_tokens = max_tokens, max_rows = self.result_store.max_rows)
+        if (cached := query_cache.get(cache_key)) is not None:
+            return cached
+
+        # this runs on the background loop shared by every session's queries, so rows are not tokenized here
+        max_chars = max_tokens * self.max_chars_per_token
+
+        async def work(driver):
+            rows = []
+            chars = 0
+            started = time.perf_counter()
+
+            async with driver.session(fetch_size = self.fetch_size) as session:
+                # pre-flight: EXPLAIN only plans the query, it does not run it
+                explain = await session.run(Query(f"EXPLAIN {parameterized}", timeout = query_guard.tx_timeout), parameters)
+                query_guard.check_plan((await explain.consume()).plan, parameterized)
+
+                result = await session.run(Query(parameterized, timeout = query_guard.tx_timeout), parameters)
+                complete = False
+                async for record in result:
+                    rows.append(record.data())
+                    if chars <= max_chars:
+                        chars += len(json.dumps(rows[-1], default = str))
+                    elif len(rows) >= self.result_store.max_rows:
+                        break
+                else:
+                    complete = True
+
+                # consume() discards any records not yet pulled, cancelling the rest of the server-side cursor
+                summary = await result.consume()
+                plan_reuse.record(query, parameterized, summary.result_available_after or 0)
+
+                # the server's own timings (in ms) separate planning and execution from transfer and tokenization
+                telemetry.record("neo4j.query", time.perf_counter() - started, self.metrics)
+                telemetry.record("neo4j.available_after", (summary.result_available_after or 0) / 1000, self.metrics)
+                telemetry.record("neo4j.consumed_after", (summary.result_consumed_after or 0) / 1000, self.metrics)
+
+            return rows, complete
+
+        rows, complete = await kg_driver.run(work)
+        count, _ = await asyncio.get_running_loop().run_in_executor(None, self._fit_rows, rows, max_tokens)
+        fetched = rows[:count], rows[count:], complete
+        query_cache.put(cache_key, fetched)
+        return fetched
 
 
 
 class MonarchAgent(KGAgent):
-    """Agent for interacting with the Monarch knowledge graph; extends KGAgent with keyword search (using Monarch API) system prompt with cypher examples."""
+    """Agent for interacting with the Monarch knowledge graph; extends KGAgent with keyword search (using the Monarch API or a local index) system prompt with cypher examples."""
     def __init__(self, engine):
 
+        # the prompt, examples and retriever are built once per process (see _monarch_prompt_assets)
+        system_prompt, competency_questions, self.example_retriever = _monarch_prompt_assets(_kg_summary())
+
+        # only the examples most relevant to each question are included in the prompt, see _set_examples()
+        self.n_examples = 3
+
+        super().__init__(engine, system_prompt = system_prompt)
+
+        # prompt tokens per completion saved by not including every example (see get_model_completion);
+        # counting the full set is deferred to the first round, so creating the agent stays cheap
+        self.competency_questions = competency_questions
+        self.example_tokens_all = None
+        self.example_tokens_saved = 0
+
+
+
+    async def full_round(self, query, **kwargs):
+        """Selects the examples for this question before running the round."""
+        self._set_examples(query)
+        async for message in super().full_round(query, **kwargs):
+            yield message
+
+
+
+    async def get_model_completion(self, include_functions: bool = True, **kwargs):
+        """Also tracks the prompt tokens saved by example retrieval."""
+        completion = await super().get_model_completion(include_functions, **kwargs)
+        self.tokens_saved_prompt += self.example_tokens_saved
+        return completion
+
+
+
+    def _set_examples(self, question):
+        """Put the examples most relevant to the question in the always-included messages, after the system prompt."""
+        examples_message = _examples_message(self.example_retriever.top_k(question, self.n_examples))
+        self.always_included_messages = [ChatMessage.system(self.system_prompt), examples_message]
+        if self.example_tokens_all is None:
+            self.example_tokens_all = self.message_token_len(_examples_message(self.competency_questions))
+        self.example_tokens_saved = self.example_tokens_all - self.message_token_len(examples_message)
+
+
+    @ai_function()
+    async def search(self, 
+               search_terms: Annotated[List[str], AIParam(desc="Search terms to look up in the database.")],):
+        """Search for nodes matching one or more terms. Each term is searched separately."""
+
+        # the backend (Monarch API, local index or Neo4j full-text index) is configured in monarch_search.py
+        results = await monarch_search.search(search_terms)
+
+        # again, if self.message_token_len reports more than 10000 tokens in the result, we need to ask the agent to make the request smaller
+        tokens = self.message_token_len(ChatMessage.user(json.dumps(results)))
+        if tokens > self.max_response_tokens:
+            return f"ERROR: The result contained {tokens} tokens, greater than the maximum allowable of {self.max_response_tokens}. Please try a smaller search."
+        else:
+            return results        
+
+
+
+    @ai_function()
+    async def subclass_hierarchy(self,
+                                 id: Annotated[str, AIParam(desc="Identifier of the entity, e.g. MONDO:0005148.")],
+                                 direction: Annotated[str, AIParam(desc="'ancestors' (more general classes) or 'descendants' (more specific classes).")],
+                                 max_depth: Annotated[int, AIParam(desc="Only include classes at most this many subclass_of steps away; 0 for all.")] = 0,):
+        """List all ancestors or descendants of an entity in the biolink:subclass_of hierarchy, with their depth, nearest first. Much faster than a variable-length subclass_of query."""
+        index = hierarchy_index.get_index()
+        if index is None:
+            return "ERROR: The hierarchy index is not available; use a `biolink:subclass_of` query instead."
+        if direction not in ("ancestors", "descendants"):
+            return "ERROR: direction must be 'ancestors' or 'descendants'."
+
+        related = index.ancestors(id, max_depth) if direction == "ancestors" else index.descendants(id, max_depth)
+        if related is None:
+            return f"ERROR: {id!r} is not part of a subclass_of hierarchy; check the identifier with search."
+        return self._hierarchy_result(related)
+
 
-        competency_questions = json.load(open("monarch_competency_questions_1.json", "r")) # list of dict
-        # keep only question, search_terms, and query
-        competency_questions = [{k: v for k, v in cq.items() if k in ["question", "search_terms", "query"]} for cq in competency_questions]
 
-        # read contents of kg_summary.md into a string for inclusion into the markdown below
-        with open("kg_summary.md", "r") as f:
-            kg_summary = f.read()
+    @ai_function()
+    async def shared_ancestors(self, ids: Annotated[List[str], AIParam(desc="Identifiers of two or more entities.")],):
+        """List the classes that all the given entities are subclasses of (in the biolink:subclass_of hierarchy), most specific first, with each entity's depth below them."""
+        index = hierarchy_index.get_index()
+        if index is None:
+            return "ERROR: The hierarchy index is not available; use a `biolink:subclass_of` query instead."
+
+        shared = index.shared_ancestors(ids)
+        if shared is None:
+            return f"ERROR: Not all of {ids} are part of a subclass_of hierarchy; check the identifiers with search."
+        return self._hierarchy_result(shared)
+
+
+
+    def _hierarchy_result(self, rows):
+        """Format hierarchy rows like query results, cut to the token budget."""
+        count, _ = self._fit_rows(rows, self.max_response_tokens)
+        result = json.dumps(compact_rows(rows[:count]))
+        if count < len(rows):
+            return f"{result}\n\nNOTE: Only the nearest {count} of {len(rows)} classes fit within the maximum allowable of {self.max_response_tokens} tokens; use max_depth to narrow the request."
+        return result
+
+
+
+
+def _kg_summary():
+    """Summary of the graph's schema for prompts: generated from the schema snapshot, or the hand-written kg_summary.md until it is loaded or if the graph can't be reached."""
+    if (summary := schema_snapshot.get_summary()) is not None:
+        return summary
+    return assets.load_text("kg_summary.md")
+
+
+
+@assets.memoize_on_files("monarch_competency_questions_1.json")
+def _monarch_prompt_assets(kg_summary):
+    """Build MonarchAgent's system prompt, examples and example retriever; cached per process until the files (or the schema summary) change."""
 
-        system_prompt = f"""
+    competency_questions = assets.load_json("monarch_competency_questions_1.json") # list of dict
+    # keep only question, search_terms, and query
+    competency_questions = [{k: v for k, v in cq.items() if k in ["question", "search_terms", "query"]} for cq in competency_questions]
+
+    system_prompt = f"""
 # Overview
 
 You are the Monarch Assistant, designed to assist users in exploring and intepreting a biomedical knowledge graph known as Monarch.
@@ -73,56 +366,31 @@ When users present questions, you'll typically first search for relevant identif
 
 # Examples
 
-Here are some example questions, searches, and cypher queries:
-
-```
-{json.dumps(competency_questions, indent=4)}
-```
+Example questions, searches, and cypher queries relevant to the user's current question are given in the next system message.
 
 # Key Points
 
 Working with the data:
 - Carefully select entries from search results, as they may not be optimally ordered. 
 - Remember that many entities are part of a `biolink:subclass_of` hierarchy, and use this information when appropriate.
+- To find the ancestors or descendants of an entity in that hierarchy, or the classes two entities share, use `subclass_hierarchy` and `shared_ancestors` rather than variable-length `biolink:subclass_of*` queries; their identifiers can then be used in queries.
 - Design queries to answer users' questions accurately but efficiently. Use `LIMIT` and `SKIP` clauses to limit the number of results returned, and limit the number of simultaneous queries.
+- When a question needs several independent queries, run them together with `query_kg_batch` rather than one at a time.
 - Always define variables for queries, and include all necessary variables in WITH clauses.
 
 Interacting with the user:
 - Always provide non-specialist descriptions of entity names or specialized vocabulary.
 - Include links in the format [Entity Name](https://monarchinitiative.org/entity_id).
 - Refuse to answer questions not related to biomedical information or the Monarch knowledge graph.
-                                         """.strip()
-                
-        super().__init__(engine, system_prompt = system_prompt)
+                                     """.strip()
 
+    return system_prompt, competency_questions, ExampleRetriever(competency_questions)
 
-    @ai_function()
-    def search(self, 
-               search_terms: Annotated[List[str], AIParam(desc="Search terms to look up in the database.")],):
-        """Search for nodes matching one or more terms. Each term is searched separately."""
 
-        # single query endpoint url is e.g. https://api-v3.monarchinitiative.org/v3/api/search?q=cystic%20fibrosis&limit=10&offset=0
-        # use httpx for each search term
-        # return the results as a list of dictionaries
 
-        results = {}
 
-        for term in search_terms:
-            url = f"https://api-v3.monarchinitiative.org/v3/api/search?q={term}&limit=5&offset=0"
-            response = httpx.get(url)
-            resp_json = response.json()
-            items_slim = []
-            if 'items' in resp_json:
-                for item in resp_json['items']:
-                    items_slim.append({k: v for k, v in item.items() if k in ['id', 'category', 'name', 'in_taxon_label']})
-            results[term] = items_slim
-
-        # again, if self.message_token_len reports more than 10000 tokens in the result, we need to ask the agent to make the request smaller
-        tokens = self.message_token_len(ChatMessage.user(json.dumps(results)))
-        if tokens > self.max_response_tokens:
-            return f"ERROR: The result contained {tokens} tokens, greater than the maximum allowable of {self.max_response_tokens}. Please try a smaller search."
-        else:
-            return results        
+def _examples_message(examples):
+    return ChatMessage.system(f"Here are some example questions, searches, and cypher queries:\n\n```\n{json.dumps(examples, indent=4)}\n```")
 
 
 
@@ -145,10 +413,13 @@ class ExplorerAgent(KGAgent):
                                         - Always include any identifiers in query results, for use in followup queries.
                                                                                  
                                         The user will be prompted to see if they want to begin. If they answer yes, you should begin by:
-                                        - Listing the node labels and relationship types
-                                        - Sampling a few nodes and relationships of each type to see properties and values
+                                        - Summarizing the node labels and relationship types from the schema below (there is no need to query for them)
+                                        - Sampling nodes and relationships only for details the schema doesn't cover, such as typical property values
                                         """).strip()
 
+        # the schema snapshot replaces the agent's opening probes for labels, relationship types and properties
+        system_message += "\n\n# Graph Schema\n\n" + _kg_summary()
+
 
         super().__init__(engine, system_prompt = system_message)
     
@@ -175,41 +446,12 @@ class ExplorerAgent(KGAgent):
                                        ):
         """Given a competency question, a query that should be able to help answer the question, and an expected answer, runs an independent test to see if the query can be used to answer the question. If successful, the question, query, and expected answer are saved to the set of validated competency questions. If not successful, returns information for further iteration."""
 
-        ## first, run the question and query by a naive answering agent
-        answer_agent = TestQuestionAgent(self.engine)
-        messages = answer_agent.full_round(textwrap.dedent(f"""
-                                                            Consider the following question: {question}
+        evaluation, prompt_tokens, completion_tokens = await evaluate_competency_question(self.engine, question, query, expected_answer, session = self.llm_session)
 
-                                                            Answer this question by running the following query: {query}
-                                                            """).strip())
-        
         ## if we want to keep track of token usage, we have to account for sub-agent costs
-        self.tokens_used_completion += answer_agent.tokens_used_completion
-        self.tokens_used_prompt += answer_agent.tokens_used_prompt
-
-        messages_data = [x.model_dump() async for x in messages]
-
-        ## now we'll check the answer against the expected answer, providing the messages that were sent to the naive answering agent
-        answer_eval_agent = AnswerEvalAgent(self.engine)
-        messages = answer_eval_agent.full_round(textwrap.dedent(f"""
-                                                                Consider the following question: {question}
+        self.tokens_used_prompt += prompt_tokens
+        self.tokens_used_completion += completion_tokens
 
-                                                                The expected answer is: {expected_answer}
-
-                                                                An attempt to answer this question was made in the following JSON-encoded exchange: {messages_data}
-
-                                                                Please provide feedback on the answer.
-                                                                """))
-        self.tokens_used_completion += answer_eval_agent.tokens_used_completion
-        self.tokens_used_prompt += answer_eval_agent.tokens_used_prompt
-        
-        messages_data = [x.model_dump() async for x in messages]
-
-        # the eval agent will be instructed to call a function to provide feedback, which provides a stronger guarantee of formatting
-        # (though newer openai models now do JSON mode, so this may not be necessary in the future)
-        # but kani's full-round will also include the summary from the agent of the call
-        # so the second to last will have the result of the function call, which contains the structured data we want
-        evaluation = messages_data[-2]['content']
         eval_data = json.loads(evaluation)
         if eval_data['accept']:
             # save the question, query, and expected answer to the set of validated competency questions
@@ -224,6 +466,49 @@ class ExplorerAgent(KGAgent):
 
 
 
+async def evaluate_competency_question(engine, question, query, expected_answer, session = None):
+    """Independently test a competency question: a naive TestQuestionAgent answers the question by running the query, then an AnswerEvalAgent judges the answer against the expected one.
+    Their model requests are queued as background work of the given llm_scheduler session (e.g. that of the agent asking).
+    Returns (evaluation, prompt tokens, completion tokens), where evaluation is the JSON-encoded {"feedback", "accept"} from the eval agent."""
+
+    ## first, run the question and query by a naive answering agent
+    answer_agent = TestQuestionAgent(engine)
+    answer_agent.llm_session = session
+    messages = answer_agent.full_round(textwrap.dedent(f"""
+                                                        Consider the following question: {question}
+
+                                                        Answer this question by running the following query: {query}
+                                                        """).strip())
+    messages_data = [x.model_dump() async for x in messages]
+
+    ## now we'll check the answer against the expected answer, providing the messages that were sent to the naive answering agent
+    answer_eval_agent = AnswerEvalAgent(engine)
+    answer_eval_agent.llm_session = session
+    messages = answer_eval_agent.full_round(textwrap.dedent(f"""
+                                                            Consider the following question: {question}
+
+                                                            The expected answer is: {expected_answer}
+
+                                                            An attempt to answer this question was made in the following JSON-encoded exchange: {messages_data}
+
+                                                            Please provide feedback on the answer.
+                                                            """))
+    messages_data = [x.model_dump() async for x in messages]
+
+    # the eval agent will be instructed to call a function to provide feedback, which provides a stronger guarantee of formatting
+    # (though newer openai models now do JSON mode, so this may not be necessary in the future)
+    # but kani's full-round will also include the summary from the agent of the call
+    # so the second to last will have the result of the function call, which contains the structured data we want
+    evaluation = messages_data[-2]['content']
+
+    ## token usage is only known once the rounds have been consumed
+    prompt_tokens = answer_agent.tokens_used_prompt + answer_eval_agent.tokens_used_prompt
+    completion_tokens = answer_agent.tokens_used_completion + answer_eval_agent.tokens_used_completion
+    return evaluation, prompt_tokens, completion_tokens
+
+
+
+
 class TestQuestionAgent(KGAgent):
     """Naive KG-enabled agent for testing competency questions by running the corresponding query and summarizing the results."""
     def __init__(self, engine):
@@ -233,6 +518,8 @@ class TestQuestionAgent(KGAgent):
                                         """).strip()
 
         super().__init__(engine, system_prompt = system_prompt)
+        # sub-agent work waits behind interactive turns
+        self.llm_priority = llm_scheduler.BACKGROUND
 
 
 
@@ -251,6 +538,7 @@ class AnswerEvalAgent(KGAgent):
                                          """).strip()
 
         super().__init__(engine, system_prompt = system_prompt)
+        self.llm_priority = llm_scheduler.BACKGROUND
 
     @ai_function()
     def provide_feedback(self, feedback: Annotated[str, AIParam(desc="Feedback to provide to the user.")],
@@ -13,6 +13,7 @@ dotenv.load_dotenv()
 import kani_streamlit as ks
 from kani.engines.openai import OpenAIEngine
 from agents import ExplorerAgent, MonarchAgent
+import schema_snapshot
 import textwrap
 
 ########################
@@ -47,15 +48,20 @@ ks.initialize_app_config(
 # StreamlitKani agents are Kani agents and work the same
 # We must subclass StreamlitKani instead of Kani to get the Streamlit UI
 # define an engine to use (see Kani documentation for more info)
-engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model="gpt-4-1106-preview", temperature=0)
+# retry=1: failed requests are retried by the process-wide llm_scheduler, which gives up its slot while it backs off
+engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model="gpt-4-1106-preview", retry=1, temperature=0)
+
+# the graph's schema snapshot (used in the agents' prompts) is loaded in the background, once per process
+schema_snapshot.preload()
 
 
 # We also have to define a function that returns a dictionary of agents to serve
 # Agents are keyed by their name, which is what the user will see in the UI
+# "agent" can be an agent, or (as here) a function creating one, so each agent is only created when a user first selects it
 def get_agents():
     return {
         "Monarch Assistant (2.0)": {
-            "agent": MonarchAgent(engine),
+            "agent": lambda: MonarchAgent(engine),
             # The greeting is not seen by the agent, but is shown to the user to provide instructions
             "greeting": textwrap.dedent(f"""
                                         I'm the Monarch Assistant, an AI chatbot with access to the [Monarch Inititive](https://monarchinitiative.org) biomedical knowledgebase. I can search for information on diseases, genes, and phenotypes. Here are some things you might try asking:
@@ -72,7 +78,7 @@ def get_agents():
             "token_costs": {"prompt": 0.01, "completion": 0.03}
         },
         "Competency Question Agent": {
-            "agent": ExplorerAgent(engine),
+            "agent": lambda: ExplorerAgent(engine),
             # The greeting is not seen by the agent, but is shown to the user to provide instructions
             "greeting": "Hello! I am here to help you explore a neo4j graph, understand the kinds of questions it can answer and queries to answer those questions, and test those queries to develop a set of competency questions. We'll start by looking at the different kinds of nodes and relationships in the graph. Should we begin?",
             "description": "An agent for exploring Neo4j graphs, and generating and evaluating competency questions over them.",
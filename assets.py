@@ -0,0 +1,66 @@
+## Process-level cache of static assets (prompt files, example collections) and values derived from them.
+##
+## Every Streamlit session creates its own agents, but the files they read rarely change. Values are cached
+## once per process, keyed on the files' modification times and sizes, so an edited file is picked up on
+## the next access without restarting the app.
+
+import functools
+import json
+import os
+import threading
+
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def memoize_on_files(*paths):
+    """Decorator caching a function's result (per arguments) until any of the given files change."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = (func.__qualname__, args, tuple(_file_stamp(p) for p in paths))
+            with _lock:
+                if key in _cache:
+                    return _cache[key]
+
+            value = func(*args)
+            with _lock:
+                # drop values built from older versions of the files
+                for old in [k for k in _cache if k[:2] == key[:2]]:
+                    del _cache[old]
+                _cache[key] = value
+            return value
+        return wrapper
+    return decorator
+
+
+def load_text(path):
+    """Contents of a text file, cached until it changes."""
+    return memoize_on_files(path)(_read_text)(path)
+
+
+def load_json(path):
+    """Parsed contents of a JSON file, cached until it changes. Callers must not mutate the result."""
+    return memoize_on_files(path)(_read_json)(path)
+
+
+def _read_text(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def clear():
+    """Drop all cached values (e.g. for benchmarking cold starts)."""
+    with _lock:
+        _cache.clear()
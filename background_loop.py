@@ -0,0 +1,35 @@
+## A process-wide asyncio event loop running in a background thread.
+##
+## Streamlit gives every session its own event loop, but pooled async clients (the neo4j driver, httpx
+## clients) are bound to the loop they were created on. Long-lived shared clients therefore live on this
+## loop, and code on any other loop submits work to it with run(), which awaits without blocking the caller.
+
+import asyncio
+import threading
+
+
+_lock = threading.Lock()
+_loop = None
+_thread = None
+
+
+def get_loop():
+    """Return the background loop, starting it on first use."""
+    global _loop, _thread
+
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="background-loop", daemon=True)
+            _thread.start()
+        return _loop
+
+
+async def run(coro):
+    """Run a coroutine on the background loop and await its result from the current loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_loop()))
+
+
+def run_sync(coro):
+    """Blocking variant of run(), for scripts and other code outside of an event loop."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
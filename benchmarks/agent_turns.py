@@ -0,0 +1,129 @@
+## Replays the competency questions through MonarchAgent, offline: the model, Neo4j and the Monarch search API are
+## replaced by the stand-ins in benchmarks/stand_ins.py, so a run measures only our own code on the hot path
+## (prompt assembly, tokenization, tool dispatch, query guarding and caching, result formatting).
+##
+## Each simulated session is a fresh agent asking every question in turn (search, query_kg, answer); sessions run
+## concurrently. Reports throughput, p50/p95 turn latency, peak memory and tokens per turn. With --large, queries
+## lose their LIMITs and return thousands of rows, to exercise the token budget and result paging.
+##
+## Run from the repo root:
+##   python -m benchmarks.agent_turns [--sessions 8] [--concurrency 4] [--large] [--llm-latency 0.0] [--json report.json]
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+
+# agents read these at import time
+os.environ.setdefault("NEO4J_BOLT", "bolt://stand-in")
+os.environ.setdefault("MONARCH_SEARCH_BACKEND", "api")
+# the stand-in graph's schema snapshot is built afresh, away from the real one
+os.environ.setdefault("KG_SCHEMA_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "kg_schema.json"))
+
+import agents
+import kg_driver
+import schema_snapshot
+import telemetry
+from agents import MonarchAgent
+from kani_streamlit import token_lengths
+from monarch_search import MonarchSearch
+from query_cache import query_cache
+from benchmarks.stand_ins import ScriptedEngine, FakeDriver, monarch_transport
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+async def run_session(engine, questions):
+    """Ask every question of a fresh agent; returns one {seconds, prompt_tokens, completion_tokens} per turn."""
+    agent = MonarchAgent(engine)
+    turns = []
+    for question in questions:
+        prompt_before, completion_before = agent.tokens_used_prompt, agent.tokens_used_completion
+        started = time.perf_counter()
+        async for _ in agent.full_round(question["question"]):
+            pass
+        turns.append({"seconds": time.perf_counter() - started,
+                      "prompt_tokens": agent.tokens_used_prompt - prompt_before,
+                      "completion_tokens": agent.tokens_used_completion - completion_before})
+    return turns
+
+
+async def run(questions, sessions = 8, concurrency = 4, large = False, llm_latency = 0.0):
+    if large:
+        questions = [{**q, "query": re.sub(r"\s+LIMIT\s+\d+\s*$", "", q["query"], flags = re.IGNORECASE)} for q in questions]
+
+    engine = ScriptedEngine(questions, latency = llm_latency)
+    driver = FakeDriver(rows_per_query = 3000 if large else None)
+    kg_driver.set_driver(driver)
+    # agents get the snapshot's schema summary, as in the app, rather than the fallback
+    assert schema_snapshot.get_schema(wait = 60) is not None, "The schema snapshot could not be built from the stand-in driver."
+    agents.monarch_search = MonarchSearch(transport = monarch_transport())
+    query_cache.clear()
+    telemetry.process_metrics.clear()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def session():
+        async with semaphore:
+            return await run_session(engine, questions)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    turns = [turn for result in await asyncio.gather(*(session() for _ in range(sessions))) for turn in result]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = [t["seconds"] for t in turns]
+    return {
+        "sessions": sessions,
+        "turns": len(turns),
+        "seconds": elapsed,
+        "turns_per_second": len(turns) / elapsed,
+        "p50_ms": percentile(seconds, 0.5) * 1000,
+        "p95_ms": percentile(seconds, 0.95) * 1000,
+        "peak_memory_mb": peak / 2**20,
+        "prompt_tokens_per_turn": sum(t["prompt_tokens"] for t in turns) / len(turns),
+        "completion_tokens_per_turn": sum(t["completion_tokens"] for t in turns) / len(turns),
+        "model_calls": engine.calls,
+        "neo4j_queries": driver.queries,
+        "query_cache": query_cache.stats(),
+        "token_length_cache": {"hits": token_lengths.hits, "misses": token_lengths.misses},
+        "spans": telemetry.process_metrics.snapshot(),
+    }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Offline benchmark of agent turns over the competency questions.")
+    parser.add_argument("questions", nargs = "?", default = "monarch_competency_questions_1.json")
+    parser.add_argument("--sessions", type = int, default = 8)
+    parser.add_argument("--concurrency", type = int, default = 4)
+    parser.add_argument("--large", action = "store_true", help = "drop query LIMITs and serve thousands of rows per query")
+    parser.add_argument("--llm-latency", type = float, default = 0.0, help = "seconds each model completion takes")
+    parser.add_argument("--json", help = "also write the report to this file")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = json.load(f)
+
+    report = asyncio.run(run(questions, args.sessions, args.concurrency, args.large, args.llm_latency))
+    kg_driver.close()
+
+    for key in ["sessions", "turns", "seconds", "turns_per_second", "p50_ms", "p95_ms", "peak_memory_mb",
+                "prompt_tokens_per_turn", "completion_tokens_per_turn", "model_calls", "neo4j_queries"]:
+        value = report[key]
+        print(f"{key:28} {value:.2f}" if isinstance(value, float) else f"{key:28} {value}")
+    print(f"{'query cache hit rate':28} {report['query_cache']['hit_rate']:.2f}")
+    print("slowest spans (total s):", ", ".join(f"{name} {s['total_s']:.2f}" for name, s in list(report["spans"].items())[:6]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent = 2)
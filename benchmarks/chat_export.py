@@ -0,0 +1,104 @@
+## Measures exporting and importing large chat transcripts: the old way (each agent saved to a temp file with
+## kani's save(), read back and re-serialized; the reverse on import) vs. export_chats()/parse_chats(), which
+## serialize straight from and into the agents' state, optionally gzipped; and write_sessions()/read_sessions(),
+## which stream many sessions' chats to and from a file.
+##
+## Runs offline, on synthetic transcripts. Run from the repo root:
+##   python -m benchmarks.chat_export [messages per agent]
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from kani import ChatMessage
+from kani.engines.base import BaseEngine, Completion
+from kani_streamlit import StreamlitKani, export_chats, parse_chats, write_sessions, read_sessions
+
+
+class _Engine(BaseEngine):
+    """Just enough of an engine to create agents; nothing is sent to a model, and any prediction is a canned reply."""
+    max_context_size = 128000
+
+    def message_len(self, message):
+        return len(message.text or "") // 4
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        message = ChatMessage.assistant("OK.")
+        return Completion(message, prompt_tokens = sum(self.message_len(m) for m in messages), completion_tokens = self.message_len(message))
+
+
+def make_agent(engine, n_messages):
+    agent = StreamlitKani(engine, system_prompt = "You have access to a neo4j knowledge graph.")
+    rows = [{"g.id": f"HGNC:{i}", "g.name": f"gene {i}", "d.id": f"MONDO:{i}", "d.name": f"disease {i}"} for i in range(200)]
+    for i in range(n_messages // 2):
+        agent.chat_history.append(ChatMessage.user(f"Which genes are associated with disease {i}?"))
+        agent.chat_history.append(ChatMessage.function("query_kg", json.dumps(rows), tool_call_id = f"call_{i}"))
+    agent.conversation_started = True
+    return agent
+
+
+def old_export(agents):
+    temp_dir = tempfile.mkdtemp()
+    for name, agent in agents.items():
+        agent.save(os.path.join(temp_dir, name + ".json"))
+    agent_jsons = {}
+    for name in agents:
+        with open(os.path.join(temp_dir, name + ".json")) as f:
+            agent_jsons[name] = json.load(f)
+    shutil.rmtree(temp_dir)
+    return json.dumps(agent_jsons)
+
+
+def old_import(export, agents):
+    parsed = json.loads(export)
+    temp_dir = tempfile.mkdtemp()
+    for name, state in parsed.items():
+        with open(os.path.join(temp_dir, name + ".json"), "w") as f:
+            json.dump(state, f)
+    for name in parsed:
+        agents[name].load(os.path.join(temp_dir, name + ".json"))
+    shutil.rmtree(temp_dir)
+
+
+def timed(func, repeats = 5):
+    """Return (mean seconds, result of the last call)."""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - started) / repeats, result
+
+
+def main(n_messages = 2000):
+    engine = _Engine()
+    agents = {"Monarch Assistant": make_agent(engine, n_messages), "Competency Question Agent": make_agent(engine, n_messages)}
+    targets = {name: StreamlitKani(engine) for name in agents}
+
+    old_export_s, old_data = timed(lambda: old_export(agents))
+    old_import_s, _ = timed(lambda: old_import(old_data, targets))
+    print(f"{'':20} {'export ms':>10} {'import ms':>10} {'size KB':>10}")
+    print(f"{'temp files':20} {old_export_s * 1000:10.1f} {old_import_s * 1000:10.1f} {len(old_data) / 1024:10.0f}")
+
+    for label, compress in (("in memory", False), ("in memory, gzip", True)):
+        export_s, data = timed(lambda: export_chats(agents, compress))
+        import_s, _ = timed(lambda: [targets[name].load_state(state) for name, state in parse_chats(data).items()])
+        print(f"{label:20} {export_s * 1000:10.1f} {import_s * 1000:10.1f} {len(data) / 1024:10.0f}")
+
+    # bulk: the same two agents in each of n_sessions sessions, one session per line
+    n_sessions = 10
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for label, compress in (("bulk sessions", False), ("bulk sessions, gzip", True)):
+            path = os.path.join(temp_dir, "sessions.jsonl")
+            export_s, _ = timed(lambda: write_sessions(path, ((f"session {i}", agents) for i in range(n_sessions)), compress), repeats = 1)
+            import_s, sessions = timed(lambda: list(read_sessions(path)), repeats = 1)
+            assert len(sessions) == n_sessions
+            print(f"{label:20} {export_s * 1000 / n_sessions:10.1f} {import_s * 1000 / n_sessions:10.1f} {os.path.getsize(path) / 1024 / n_sessions:10.0f}  (per session)")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
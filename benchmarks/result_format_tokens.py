@@ -0,0 +1,61 @@
+## Compares the prompt tokens of plain JSON records vs. the compact encodings in result_format.py,
+## over the result sets of the competency questions' queries.
+##
+## By default it runs offline: results come from the stand-in graph in benchmarks/stand_ins.py, and tokens are
+## estimated by its ScriptedEngine (4 characters each), so runs are reproducible. With --live, the queries run
+## against the graph at NEO4J_BOLT and tokens are counted with the OpenAI tokenizer (OPENAI_API_KEY), both read
+## from the environment or .env file. Run from the repo root:
+##   python -m benchmarks.result_format_tokens [--live]
+
+import json
+import sys
+from kani import ChatMessage
+import kg_driver
+from result_format import compact_rows
+from benchmarks.stand_ins import ScriptedEngine, FakeDriver
+
+
+def fetch(query):
+    async def work(driver):
+        async with driver.session() as session:
+            result = await session.run(query)
+            return await result.data()
+
+    return kg_driver.run_sync(work)
+
+
+def main(live = False):
+    with open("monarch_competency_questions_1.json") as f:
+        competency_questions = json.load(f)
+
+    if live:
+        import dotenv
+        from kani.engines.openai import OpenAIEngine
+        dotenv.load_dotenv()
+        engine = OpenAIEngine(model="gpt-4-1106-preview")
+    else:
+        engine = ScriptedEngine(competency_questions)
+        kg_driver.set_driver(FakeDriver())
+
+    def tokens(obj):
+        return engine.message_len(ChatMessage.function("query_kg", json.dumps(obj)))
+
+    total_plain = 0
+    total_compact = 0
+    print(f"{'plain':>8} {'compact':>8} {'saved':>6}  question")
+    for cq in competency_questions:
+        rows = fetch(cq["query"])
+        if not rows:
+            continue
+        plain = tokens(rows)
+        compact = tokens(compact_rows(rows))
+        total_plain += plain
+        total_compact += compact
+        print(f"{plain:>8} {compact:>8} {1 - compact / plain:>6.1%}  {cq['question'][:80]}")
+
+    print(f"{total_plain:>8} {total_compact:>8} {1 - total_compact / total_plain:>6.1%}  TOTAL ({len(competency_questions)} questions)")
+    kg_driver.close()
+
+
+if __name__ == "__main__":
+    main(live = "--live" in sys.argv[1:])
@@ -0,0 +1,62 @@
+## Measures the cost of starting a Streamlit session's agents: the old eager behavior (every agent created,
+## prompt files read and parsed per session) vs. lazy creation with the process-level asset cache (only
+## the first agent is created, from cached prompt assets).
+##
+## Runs offline: the model and Neo4j are replaced by the stand-ins in benchmarks/stand_ins.py (no queries are run
+## per session; the stand-in graph only provides the schema snapshot, built once up front, as in the app).
+## Run from the repo root:
+##   python -m benchmarks.session_startup [sessions]
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# agents read these at import time
+os.environ.setdefault("NEO4J_BOLT", "bolt://stand-in")
+os.environ.setdefault("KG_SCHEMA_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "kg_schema.json"))
+
+import assets
+import kg_driver
+import schema_snapshot
+from agents import MonarchAgent, ExplorerAgent
+from benchmarks.stand_ins import ScriptedEngine, FakeDriver
+
+
+def measure(start_session, sessions):
+    """Return (mean seconds per session, peak bytes allocated per session)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    agents = [start_session() for _ in range(sessions)]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del agents
+    return elapsed / sessions, peak / sessions
+
+
+def main(engine, sessions = 20):
+    def eager():
+        # before: no shared assets, and every agent is created up front
+        assets.clear()
+        return [MonarchAgent(engine), ExplorerAgent(engine)]
+
+    def lazy():
+        # after: only the agent shown first is created, from cached assets
+        return [MonarchAgent(engine)]
+
+    lazy()  # warm the asset cache, as the first session in the process would
+    for name, start_session in [("eager, uncached", eager), ("lazy, cached", lazy)]:
+        seconds, peak = measure(start_session, sessions)
+        print(f"{name:>16}: {seconds * 1000:8.2f} ms/session, {peak / 1024:8.1f} KiB/session ({sessions} sessions)")
+
+
+if __name__ == "__main__":
+    with open("monarch_competency_questions_1.json") as f:
+        questions = json.load(f)
+
+    kg_driver.set_driver(FakeDriver())
+    assert schema_snapshot.get_schema(wait = 60) is not None, "The schema snapshot could not be built from the stand-in driver."
+    main(ScriptedEngine(questions), int(sys.argv[1]) if len(sys.argv) > 1 else 20)
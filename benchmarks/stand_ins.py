@@ -0,0 +1,213 @@
+## Local stand-ins for the services the agents use, so they can be run and measured offline:
+##   ScriptedEngine  - a kani engine that replays a competency question's search, query and answer as tool calls
+##   FakeDriver      - an in-process neo4j AsyncDriver serving canned results (optionally large ones), and a small canned
+##                     schema for schema_snapshot's introspection queries
+##   monarch_transport() - an httpx.MockTransport answering Monarch search API requests
+## Results are deterministic (derived from the query or term), so runs are comparable.
+
+import asyncio
+import hashlib
+import itertools
+import json
+import re
+import httpx
+from kani import ChatMessage, ChatRole
+from kani.engines.base import BaseEngine, Completion
+from kani.models import FunctionCall, ToolCall
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size = 4).digest(), "big")
+
+
+
+class ScriptedEngine(BaseEngine):
+    """Answers each user question by calling search (with its search terms), then query_kg (with its query), then summarizing.
+    The script for a question is looked up by its text; unknown questions are answered directly. Tokens are estimated at 4 characters each."""
+
+    max_context_size = 128000
+
+    def __init__(self, questions, latency = 0.0):
+        self.scripts = {q["question"]: q for q in questions}
+        self.latency = latency
+        self.calls = 0
+
+
+    def message_len(self, message):
+        text = message.text or ""
+        if message.tool_calls:
+            text += "".join(tc.function.name + tc.function.arguments for tc in message.tool_calls)
+        return 4 + len(text) // 4
+
+
+    def function_token_reserve(self, functions):
+        return sum(len(f.name) + len(f.desc) for f in functions) // 4 if functions else 0
+
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        # where we are in the round: the number of tool results since the user's question
+        question = next((m.text for m in reversed(messages) if m.role == ChatRole.USER), "")
+        step = 0
+        for m in reversed(messages):
+            if m.role == ChatRole.USER:
+                break
+            step += m.role == ChatRole.FUNCTION
+
+        script = self.scripts.get(question)
+        function_names = {f.name for f in functions or []}
+        if script and step == 0 and "search" in function_names:
+            message = _tool_call("search", search_terms = script.get("search_terms", []))
+        elif script and step <= 1 and "query_kg" in function_names:
+            message = _tool_call("query_kg", query = script["query"])
+        else:
+            message = ChatMessage.assistant(script["expected_answer"] if script else "I don't know.")
+
+        prompt_tokens = sum(self.message_len(m) for m in messages) + self.function_token_reserve(functions)
+        return Completion(message, prompt_tokens = prompt_tokens, completion_tokens = self.message_len(message))
+
+
+def _tool_call(name, **kwargs):
+    call = ToolCall.from_function_call(FunctionCall.with_args(name, **kwargs), f"call_{name}_{_seed(json.dumps(kwargs))}")
+    return ChatMessage.assistant(None, tool_calls = [call])
+
+
+
+class _Record:
+    def __init__(self, data):
+        self._data = data
+
+    def data(self):
+        return dict(self._data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+class _Summary:
+    def __init__(self, plan, available_after, consumed_after):
+        self.plan = plan
+        self.result_available_after = available_after
+        self.result_consumed_after = consumed_after
+
+
+class _Result:
+    def __init__(self, rows, plan = None):
+        self._rows = iter(rows)
+        self._plan = plan
+        self._consumed = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            row = next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+        self._consumed += 1
+        return _Record(row)
+
+    async def fetch(self, n):
+        rows = list(itertools.islice(self._rows, n))
+        self._consumed += len(rows)
+        return [_Record(row) for row in rows]
+
+    async def data(self):
+        return [record.data() async for record in self]
+
+    async def single(self):
+        records = [record async for record in self]
+        return records[0] if len(records) == 1 else None
+
+    async def consume(self):
+        return _Summary(self._plan, 1, self._consumed // 100)
+
+
+class _Session:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def run(self, query, parameters = None, **kwargs):
+        text = getattr(query, "text", query)
+        parameters = {**(parameters or {}), **kwargs}
+        self.driver.queries += 1
+        if text.lstrip().upper().startswith("EXPLAIN"):
+            return _Result([], plan = {"operatorType": "ProduceResults@neo4j", "args": {"EstimatedRows": 10.0}, "children": []})
+        if (rows := _schema_rows(text)) is not None:
+            return _Result(rows)
+        return _Result(self.driver.rows_for(text, parameters))
+
+
+
+# the canned schema: labels with their properties, and relationship types with the labels they connect
+_LABELS = {"biolink:Gene": ["id", "name", "category", "in_taxon_label"], "biolink:Disease": ["id", "name", "category"],
+           "biolink:PhenotypicFeature": ["id", "name", "category"]}
+_RELATIONSHIPS = {"biolink:causes": ("biolink:Gene", "biolink:Disease"), "biolink:has_phenotype": ("biolink:Disease", "biolink:PhenotypicFeature"),
+                  "biolink:subclass_of": ("biolink:Disease", "biolink:Disease")}
+
+
+def _schema_rows(text):
+    """Rows answering one of schema_snapshot's introspection queries, or None for any other query."""
+    if "db.labels()" in text:
+        return [{"label": label} for label in _LABELS]
+    if "db.relationshipTypes()" in text:
+        return [{"relationshipType": rel_type} for rel_type in _RELATIONSHIPS]
+    if "db.schema.nodeTypeProperties()" in text:
+        return [{"nodeLabels": [label], "propertyName": p, "propertyTypes": ["String"]} for label, properties in _LABELS.items() for p in properties]
+    if "db.schema.relTypeProperties()" in text:
+        return [{"relType": f":`{rel_type}`", "propertyName": "knowledge_source", "propertyTypes": ["String"]} for rel_type in _RELATIONSHIPS]
+    if re.search(r"RETURN count\(\w\) AS n$", text):
+        return [{"n": 1000 + _seed(text) % 1000}]
+    if "AS source" in text:
+        rel_type = re.search(r"\[r:`([^`]*)`\]", text).group(1)
+        source, target = _RELATIONSHIPS.get(rel_type, ("biolink:Gene", "biolink:Gene"))
+        return [{"source": [source, "biolink:NamedThing"], "target": [target, "biolink:NamedThing"]}] * 10
+    return None
+
+
+
+class FakeDriver:
+    """Stands in for neo4j's AsyncDriver (see kg_driver.set_driver). Every query returns rows of (id, name, category) up to its
+    LIMIT: rows_per_query of them if given, otherwise a small number derived from the query text."""
+
+    def __init__(self, rows_per_query = None):
+        self.rows_per_query = rows_per_query
+        self.queries = 0
+
+    def session(self, **kwargs):
+        return _Session(self)
+
+    def rows_for(self, text, parameters):
+        count = self.rows_per_query or 1 + _seed(text) % 40
+        if match := re.search(r"\bLIMIT\s+(\$\w+|\d+)", text, re.IGNORECASE):
+            limit = match.group(1)
+            count = min(count, int(parameters.get(limit[1:], count) if limit.startswith("$") else limit))
+        base = _seed(text)
+        return ({"id": f"HGNC:{base + i}", "name": f"gene {base + i}", "category": "biolink:Gene"} for i in range(count))
+
+    async def close(self):
+        pass
+
+
+
+def monarch_transport(items_per_term = 5):
+    """An httpx transport answering Monarch search API requests with canned items for the query term."""
+
+    def handler(request):
+        term = request.url.params.get("q", "")
+        base = _seed(term)
+        items = [{"id": f"MONDO:{base + i:07d}", "category": "biolink:Disease", "name": f"{term} {i}", "in_taxon_label": None,
+                  "description": "A canned search result. " * 10, "xref": [f"OMIM:{base + i}"]} for i in range(items_per_term)]
+        return httpx.Response(200, json = {"items": items, "total": len(items)})
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,133 @@
+## Process-wide structured log of chat activity, written off the chat's hot path.
+##
+## Callers only put a log record on a queue (log() does no serialization or I/O); a background listener thread
+## turns records into JSON lines, truncating long strings (e.g. large function results), and writes them out.
+## Chat messages are immutable, so they can be passed to the listener as-is and dumped there.
+##
+## Configuration (via environment / .env file):
+##   CHAT_LOG_FILE        - file to append JSON lines to (default: stderr)
+##   CHAT_LOG_MAX_CHARS   - strings longer than this are truncated (default 2000)
+##   CHAT_LOG_QUEUE_SIZE  - max records waiting to be written; further records are dropped and counted (default 10000)
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+
+def truncate(value, max_chars):
+    """Copy of a JSON-like value with strings longer than max_chars cut short."""
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}... [truncated {len(value) - max_chars} characters]"
+    if isinstance(value, dict):
+        return {k: truncate(v, max_chars) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(v, max_chars) for v in value]
+    return value
+
+
+
+class JSONLineFormatter(logging.Formatter):
+    """Formats a record as one JSON object: time, level, event (the log message) and the record's fields (pydantic models are dumped)."""
+
+    def __init__(self, max_chars = 2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            if hasattr(value, "model_dump"):
+                value = value.model_dump(mode = "json")
+            entry[key] = truncate(value, self.max_chars)
+        return json.dumps(entry, default = str)
+
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records untouched (the default formats them in the caller's thread), and drops them if the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Waits for room in a full queue to signal the writer thread to stop, rather than raising queue.Full (and never stopping it)."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+
+class ChatLog:
+    """A logger whose records are written by a background thread; see module comments."""
+
+    def __init__(self, stream = None, path = None, max_chars = 2000, queue_size = 10000):
+        handler = logging.FileHandler(path) if path else logging.StreamHandler(stream)
+        handler.setFormatter(JSONLineFormatter(max_chars))
+
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._queue_handler = _QueueHandler(self._queue)
+        self._listener = _QueueListener(self._queue, handler)
+        self._started = False
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"{__name__}.{id(self)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self._queue_handler)
+
+
+    def log(self, event, level = logging.INFO, **fields):
+        """Queue a record of event with the given fields (JSON-like values or pydantic models, e.g. a ChatMessage)."""
+        if not self._started:
+            self.start()
+        self.logger.log(level, event, extra = {"fields": fields})
+
+
+    @property
+    def dropped(self):
+        """Records dropped because the queue was full."""
+        return self._queue_handler.dropped
+
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self._listener.start()
+                self._started = True
+
+
+    def stop(self):
+        """Write out queued records and stop the writer thread."""
+        with self._lock:
+            if self._started:
+                self._listener.stop()
+                self._started = False
+
+
+
+# the process-wide chat log
+chat_log = ChatLog(path = os.environ.get("CHAT_LOG_FILE"),
+                   max_chars = int(os.environ.get("CHAT_LOG_MAX_CHARS", 2000)),
+                   queue_size = int(os.environ.get("CHAT_LOG_QUEUE_SIZE", 10000)))
+atexit.register(chat_log.stop)
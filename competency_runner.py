@@ -0,0 +1,183 @@
+## Headless regression run over the competency questions (monarch_competency_questions_1.json by default).
+##
+## Each question's query is run against the knowledge graph, and the question passes if the query succeeds and
+## returns rows. With --agents, each question is also put through the same independent test as
+## ExplorerAgent.test_competency_question (TestQuestionAgent answers, AnswerEvalAgent judges), and it only
+## passes if the answer is accepted. Questions run concurrently, up to --concurrency at a time.
+##
+## Results are appended to REPORT.jsonl as each question finishes, so an interrupted run can be resumed with
+## --resume (questions that already have a result in the file are skipped; those that ended in an error are run
+## again); at the end REPORT.json (summary and results) and
+## REPORT.csv are written.
+##
+## Usage (from the repo root, with NEO4J_BOLT, and OPENAI_API_KEY for --agents, set):
+##   python competency_runner.py [--agents] [--concurrency 4] [--resume] [--out competency_report] [QUESTIONS.json]
+##
+## To run without a database or model, call kg_driver.set_driver() with a stand-in driver and pass
+## run_questions() a stand-in engine.
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from neo4j import Query
+import kg_driver
+from query_guard import query_guard
+
+
+# the most rows fetched per query; the runner only needs to know that a query answers something
+MAX_ROWS = 1000
+
+# report columns, in CSV order
+FIELDS = ["key", "question", "status", "rows", "query_ms", "agent_ms", "prompt_tokens", "completion_tokens", "accepted", "error", "feedback"]
+
+
+def question_key(question):
+    """Identifies a question (and its query) across runs, for resuming."""
+    text = json.dumps([question.get("question"), question.get("query")])
+    return hashlib.blake2b(text.encode(), digest_size = 8).hexdigest()
+
+
+async def run_query(query, max_rows = MAX_ROWS):
+    """Run a query on the shared driver; returns (number of rows, at most max_rows, milliseconds taken)."""
+
+    async def work(driver):
+        started = time.perf_counter()
+        async with driver.session() as session:
+            result = await session.run(Query(query, timeout = query_guard.tx_timeout))
+            records = await result.fetch(max_rows)
+            await result.consume()
+        return len(records), (time.perf_counter() - started) * 1000
+
+    return await kg_driver.run(work)
+
+
+async def run_question(question, engine = None):
+    """Run one competency question; returns its report entry (see FIELDS)."""
+    entry = {"key": question_key(question), "question": question["question"], "status": "fail"}
+
+    try:
+        entry["rows"], entry["query_ms"] = await run_query(question["query"])
+    except Exception as e:
+        entry.update(status = "error", error = f"{type(e).__name__}: {e}")
+        return entry
+
+    if engine is not None:
+        # imported here so the query-only mode doesn't need the agents' dependencies (streamlit, prompt assets)
+        from agents import evaluate_competency_question
+
+        started = time.perf_counter()
+        try:
+            evaluation, entry["prompt_tokens"], entry["completion_tokens"] = await evaluate_competency_question(engine, question["question"], question["query"], question.get("expected_answer", ""))
+            eval_data = json.loads(evaluation)
+            entry["accepted"] = bool(eval_data["accept"])
+            entry["feedback"] = eval_data["feedback"]
+        except Exception as e:
+            entry.update(status = "error", error = f"{type(e).__name__}: {e}")
+            return entry
+        finally:
+            entry["agent_ms"] = (time.perf_counter() - started) * 1000
+
+    if entry["rows"] > 0 and entry.get("accepted", True):
+        entry["status"] = "pass"
+    return entry
+
+
+def _read_log(path):
+    """Report entries already in a run's log, keyed by question key; a question's last entry wins."""
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                # the last line may be partial if the run was killed mid-write
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[entry["key"]] = entry
+    return done
+
+
+async def run_questions(questions, report = "competency_report", engine = None, concurrency = 4, resume = False, on_result = None):
+    """Run the questions, at most concurrency at a time, writing report.jsonl as they finish and report.json/report.csv at the end.
+    If engine is given, the agents' test is run too. With resume, questions that already have a pass or fail result in report.jsonl
+    are not run again (those that ended in an error are). on_result, if given, is called with each new entry as it finishes.
+    Returns the report: {"summary": {...}, "results": [entries, in question order]}."""
+    log_path = report + ".jsonl"
+    done = {key: entry for key, entry in _read_log(log_path).items() if entry["status"] != "error"} if resume else {}
+    if not resume and os.path.exists(log_path):
+        os.remove(log_path)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(question, log):
+        async with semaphore:
+            entry = await run_question(question, engine)
+        log.write(json.dumps(entry) + "\n")
+        log.flush()
+        done[entry["key"]] = entry
+        logging.getLogger(__name__).info(f"[{entry['status']}] {entry['question']}")
+        if on_result is not None:
+            on_result(entry)
+
+    with open(log_path, "a") as log:
+        await asyncio.gather(*(run_one(q, log) for q in questions if question_key(q) not in done))
+
+    results = [done[question_key(q)] for q in questions]
+    report_data = {"summary": summarize(results), "results": results}
+
+    with open(report + ".json", "w") as f:
+        json.dump(report_data, f, indent = 2)
+    with open(report + ".csv", "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    return report_data
+
+
+def summarize(results):
+    query_ms = sorted(r["query_ms"] for r in results if "query_ms" in r)
+    return {
+        "questions": len(results),
+        "passed": sum(r["status"] == "pass" for r in results),
+        "failed": sum(r["status"] == "fail" for r in results),
+        "errors": sum(r["status"] == "error" for r in results),
+        "query_ms_p50": query_ms[len(query_ms) // 2] if query_ms else None,
+        "query_ms_max": query_ms[-1] if query_ms else None,
+        "prompt_tokens": sum(r.get("prompt_tokens", 0) for r in results),
+        "completion_tokens": sum(r.get("completion_tokens", 0) for r in results),
+    }
+
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description = "Run the competency questions as a regression test.")
+    parser.add_argument("questions", nargs = "?", default = "monarch_competency_questions_1.json")
+    parser.add_argument("--out", default = "competency_report", help = "report path, without extension")
+    parser.add_argument("--concurrency", type = int, default = 4)
+    parser.add_argument("--agents", action = "store_true", help = "also test each question with the answer and eval agents")
+    parser.add_argument("--resume", action = "store_true", help = "skip questions already in the report's .jsonl log")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = json.load(f)
+
+    engine = None
+    if args.agents:
+        from kani.engines.openai import OpenAIEngine
+        engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model = "gpt-4-1106-preview", retry = 1, temperature = 0)
+
+    try:
+        summary = asyncio.run(run_questions(questions, args.out, engine, args.concurrency, args.resume,
+                                            on_result = lambda entry: print(f"[{entry['status']}] {entry['question']}")))["summary"]
+        print(json.dumps(summary, indent = 2))
+    finally:
+        kg_driver.close()
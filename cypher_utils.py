@@ -0,0 +1,166 @@
+## Small helpers for working with cypher query text, without a full parser.
+
+import re
+
+
+# string literals (single or double quoted, with backslash escapes), backtick-quoted names, and comments;
+# anything matched here must be left untouched when rewriting the rest of the query
+_QUOTED = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`|//[^\n]*|/\*.*?\*/""", re.DOTALL)
+
+KEYWORDS = {
+    "MATCH", "OPTIONAL", "WHERE", "RETURN", "WITH", "UNWIND", "CALL", "YIELD", "UNION", "ALL",
+    "ORDER", "BY", "ASC", "DESC", "ASCENDING", "DESCENDING", "SKIP", "LIMIT", "DISTINCT", "AS",
+    "AND", "OR", "XOR", "NOT", "IN", "IS", "NULL", "TRUE", "FALSE", "CONTAINS", "STARTS", "ENDS",
+    "CASE", "WHEN", "THEN", "ELSE", "END", "EXISTS", "EXPLAIN", "PROFILE",
+}
+
+# a keyword is a bare word, not a property (n.limit), label (:Match) or parameter ($in)
+_KEYWORD = re.compile(r"(?<![\w.:$])(" + "|".join(KEYWORDS) + r")(?!\w)", re.IGNORECASE)
+
+
+def split_quoted(query):
+    """Split a query into (text, is_quoted) segments, where quoted segments are string literals, backtick names or comments."""
+    segments = []
+    pos = 0
+    for match in _QUOTED.finditer(query):
+        if match.start() > pos:
+            segments.append((query[pos:match.start()], False))
+        segments.append((match.group(0), True))
+        pos = match.end()
+    if pos < len(query):
+        segments.append((query[pos:], False))
+    return segments
+
+
+def normalize_query(query):
+    """Normalize a query for use as a cache key: collapse whitespace, uppercase keywords, drop comments and trailing semicolons.
+    String literals and backtick-quoted names are kept verbatim."""
+    # comments become plain whitespace, merged with the unquoted text around them
+    segments = []
+    for text, quoted in split_quoted(query):
+        if quoted and text.startswith(("//", "/*")):
+            text, quoted = " ", False
+        if segments and not quoted and not segments[-1][1]:
+            segments[-1] = (segments[-1][0] + text, False)
+        else:
+            segments.append((text, quoted))
+
+    parts = []
+    for text, quoted in segments:
+        if not quoted:
+            text = _KEYWORD.sub(lambda m: m.group(1).upper(), re.sub(r"\s+", " ", text))
+        parts.append(text)
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def mask_quoted(query, fill = "_"):
+    """Return the query with the contents of string literals, backtick names and comments replaced by fill characters.
+    Positions are preserved, so matches found in the masked text can be used to edit the original."""
+    return "".join(text if not quoted else fill * len(text) for text, quoted in split_quoted(query))
+
+
+# numbers that can be lifted into parameters; the lookbehind/lookahead skip identifiers (n1, $p0) and property access.
+# The bounds of variable-length patterns ([*1..3], [* 1 .. 3]) can't be parameters, so a `*` followed by a range is
+# matched first (as group 1) and left alone; this also keeps the literal in a multiplication like `x * 2`, which is harmless.
+_NUMBER = re.compile(r"(\*\s*(?:\d+\s*)?(?:\.\.\s*(?:\d+)?)?)|(?<![\w.$])(?<!\.\.)(\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)(?![\w.])")
+_ESCAPES = {"\\": "\\", "'": "'", '"': '"', "n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+
+# tokens that delimit RETURN and WITH projections: brackets, and the keywords that start the next clause or subclause
+_CLAUSE = re.compile(r"[()\[\]{}]|(?<![\w.:$])(RETURN|WITH|WHERE|ORDER|SKIP|LIMIT|MATCH|OPTIONAL|UNWIND|CALL|YIELD|UNION|"
+                     r"CREATE|MERGE|SET|DELETE|DETACH|REMOVE|FOREACH|LOAD|USE)(?!\w)", re.IGNORECASE)
+# WITH is also part of the STARTS WITH and ENDS WITH operators
+_STRING_OPERATOR = re.compile(r"(?<![\w.:$])(?:STARTS|ENDS)\s*$", re.IGNORECASE)
+
+
+def _projection_spans(masked):
+    """Return (start, end) positions of the RETURN and WITH projections in a masked query (see mask_quoted()).
+    A projection runs to the next clause or subclause (e.g. WHERE, ORDER BY) at its own bracket depth, so a WHERE inside
+    a list comprehension is part of it."""
+    spans = []
+    depth = 0
+    projection = None  # (start, depth) of the projection being read
+    for match in _CLAUSE.finditer(masked):
+        token = match.group(0)
+        if token in "([{":
+            depth += 1
+            continue
+        if token in ")]}":
+            depth -= 1
+            if projection is not None and depth < projection[1]:
+                spans.append((projection[0], match.start()))
+                projection = None
+            continue
+
+        keyword = token.upper()
+        if keyword == "WITH" and _STRING_OPERATOR.search(masked, 0, match.start()):
+            continue
+        if projection is not None and depth == projection[1]:
+            spans.append((projection[0], match.start()))
+            projection = None
+        if keyword in ("RETURN", "WITH") and projection is None:
+            projection = (match.end(), depth)
+
+    if projection is not None:
+        spans.append((projection[0], len(masked)))
+    return spans
+
+
+def _unescape(literal):
+    """Return the value of a cypher string literal (including its quotes), or None if it uses an unsupported escape."""
+    body = literal[1:-1]
+    value = []
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char != "\\":
+            value.append(char)
+            i += 1
+        elif body[i + 1] in _ESCAPES:
+            value.append(_ESCAPES[body[i + 1]])
+            i += 2
+        elif body[i + 1] in "uU" and re.fullmatch(r"[0-9a-fA-F]{4}", body[i + 2:i + 6]):
+            value.append(chr(int(body[i + 2:i + 6], 16)))
+            i += 6
+        else:
+            return None
+    return "".join(value)
+
+
+def parameterize(query):
+    """Lift string and numeric literals out of a query into parameters, so structurally identical queries share a plan.
+    Returns (parameterized query, parameters); repeated literals share a single parameter.
+    Literals in RETURN and WITH projections are kept: the text of an unaliased expression (e.g. count(*) > 5) is its column's name."""
+    params = {}
+    names = {}
+    spans = _projection_spans(mask_quoted(query))
+
+    def projected(position):
+        return any(start <= position < end for start, end in spans)
+
+    def param_for(value):
+        key = (type(value), value)
+        if key not in names:
+            names[key] = f"lit{len(names)}"
+            params[names[key]] = value
+        return f"${names[key]}"
+
+    def number(match, offset):
+        if match.group(1) is not None or projected(offset + match.start()):
+            return match.group(0)
+        text = match.group(0)
+        value = float(text) if any(c in text for c in ".eE") else int(text)
+        return param_for(value)
+
+    parts = []
+    offset = 0
+    for text, quoted in split_quoted(query):
+        start, offset = offset, offset + len(text)
+        if not quoted:
+            text = _NUMBER.sub(lambda match: number(match, start), text)
+        elif text[0] in "'\"" and not projected(start) and (value := _unescape(text)) is not None:
+            text = param_for(value)
+        parts.append(text)
+
+    return "".join(parts), params
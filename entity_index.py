@@ -0,0 +1,283 @@
+## A local, in-process entity search index, as an alternative to the Monarch search API.
+##
+## The index is built offline from a dump of the graph's nodes (id, name, synonym, category, in_taxon_label)
+## and stored as a directory of flat binary files, which are memory-mapped when loaded, so startup is fast
+## and the OS shares the pages between processes:
+##   meta.json       - counts and format version
+##   terms.bin/.idx  - the sorted vocabulary, and uint64 offsets of each term
+##   postings.bin/.idx - for each term, uint32 entries of (doc number << 1 | 1 if the term is in the name), and uint64 offsets
+##   deletes.bin/.idx  - the sorted deletion keys: each term of at least MIN_FUZZY_LENGTH, and each way of deleting one
+##                       of its characters
+##   deleted_terms.bin/.idx - for each deletion key, the uint32 numbers of the terms it came from
+##   docs.bin/.idx   - the slim item (JSON) for each document, and uint64 offsets
+##
+## Search matches each word of a term exactly, by prefix (the last word, as the user may still be typing) or
+## with one typo (found through the deletion keys, since two words within one edit share a key), and ranks documents by idf-weighted word matches (name matches count double), with
+## boosts for exact and prefix matches of the full name.
+##
+## Usage (from the repo root, with NEO4J_BOLT set):
+##   python entity_index.py export nodes.jsonl      # dump nodes from Neo4j
+##   python entity_index.py build nodes.jsonl index  # build the index directory
+
+import json
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from collections import defaultdict
+
+
+FORMAT_VERSION = 2
+
+# match weights by kind of match
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.5
+# at most this many vocabulary terms are considered for one prefix or fuzzy query word
+MAX_EXPANSIONS = 64
+# shorter words are only matched exactly or by prefix, as one typo would match too many terms
+MIN_FUZZY_LENGTH = 3
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _slim(node):
+    category = node.get("category")
+    if isinstance(category, list):
+        category = category[0] if category else None
+    item = {"id": node["id"], "category": category, "name": node.get("name")}
+    if node.get("in_taxon_label"):
+        item["in_taxon_label"] = node["in_taxon_label"]
+    return item
+
+
+def _synonyms(node):
+    synonyms = node.get("synonym") or []
+    if isinstance(synonyms, str):
+        synonyms = synonyms.split("|")
+    return synonyms
+
+
+def _deletion_keys(word):
+    """The word and each way of deleting one of its characters; words within one edit of each other share at least one key."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _write_blobs(path, blobs):
+    """Write byte strings to path.bin, with their uint64 offsets (plus the end offset) to path.idx."""
+    offsets = array("Q", [0])
+    with open(path + ".bin", "wb") as f:
+        for blob in blobs:
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    with open(path + ".idx", "wb") as f:
+        offsets.tofile(f)
+
+
+
+def build_index(nodes, index_dir):
+    """Build an index directory from an iterable of node dicts (id, name, synonym, category, in_taxon_label)."""
+    os.makedirs(index_dir, exist_ok = True)
+
+    postings = defaultdict(dict)  # term -> {doc number: in name}
+    docs = []
+    for node in nodes:
+        if not node.get("id") or not node.get("name"):
+            continue
+        doc = len(docs)
+        docs.append(json.dumps(_slim(node)).encode())
+
+        for term in tokenize(node["name"]):
+            postings[term][doc] = True
+        for synonym in _synonyms(node):
+            for term in tokenize(synonym):
+                postings[term].setdefault(doc, False)
+
+    terms = sorted(postings)
+    _write_blobs(os.path.join(index_dir, "terms"), (t.encode() for t in terms))
+    _write_blobs(os.path.join(index_dir, "postings"),
+                 (array("I", (doc << 1 | in_name for doc, in_name in sorted(postings[t].items()))).tobytes() for t in terms))
+    _write_blobs(os.path.join(index_dir, "docs"), docs)
+
+    deleted_terms = defaultdict(list)  # deletion key -> term numbers, in order
+    for number, term in enumerate(terms):
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for key in _deletion_keys(term):
+                deleted_terms[key].append(number)
+    keys = sorted(deleted_terms)
+    _write_blobs(os.path.join(index_dir, "deletes"), (k.encode() for k in keys))
+    _write_blobs(os.path.join(index_dir, "deleted_terms"), (array("I", deleted_terms[k]).tobytes() for k in keys))
+
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "terms": len(terms), "docs": len(docs)}, f)
+
+
+
+class _Blobs:
+    """Memory-mapped view of a .bin/.idx pair written by _write_blobs."""
+
+    def __init__(self, path):
+        self._files = [open(path + ".bin", "rb"), open(path + ".idx", "rb")]
+        # mmap can't map empty files
+        self.data = mmap.mmap(self._files[0].fileno(), 0, access = mmap.ACCESS_READ) if os.path.getsize(path + ".bin") else b""
+        self._offsets_map = mmap.mmap(self._files[1].fileno(), 0, access = mmap.ACCESS_READ)
+        self.offsets = memoryview(self._offsets_map).cast("Q")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+
+class EntityIndex:
+    """A loaded (memory-mapped) entity index; see build_index()."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Entity index in {index_dir} has format version {meta['version']}, expected {FORMAT_VERSION}; please rebuild it.")
+
+        self.terms = _Blobs(os.path.join(index_dir, "terms"))
+        self.postings = _Blobs(os.path.join(index_dir, "postings"))
+        self.docs = _Blobs(os.path.join(index_dir, "docs"))
+        self.deletes = _Blobs(os.path.join(index_dir, "deletes"))
+        self.deleted_terms = _Blobs(os.path.join(index_dir, "deleted_terms"))
+
+
+    def _lower_bound(self, key, blobs = None):
+        """Index of the first entry of sorted blobs (by default, the vocabulary) >= key."""
+        blobs = self.terms if blobs is None else blobs
+        lo, hi = 0, len(blobs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blobs[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+    def _matches(self, word, allow_prefix):
+        """Return [(term number, weight)] of vocabulary terms matching a query word."""
+        key = word.encode()
+        start = self._lower_bound(key)
+        if start < len(self.terms) and self.terms[start] == key and not allow_prefix:
+            return [(start, EXACT)]
+
+        matches = []
+        if allow_prefix:
+            i = start
+            while i < len(self.terms) and len(matches) < MAX_EXPANSIONS and self.terms[i].startswith(key):
+                matches.append((i, EXACT if self.terms[i] == key else PREFIX))
+                i += 1
+        if matches:
+            return matches
+
+        # one typo: candidate terms share a deletion key with the word; the keys over-match (e.g. two substitutions
+        # at the same position), so candidates are checked
+        if len(word) < MIN_FUZZY_LENGTH:
+            return matches
+        candidates = set()
+        for deleted in _deletion_keys(word):
+            deleted = deleted.encode()
+            i = self._lower_bound(deleted, self.deletes)
+            if i < len(self.deletes) and self.deletes[i] == deleted:
+                candidates.update(memoryview(self.deleted_terms[i]).cast("I"))
+        for number in sorted(candidates):
+            if _within_one_edit(self.terms[number], key):
+                matches.append((number, FUZZY))
+                if len(matches) >= MAX_EXPANSIONS:
+                    break
+        return matches
+
+
+    def search(self, term, limit = 5):
+        """Return up to limit slim items ({id, category, name, in_taxon_label}) best matching term."""
+        words = tokenize(term)
+        if not words:
+            return []
+
+        n_docs = max(len(self.docs), 1)
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for position, word in enumerate(words):
+            best = {}
+            for term_number, weight in self._matches(word, allow_prefix = position == len(words) - 1):
+                postings = memoryview(self.postings[term_number]).cast("I")
+                idf = math.log(1 + n_docs / len(postings))
+                for entry in postings:
+                    score = weight * idf * (2.0 if entry & 1 else 1.0)
+                    doc = entry >> 1
+                    if score > best.get(doc, 0.0):
+                        best[doc] = score
+            for doc, score in best.items():
+                scores[doc] += score
+                matched[doc] += 1
+
+        # prefer documents matching every word, then by score; only the top candidates are decoded
+        candidates = sorted(scores, key = lambda d: (matched[d], scores[d]), reverse = True)[:limit * 10]
+        query = " ".join(words)
+        ranked = []
+        for doc in candidates:
+            item = json.loads(self.docs[doc])
+            name = " ".join(tokenize(item["name"] or ""))
+            boost = 10.0 if name == query else 3.0 if name.startswith(query) else 0.0
+            # shorter names are more likely to be the entity itself rather than a subtype of it
+            ranked.append(((matched[doc], scores[doc] + boost - 0.01 * len(name)), item))
+
+        ranked.sort(key = lambda r: r[0], reverse = True)
+        return [item for _, item in ranked[:limit]]
+
+
+
+def _within_one_edit(a, b):
+    """Whether byte strings a and b differ by at most one insertion, deletion or substitution."""
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+
+def export_nodes(path):
+    """Dump the graph's named nodes to a JSON lines file, for build_index()."""
+    import kg_driver
+
+    async def work(driver):
+        async with driver.session() as session:
+            result = await session.run("MATCH (n) WHERE n.name IS NOT NULL RETURN n.id AS id, n.name AS name, n.synonym AS synonym, n.category AS category, n.in_taxon_label AS in_taxon_label")
+            with open(path, "w") as f:
+                async for record in result:
+                    f.write(json.dumps(record.data()) + "\n")
+
+    kg_driver.run_sync(work)
+    kg_driver.close()
+
+
+def _read_nodes(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv()
+
+    if len(sys.argv) == 3 and sys.argv[1] == "export":
+        export_nodes(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == "build":
+        build_index(_read_nodes(sys.argv[2]), sys.argv[3])
+    else:
+        sys.exit("usage: python entity_index.py export NODES.jsonl | build NODES.jsonl INDEX_DIR")
@@ -0,0 +1,65 @@
+## Retrieval of the competency-question examples most relevant to a user's question.
+##
+## Rather than putting every example in the system prompt (paid for on every completion of every turn),
+## MonarchAgent asks an ExampleRetriever for the top few examples for each new question. Ranking is BM25
+## over the words of each example's question and search terms; it runs locally and needs no network.
+
+import math
+import re
+from collections import Counter
+
+
+# words too common to say anything about which example is relevant
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "in", "is", "it",
+    "list", "me", "of", "on", "or", "that", "the", "their", "there", "these", "this", "to", "what", "which", "who",
+    "with", "all", "any", "known", "show", "tell", "about",
+}
+
+
+def tokenize(text):
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOPWORDS]
+
+
+
+class ExampleRetriever:
+    """BM25 ranking over a list of examples (dicts); fields names the keys whose text is indexed."""
+
+    def __init__(self, examples, fields = ("question", "search_terms"), k1 = 1.5, b = 0.75):
+        self.examples = examples
+        self.k1 = k1
+        self.b = b
+
+        self.doc_terms = []
+        for example in examples:
+            text = " ".join(" ".join(v) if isinstance(v, list) else str(v) for f in fields if (v := example.get(f)))
+            self.doc_terms.append(Counter(tokenize(text)))
+
+        self.avg_len = sum(sum(t.values()) for t in self.doc_terms) / max(len(self.doc_terms), 1)
+        df = Counter(term for terms in self.doc_terms for term in terms)
+        n = len(self.doc_terms)
+        self.idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+
+
+    def scores(self, text):
+        """BM25 score of each example for the given text."""
+        query = tokenize(text)
+        scores = []
+        for terms in self.doc_terms:
+            length = sum(terms.values())
+            score = 0.0
+            for word in query:
+                if word in terms:
+                    tf = terms[word]
+                    score += self.idf[word] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.avg_len))
+            scores.append(score)
+        return scores
+
+
+    def top_k(self, text, k = 3):
+        """The k examples most relevant to text, best first. If nothing matches, the first k examples are used, so the model always sees some."""
+        scores = self.scores(text)
+        ranked = sorted(range(len(self.examples)), key = lambda i: scores[i], reverse = True)
+        if not ranked or scores[ranked[0]] == 0:
+            return self.examples[:k]
+        return [self.examples[i] for i in ranked[:k] if scores[i] > 0]
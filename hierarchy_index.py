@@ -0,0 +1,221 @@
+## A materialized transitive closure of the graph's biolink:subclass_of hierarchies (diseases, phenotypes, ...),
+## so ancestors and descendants can be looked up without variable-length expansions in the database.
+##
+## The index is built offline from a dump of the subclass_of edges within HIERARCHY_LABELS (both ends of an edge
+## must have the same one of these labels), and stored, like entity_index.py's, as flat
+## binary files that are memory-mapped when loaded:
+##   meta.json               - counts, format version and the KG_VERSION it was built from
+##   ids.bin/.idx            - the sorted node ids (a node's number is its position)
+##   names.bin/.idx          - node names, in the same order
+##   ancestors.bin/.idx      - for each node, uint32 pairs of (ancestor number, depth), nearest first
+##   descendants.bin/.idx    - for each node, uint32 pairs of (descendant number, depth), nearest first
+## Depth is the length of the shortest subclass_of path between the two nodes. Only the edges are held in memory
+## while building; each node's closure is written out as soon as it is computed.
+##
+## Usage (from the repo root, with NEO4J_BOLT set):
+##   python hierarchy_index.py export edges.jsonl [LABEL ...]  # dump subclass_of edges from Neo4j (default HIERARCHY_LABELS)
+##   python hierarchy_index.py build edges.jsonl hierarchy_index  # build the index directory
+
+import json
+import logging
+import os
+import sys
+import threading
+from array import array
+from collections import defaultdict
+from entity_index import _Blobs, _write_blobs
+
+
+FORMAT_VERSION = 1
+
+# the hierarchies exported by default
+HIERARCHY_LABELS = ["biolink:Disease", "biolink:PhenotypicFeature"]
+
+
+def _pairs(entries):
+    return array("I", (v for entry in entries for v in entry)).tobytes()
+
+
+
+def _closure(neighbours, node):
+    """[(node number, depth)] of the nodes reachable from node through neighbours (lists of node numbers), nearest first,
+    by a breadth-first search a level at a time; cycles (which shouldn't exist) are harmless."""
+    found = []
+    seen = {node}
+    frontier = [node]
+    depth = 0
+    while frontier:
+        depth += 1
+        level = {n for current in frontier for n in neighbours[current]} - seen
+        seen |= level
+        frontier = sorted(level)
+        found.extend((n, depth) for n in frontier)
+    return found
+
+
+
+def build_index(edges, index_dir):
+    """Build an index directory from an iterable of edge dicts (child, child_name, parent, parent_name)."""
+    os.makedirs(index_dir, exist_ok = True)
+
+    names = {}
+    parents = defaultdict(set)
+    for edge in edges:
+        child, parent = edge["child"], edge["parent"]
+        if not child or not parent or child == parent:
+            continue
+        names.setdefault(child, edge.get("child_name"))
+        names.setdefault(parent, edge.get("parent_name"))
+        parents[child].add(parent)
+
+    ids = sorted(names)
+    number = {node_id: i for i, node_id in enumerate(ids)}
+    parent_numbers = [sorted(number[p] for p in parents.get(node_id, ())) for node_id in ids]
+    child_numbers = [[] for _ in ids]
+    for node, node_parents in enumerate(parent_numbers):
+        for p in node_parents:
+            child_numbers[p].append(node)
+    del parents, number
+
+    _write_blobs(os.path.join(index_dir, "ids"), (node_id.encode() for node_id in ids))
+    _write_blobs(os.path.join(index_dir, "names"), ((names[node_id] or "").encode() for node_id in ids))
+    # the closures are generated lazily, so each is written as soon as it is computed and then dropped
+    _write_blobs(os.path.join(index_dir, "ancestors"), (_pairs(_closure(parent_numbers, node)) for node in range(len(ids))))
+    _write_blobs(os.path.join(index_dir, "descendants"), (_pairs(_closure(child_numbers, node)) for node in range(len(ids))))
+
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "nodes": len(ids), "edges": sum(len(p) for p in parent_numbers),
+                   "kg_version": os.environ.get("KG_VERSION", "")}, f)
+
+
+
+class HierarchyIndex:
+    """A loaded (memory-mapped) hierarchy closure index; see build_index()."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Hierarchy index in {index_dir} has format version {meta['version']}, expected {FORMAT_VERSION}; please rebuild it.")
+        if (kg_version := os.environ.get("KG_VERSION")) and meta.get("kg_version") and meta["kg_version"] != kg_version:
+            logging.getLogger(__name__).warning(f"Hierarchy index in {index_dir} was built for graph version {meta['kg_version']}, not {kg_version}; please rebuild it.")
+
+        self.ids = _Blobs(os.path.join(index_dir, "ids"))
+        self.names = _Blobs(os.path.join(index_dir, "names"))
+        self._ancestors = _Blobs(os.path.join(index_dir, "ancestors"))
+        self._descendants = _Blobs(os.path.join(index_dir, "descendants"))
+
+
+    def number(self, node_id):
+        """The node's number, or None if it isn't in any hierarchy."""
+        key = node_id.encode()
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ids[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self.ids) and self.ids[lo] == key else None
+
+
+    def _related(self, blobs, node_id, max_depth):
+        if (node := self.number(node_id)) is None:
+            return None
+        pairs = memoryview(blobs[node]).cast("I")
+        related = []
+        for i in range(0, len(pairs), 2):
+            if max_depth and pairs[i + 1] > max_depth:
+                break  # pairs are ordered by depth
+            related.append((pairs[i], pairs[i + 1]))
+        return related
+
+
+    def node(self, number, **fields):
+        return {"id": self.ids[number].decode(), "name": self.names[number].decode() or None, **fields}
+
+
+    def ancestors(self, node_id, max_depth = None):
+        """Return [{id, name, depth}] of the node's ancestors, nearest first, or None if the node isn't in the index."""
+        related = self._related(self._ancestors, node_id, max_depth)
+        return None if related is None else [self.node(n, depth = d) for n, d in related]
+
+
+    def descendants(self, node_id, max_depth = None):
+        """Return [{id, name, depth}] of the node's descendants, nearest first, or None if the node isn't in the index."""
+        related = self._related(self._descendants, node_id, max_depth)
+        return None if related is None else [self.node(n, depth = d) for n, d in related]
+
+
+    def shared_ancestors(self, node_ids):
+        """Return [{id, name, depths}] of the ancestors shared by all the nodes (a node counts as its own ancestor, at depth 0),
+        most specific first (smallest total depth); None if any node isn't in the index."""
+        common = None
+        for node_id in node_ids:
+            if (related := self._related(self._ancestors, node_id, None)) is None:
+                return None
+            depths = dict(related)
+            depths[self.number(node_id)] = 0
+            common = {n: [d] for n, d in depths.items()} if common is None else {n: ds + [depths[n]] for n, ds in common.items() if n in depths}
+        ranked = sorted((common or {}).items(), key = lambda item: (sum(item[1]), item[0]))
+        return [self.node(n, depths = ds) for n, ds in ranked]
+
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_index():
+    """The process-wide index at KG_HIERARCHY_INDEX (default hierarchy_index), loaded on first use; None if it hasn't been built."""
+    global _index
+
+    with _lock:
+        if _index is None:
+            index_dir = os.environ.get("KG_HIERARCHY_INDEX", "hierarchy_index")
+            if os.path.exists(os.path.join(index_dir, "meta.json")):
+                _index = HierarchyIndex(index_dir)
+        return _index
+
+
+
+def export_edges(path, labels = HIERARCHY_LABELS):
+    """Dump the graph's biolink:subclass_of edges between nodes with the same one of labels to a JSON lines file, for build_index()."""
+    import kg_driver
+
+    within = " OR ".join(f"(c:{_quote(label)} AND p:{_quote(label)})" for label in labels)
+
+    async def work(driver):
+        async with driver.session() as session:
+            result = await session.run(f"MATCH (c)-[:`biolink:subclass_of`]->(p) WHERE {within} "
+                                       "RETURN DISTINCT c.id AS child, c.name AS child_name, p.id AS parent, p.name AS parent_name")
+            with open(path, "w") as f:
+                async for record in result:
+                    f.write(json.dumps(record.data()) + "\n")
+
+    kg_driver.run_sync(work)
+    kg_driver.close()
+
+
+def _quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _read_edges(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv()
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "export":
+        export_edges(sys.argv[2], sys.argv[3:] or HIERARCHY_LABELS)
+    elif len(sys.argv) == 4 and sys.argv[1] == "build":
+        build_index(_read_edges(sys.argv[2]), sys.argv[3])
+    else:
+        sys.exit("usage: python hierarchy_index.py export EDGES.jsonl [LABEL ...] | build EDGES.jsonl INDEX_DIR")
@@ -1,14 +1,27 @@
 ## Streamlit application and StreamlitKani agent sublassing Kani to use with it. See app.py and agents.py for examples.
 
 import streamlit as st
-import logging
 from kani import ChatRole, ChatMessage, Kani
 from kani.engines.base import BaseCompletion, Completion
+from kani.engines.openai import OpenAIEngine
+from kani.exceptions import HTTPException, HTTPStatusException, HTTPTimeout, MessageTooLong, WrappedCallException
+from kani.models import FunctionCall, ToolCall
+from kani.utils.typing import SavedKani
+from pydantic import BaseModel, TypeAdapter
+from typing import Dict
+import aiohttp
 import asyncio
-import tempfile
+import time
 import json
+import gzip
 import os
-import shutil
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from chat_log import chat_log
+import telemetry
+from llm_scheduler import llm_scheduler, RateLimited, TransientError, INTERACTIVE, retry_after_seconds
 
 
 class UIOnlyMessage:
@@ -27,6 +40,58 @@ class UIOnlyMessage:
         self.icon = icon
 
 
+class TokenLengthCache:
+    """
+    Process-wide, bounded cache of message token lengths, keyed by engine and a digest of the message content.
+
+    Kani's own cache is per agent and weakly keyed, so it misses for fresh copies of the same content (e.g. a
+    repeated query result, or a chat loaded from a file); this one is shared by all agents and sessions.
+    Thread-safe, so tool functions running off the main event loop can use it too.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._lengths = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def message_len(self, engine, message):
+        digest = hashlib.blake2b(message.model_dump_json().encode(), digest_size=16).digest()
+        key = (type(engine).__name__, getattr(engine, "model", None), digest)
+        with self._lock:
+            if (length := self._lengths.get(key)) is not None:
+                self._lengths.move_to_end(key)
+                self.hits += 1
+                return length
+
+        # tokenize outside the lock; a concurrent miss on the same message just does the work twice
+        with telemetry.span("tokenize"):
+            length = engine.message_len(message)
+        with self._lock:
+            self.misses += 1
+            self._lengths[key] = length
+            while len(self._lengths) > self.max_entries:
+                self._lengths.popitem(last=False)
+        return length
+
+
+token_lengths = TokenLengthCache()
+
+
+def _retryable_error(error):
+    """Translate an engine's HTTP error into the llm_scheduler's RateLimited (429) or TransientError (5xx, timeout), or None if it shouldn't be retried."""
+    if isinstance(error, HTTPTimeout):
+        return TransientError(f"Request timed out: {error}")
+    if isinstance(error, HTTPStatusException) and (error.status_code == 429 or error.status_code >= 500):
+        retry_after = retry_after_seconds(getattr(error.response, "headers", None))
+        if error.status_code == 429:
+            return RateLimited(f"Request was rate limited: {error}", retry_after)
+        return TransientError(f"Request failed with a server error: {error}", retry_after)
+    return None
+
+
+
 class StreamlitKani(Kani):
     """
     A Kani that can be used in Streamlit.
@@ -39,6 +104,48 @@ class StreamlitKani(Kani):
         self.conversation_started = False
         self.tokens_used_prompt = 0
         self.tokens_used_completion = 0
+        # subclasses that trim their prompts (e.g. by retrieving only relevant examples) can report the savings here
+        self.tokens_saved_prompt = 0
+        # running total of chat_history's tokens, see history_token_len()
+        self._counted_messages = []  # (message, tokens) for the messages in the total, in order
+        self._history_tokens = 0
+
+        # compaction of stale function results in the prompt (chat_history itself keeps the originals), see compacted_history()
+        self.compact_keep_turns = 2  # results from the last this-many user turns (at least 1, the current one) are always sent verbatim
+        self.compact_threshold_tokens = self.max_context_size // 2  # above this, all but the current turn's results are compacted
+        self.compact_min_tokens = 200  # smaller results are not worth compacting
+        self.compact_preview_chars = 300
+        self._compacted = weakref.WeakKeyDictionary()  # original message -> compacted stand-in
+        self._compaction_saved_tokens = 0
+
+        # if set to a function, assistant text is streamed to it chunk by chunk as the engine produces it
+        self.stream_callback = None
+
+        # the tool calls of one assistant message run concurrently (kani gathers them, keeping their order); these bound them
+        self.max_concurrent_calls = 4
+        self.call_timeout = 120  # seconds; a call taking longer is cancelled and reported to the model as an error
+        self._call_semaphore = None
+        # tool_call_id -> {"name", "state" (queued, running, done, failed or timed out), "started", "finished"}, for showing progress
+        self.tool_call_status = {}
+
+        # timings of this agent's spans (see telemetry.py)
+        self.metrics = telemetry.Metrics()
+
+        # completions are admitted by the process-wide llm_scheduler, fairly across sessions and by priority;
+        # the app sets llm_session to the Streamlit session id (agents without one are queued on their own)
+        self.llm_session = None
+        self.llm_priority = INTERACTIVE
+
+        # only the most recent this-many display_messages are rendered on each rerun; "load earlier" extends it
+        self.display_window = 50
+
+    def load_state(self, state: SavedKani):
+        """Like load(), but from an already parsed state (see parse_chats()); the loaded history is also shown in the chat."""
+        self.always_included_messages = state.always_included_messages
+        self.chat_history = state.chat_history
+        self.display_messages = list(state.chat_history)
+        self.conversation_started = bool(state.chat_history)
+
 
     def render_in_ui(self, data):
         """Render a dataframe in the chat window."""
@@ -46,10 +153,29 @@ class StreamlitKani(Kani):
 
 
     async def get_model_completion(self, include_functions: bool = True, **kwargs) -> BaseCompletion:
-        """Overrides the default get_model_completion to track tokens used.
+        """Overrides the default get_model_completion to track tokens used, to stream the response if stream_callback is set,
+        and to run the request through the process-wide llm_scheduler (which also retries it if rate limited or it fails transiently;
+        create the engine with retry = 1 so its client doesn't retry too).
         See https://github.com/zhudotexe/kanpai/blob/cc603705d353e4e9b9aa3cf9fbb12e3a46652c55/kanpai/base_kani.py#L48
         """
-        completion = await super().get_model_completion(include_functions, **kwargs)
+        self.tool_call_status = {}
+
+        async def request():
+            with telemetry.span("llm.completion", self.metrics):
+                completion = None
+                if self.stream_callback is not None and isinstance(self.engine, OpenAIEngine):
+                    completion = await self._stream_completion(include_functions, **kwargs)
+                if completion is None:
+                    try:
+                        completion = await super(StreamlitKani, self).get_model_completion(include_functions, **kwargs)
+                    except HTTPException as e:
+                        if (retryable := _retryable_error(e)) is not None:
+                            raise retryable from e
+                        raise
+                return completion
+
+        session = self.llm_session if self.llm_session is not None else id(self)
+        completion = await llm_scheduler.run(request, session, self.llm_priority, self.metrics)
         self.tokens_used_prompt += completion.prompt_tokens
         self.tokens_used_completion += completion.completion_tokens
 
@@ -65,10 +191,218 @@ class StreamlitKani(Kani):
     
 
 
+    async def _stream_completion(self, include_functions: bool = True, **kwargs):
+        """Get a completion from the OpenAI API with stream=True, passing text to stream_callback as it arrives.
+        kani 0.7 engines don't stream, so this makes the request with the engine's own client and settings.
+        Returns None if the request fails before anything was streamed, so the caller can fall back to a regular completion."""
+        engine = self.engine
+        client = engine.client
+        messages = await self.get_prompt()
+        functions = list(self.functions.values()) if include_functions else []
+
+        payload = {
+            "model": engine.model,
+            # this needs to be exclude_defaults since content can be None but is required regardless
+            "messages": [m.model_dump(exclude_defaults=True, mode="json") for m in engine.translate_messages(messages)],
+            "stream": True,
+            # the last chunk then reports the tokens billed for the request
+            "stream_options": {"include_usage": True},
+            **engine.hyperparams,
+            **kwargs,
+        }
+        if functions:
+            payload["tools"] = [t.model_dump(exclude_unset=True) for t in engine.translate_functions(functions)]
+
+        headers = {**client.headers, "Authorization": f"Bearer {client.api_key}"}
+        if client.organization:
+            headers["OpenAI-Organization"] = client.organization
+        if client.http is None:
+            client.http = aiohttp.ClientSession()
+
+        content = []
+        tool_calls = {}  # index -> {"id", "name", "arguments"}, assembled from deltas
+        usage = None
+        try:
+            async with client.http.post(f"{client.SERVICE_BASE}/chat/completions", json=payload, headers=headers) as resp:
+                if resp.status == 429:
+                    raise RateLimited(f"Streaming request was rate limited: {resp.reason}", retry_after_seconds(resp.headers))
+                if resp.status >= 500:
+                    raise TransientError(f"Streaming request failed with a server error: {resp.status}: {resp.reason}", retry_after_seconds(resp.headers))
+                if resp.status != 200:
+                    raise HTTPException(f"Streaming request returned an error: {resp.status}: {resp.reason}")
+
+                # server-sent events: one "data: {json}" line per chunk, ending with "data: [DONE]"
+                async for line in resp.content:
+                    line = line.decode().strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line.removeprefix("data:").strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices") or []:
+                        delta = choice.get("delta") or {}
+                        if text := delta.get("content"):
+                            content.append(text)
+                            self.stream_callback(text)
+                        for tc in delta.get("tool_calls") or []:
+                            call = tool_calls.setdefault(tc["index"], {"id": None, "name": "", "arguments": ""})
+                            call["id"] = tc.get("id") or call["id"]
+                            call["name"] += (tc.get("function") or {}).get("name") or ""
+                            call["arguments"] += (tc.get("function") or {}).get("arguments") or ""
+        except (aiohttp.ClientError, HTTPException):
+            if content:
+                raise
+            return None
+
+        message = ChatMessage.assistant(
+            "".join(content) or None,
+            tool_calls=[ToolCall.from_function_call(FunctionCall(name=c["name"], arguments=c["arguments"]), c["id"])
+                        for _, c in sorted(tool_calls.items())] or None,
+        )
+
+        if usage:
+            return Completion(message, prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"])
+        # if the server didn't report usage, count tokens the same way kani budgets the prompt
+        prompt_tokens = sum(self.message_token_len(m) for m in messages) + engine.token_reserve + engine.function_token_reserve(functions)
+        completion_tokens = self.message_token_len(message)
+        return Completion(message, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+
+    async def do_function_call(self, call: FunctionCall, tool_call_id: str = None):
+        """Overrides the default to limit how many calls run at once, time out slow calls, and record their progress in tool_call_status."""
+        status = self.tool_call_status[tool_call_id or call.name] = {"name": call.name, "state": "queued", "started": None, "finished": None}
+        if self._call_semaphore is None:
+            self._call_semaphore = asyncio.Semaphore(self.max_concurrent_calls)
+
+        async with self._call_semaphore:
+            status.update(state = "running", started = time.monotonic())
+            try:
+                with telemetry.span(f"tool.{call.name}", self.metrics):
+                    result = await asyncio.wait_for(super().do_function_call(call, tool_call_id), timeout = self.call_timeout)
+                status["state"] = "done"
+                return result
+            except asyncio.TimeoutError as e:
+                status["state"] = "timed out"
+                raise WrappedCallException(False, TimeoutError(f"ERROR: {call.name} did not finish within {self.call_timeout} seconds and was cancelled. "
+                                                               "Try a narrower request.")) from e
+            except Exception:
+                status["state"] = "failed"
+                raise
+            finally:
+                status["finished"] = time.monotonic()
+
+
+
+    def message_token_len(self, message: ChatMessage):
+        """Overrides the default to use the process-wide token length cache, after kani's own per-agent cache
+        (which also holds the exact lengths of completions reported by the engine)."""
+        try:
+            return self._message_tokens[message]
+        except KeyError:
+            length = self._message_tokens[message] = token_lengths.message_len(self.engine, message)
+            return length
+
+
+    def history_token_len(self):
+        """Total tokens of chat_history, kept as a running total. The messages counted last time are compared with chat_history
+        by identity, and only those from the first difference on are recounted: usually just the messages appended since."""
+        history = self.chat_history
+        counted = self._counted_messages
+        same = 0
+        for (message, _), current in zip(counted, history):
+            if message is not current:
+                break
+            same += 1
+
+        self._history_tokens -= sum(tokens for _, tokens in counted[same:])
+        del counted[same:]
+        for message in history[same:]:
+            tokens = self.message_token_len(message)
+            counted.append((message, tokens))
+            self._history_tokens += tokens
+        return self._history_tokens
+
+
+    def reset_history_token_len(self):
+        """Forget the running total, so the next history_token_len() counts every message again."""
+        self._counted_messages = []
+        self._history_tokens = 0
+
+
+    def compacted_history(self):
+        """Return chat_history as it should be sent to the model: old FUNCTION results are replaced by short stubs.
+        Results are compacted once they are older than the last compact_keep_turns user turns, or, if the history is over
+        compact_threshold_tokens, once they are older than the current turn. Display messages and exports keep the originals."""
+        if self.compact_keep_turns < 1:
+            raise ValueError(f"compact_keep_turns must be at least 1 (the current turn's results are always kept), not {self.compact_keep_turns}.")
+
+        history = self.chat_history
+        user_turns = [i for i, m in enumerate(history) if m.role == ChatRole.USER]
+        if not user_turns:
+            self._compaction_saved_tokens = 0
+            return history
+
+        keep_from = user_turns[-self.compact_keep_turns] if len(user_turns) >= self.compact_keep_turns else 0
+        if self.history_token_len() > self.compact_threshold_tokens:
+            keep_from = user_turns[-1]
+
+        compacted = []
+        saved = 0
+        for i, message in enumerate(history):
+            if i < keep_from and message.role == ChatRole.FUNCTION and self.message_token_len(message) >= self.compact_min_tokens:
+                stub = self._compacted.get(message)
+                if stub is None:
+                    stub = self._compacted[message] = self._compact_message(message)
+                saved += self.message_token_len(message) - self.message_token_len(stub)
+                message = stub
+            compacted.append(message)
+
+        self._compaction_saved_tokens = saved
+        return compacted
+
+
+    def _compact_message(self, message):
+        text = message.text or ""
+        preview = text[:self.compact_preview_chars]
+        return message.copy_with(content=f"[Earlier result of {message.name}, compacted to save space ({len(text)} characters). "
+                                         f"It began: {preview}... Call the function again if the full result is needed.]")
+
+
+    async def get_prompt(self):
+        """Overrides the default to send the compacted history, keeping as many recent messages as fit in the context.
+        Like the default, raises MessageTooLong if a message it reaches could never fit in the context."""
+        history = self.compacted_history()
+        remaining = max_size = self.max_context_size - self.always_len
+        to_keep = 0
+        for message in reversed(history):
+            message_len = self.message_token_len(message)
+            if message_len > max_size:
+                raise MessageTooLong("The chat message's size is longer than the allowed context window (after including system messages, "
+                                     f"always included messages, and desired response tokens).\nContent: {(message.text or '')[:100]}...")
+            remaining -= message_len
+            if remaining < 0:
+                break
+            to_keep += 1
+
+        if not to_keep:
+            return self.always_included_messages
+        return self.always_included_messages + history[-to_keep:]
+
+
     async def estimate_next_tokens_cost(self):
         """Estimate the cost of the next message (not including the response)"""
+        reserve = self.engine.token_reserve + self.engine.function_token_reserve(list(self.functions.values()))
+        # if the whole (compacted) history fits in the context, the prompt is all of it, and the running total avoids recounting
+        self.compacted_history()
+        history_tokens = self.history_token_len() - self._compaction_saved_tokens
+        if history_tokens <= self.max_context_size - self.always_len:
+            return sum(self.message_token_len(m) for m in self.always_included_messages) + history_tokens + reserve
         # includes all previous messages, plus the current
-        return sum(self.message_token_len(m) for m in await self.get_prompt()) + self.engine.token_reserve + self.engine.function_token_reserve(list(self.functions.values()))
+        return sum(self.message_token_len(m) for m in await self.get_prompt()) + reserve
 
 
 def initialize_app_config(**kwargs):
@@ -92,7 +426,8 @@ def initialize_app_config(**kwargs):
 
 
 def set_app_agents(agents_func, reinit = False):
-    """Set the agents to be used in the app. Must be run before serve_app() and provided with a function that returns a dictionary of agents to serve."""
+    """Set the agents to be used in the app. Must be run before serve_app() and provided with a function that returns a dictionary of agents to serve.
+    Each entry's "agent" may be an agent, or a function that creates one; functions are only called when the agent is first selected."""
     if "agents" not in st.session_state or reinit:
         agents = agents_func()
         st.session_state.agents = agents
@@ -103,27 +438,47 @@ def set_app_agents(agents_func, reinit = False):
 
 
 
+def get_agent(agent_name):
+    """Return the named agent, creating it on first use if it was given as a function."""
+    entry = st.session_state.agents[agent_name]
+    if not isinstance(entry["agent"], Kani):
+        entry["agent"] = entry["agent"]()
+    # the session's agents share its turn in the llm_scheduler
+    entry["agent"].llm_session = _session_id()
+    return entry["agent"]
+
+
+def _session_id():
+    return st.runtime.scriptrunner.add_script_run_ctx().streamlit_script_run_ctx.session_id
+
+
+def _created_agents():
+    """The agents that have been created so far, keyed by name."""
+    return {name: entry["agent"] for name, entry in st.session_state.agents.items() if isinstance(entry["agent"], Kani)}
+
+
+
 def serve_app():
     """Serve the application. Must be run last."""
     assert "agents" in st.session_state, "No agents have been set. Use set_app_agents() to set agents prior to serve_app()"
     loop = st.session_state.get("event_loop")
-    
+
+    # Prometheus-style /metrics endpoint for the whole process, started once
+    if port := os.environ.get("METRICS_PORT"):
+        telemetry.serve_prometheus(int(port))
+
     loop.run_until_complete(_main())
 
 
 
 # Initialize session states
 def _initialize_session_state():
-    if "logger" not in st.session_state:
-        st.session_state.logger = logging.getLogger(__name__)
-        st.session_state.logger.handlers = []
-        st.session_state.logger.setLevel(logging.INFO)
-        st.session_state.logger.addHandler(logging.StreamHandler())
-
     st.session_state.setdefault("event_loop", asyncio.new_event_loop())
     st.session_state.setdefault("user_api_key", "")
     st.session_state.setdefault("default_api_key", None)  # Store the original API key
     st.session_state.setdefault("show_function_calls", False)
+    st.session_state.setdefault("stream_responses", True)
+    st.session_state.setdefault("show_metrics", False)
     st.session_state.setdefault("ui_disabled", False)
     st.session_state.setdefault("lock_widgets", False)
     st.session_state.setdefault("upload_chats_processed", False)
@@ -131,7 +486,28 @@ def _initialize_session_state():
 
 
 # Render chat message
-def _render_message(message):
+# function results longer than this are shown as a preview, with a toggle to show them in full
+FUNCTION_PREVIEW_CHARS = 1000
+
+# message -> text shown for it (tool call signatures, function result previews), so it isn't rebuilt on every rerun
+_rendered_text = weakref.WeakKeyDictionary()
+
+
+def _display_text(message):
+    if (text := _rendered_text.get(message)) is None:
+        if message.tool_calls:
+            text = [f"{tc.function.name}(params = {tc.function.arguments})" for tc in message.tool_calls]
+        else:
+            content = message.text or ""
+            text = content if len(content) <= FUNCTION_PREVIEW_CHARS else f"{content[:FUNCTION_PREVIEW_CHARS]}\n... ({len(content) - FUNCTION_PREVIEW_CHARS} more characters)"
+        _rendered_text[message] = text
+    return text
+
+
+def _render_message(message, tool_status = None, key = None):
+    """Render a message in the chat; returns the action to show while waiting for the next one.
+    If tool_status (see StreamlitKani.tool_call_status) is given, the message's tool calls are shown with their progress.
+    key identifies the message's widgets (e.g. its position in display_messages), so a large result shown in full stays so across reruns."""
     current_agent_avatar = st.session_state.agents[st.session_state.current_agent_name].get("avatar", None)
     current_user_avatar = st.session_state.agents[st.session_state.current_agent_name].get("user_avatar", None)
 
@@ -162,88 +538,170 @@ def _render_message(message):
             st.write(message.content)
 
 
-    if message.tool_calls:
-        for tool_call in message.tool_calls:
-            func_name = tool_call.function.name
-            func_arguments = tool_call.function.arguments
-            current_action = f"*Checking source ({func_name})...*"
+    if message.tool_calls and tool_status is not None:
+        current_action = f"*Checking sources ({', '.join(tc.function.name for tc in message.tool_calls)})...*"
+        with st.chat_message("assistant", avatar="🛠️"):
+            st.markdown("  \n".join(_tool_progress_line(tool_call, tool_status.get(tool_call.id)) for tool_call in message.tool_calls))
+
+    elif message.tool_calls:
+        for tool_call, call_text in zip(message.tool_calls, _display_text(message)):
+            current_action = f"*Checking source ({tool_call.function.name})...*"
             if st.session_state.show_function_calls:
                 with st.chat_message("assistant", avatar="🛠️"):
-                    st.text(f"{func_name}(params = {func_arguments})")
+                    st.text(call_text)
 
     elif message.role == ChatRole.FUNCTION:
         current_action = f"*Evaluating result ({message.name})...*"
         if st.session_state.show_function_calls:
             with st.chat_message("assistant", avatar="✔️"):
-                st.text(message.content)
+                # large results are collapsed to a preview; the full text is only sent to the browser when asked for
+                if len(message.text or "") > FUNCTION_PREVIEW_CHARS and st.toggle("Show full result", key = f"full_result_{st.session_state.current_agent_name}_{key}"):
+                    st.text(message.content)
+                else:
+                    st.text(_display_text(message))
 
     
     return current_action
 
-## kani agents have a save method:
-    # def save(self, fp: PathLike, **kwargs):
-    #     """Save the chat state of this kani to a JSON file. This will overwrite the file if it exists!
-
-    #     :param fp: The path to the file to save.
-    #     :param kwargs: Additional arguments to pass to Pydantic's ``model_dump_json``.
-    #     """
-## so we will return create a JSON file for each agent,
-## and loop over all of those, reading them is as JSON so we 
-## can eventually return them to the user as a .json file
-## we will return a json object keyed by agent name, 
-## but only for those that have conversation_started set to True
-## finally, we'll create our temp files in an appropirate temp directory,
-## removing them when done for security
-## 
-def _export_chats():
-    # create a temp dir
-    temp_dir = tempfile.mkdtemp()
-    # create a temp file for each agent
-    for agent_name, agent in st.session_state.agents.items():
-        if agent.conversation_started:
-            agent_file = os.path.join(temp_dir, agent_name + ".json")
-            agent.save(agent_file)
-
-    # read each agent file as json
-    agent_jsons = {}
-    for agent_name, agent in st.session_state.agents.items():
-        if agent.conversation_started:
-            agent_file = os.path.join(temp_dir, agent_name + ".json")
-            with open(agent_file) as f:
-                agent_jsons[agent_name] = json.load(f)
-
-    # remove the temp dir
-    shutil.rmtree(temp_dir)
-
-    return json.dumps(agent_jsons)
-
-## this is the inverse of the above, using kani's correponding load() method
-def _import_chats(parsed_json):
+def _tool_progress_line(tool_call, status):
+    icons = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "⚠️", "timed out": "⌛"}
+    state = status["state"] if status else "queued"
+    line = f"{icons[state]} `{tool_call.function.name}` {state}"
+    if status and status["started"] is not None:
+        line += f" ({(status['finished'] or time.monotonic()) - status['started']:.1f}s)"
+    if st.session_state.show_function_calls:
+        line += f" `{tool_call.function.arguments}`"
+    return line
+
+
+async def _next_message(agent, messages, tool_message):
+    """Wait for the next message of a round. If the previous message made tool calls, they are in flight meanwhile,
+    so it is rendered with their progress, updated until their results arrive."""
+    if not tool_message:
+        return await anext(messages)
+
+    next_message = asyncio.ensure_future(anext(messages))
+    progress = st.empty()
+    while True:
+        with progress.container():
+            _render_message(tool_message, tool_status = agent.tool_call_status)
+        if next_message.done():
+            return next_message.result()
+        await asyncio.wait({next_message}, timeout = 0.25)
+
+## Chats are exported as a JSON object keyed by agent name, each value being the agent's saved state in the format of
+## kani's save()/load() (its always-included messages and chat history), but for those with conversation_started only.
+## Rather than going through save()/load() and temp files, the state is serialized (and parsed) straight from (and into)
+## the agents, in one pass; exports starting with the gzip magic number are decompressed on import.
+## Many sessions can be exported at once as JSON lines, one {"session": ..., "chats": ...} object per line, streamed
+## to and from a (possibly gzipped) file without holding them all in memory.
+
+_saved_chats = TypeAdapter(Dict[str, SavedKani])
+
+
+class _SavedSession(BaseModel):
+    session: str
+    chats: Dict[str, SavedKani]
+
+
+def export_chats(agents, compress = False):
+    """Serialize the chats of the given agents ({name: agent}) that have been started; returns JSON bytes, gzipped if compress."""
+    data = _saved_chats.dump_json({name: SavedKani(always_included_messages = agent.always_included_messages, chat_history = agent.chat_history)
+                                   for name, agent in agents.items() if agent.conversation_started})
+    return gzip.compress(data, compresslevel = 6) if compress else data
+
+
+def parse_chats(data):
+    """Parse an export of export_chats (bytes or str, optionally gzipped); returns {agent name: SavedKani}."""
+    if isinstance(data, bytes) and data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return _saved_chats.validate_json(data)
+
+
+def write_sessions(fp, sessions, compress = False):
+    """Write many sessions' chats to the file at fp as JSON lines; sessions is an iterable of (session id, {name: agent}) pairs."""
+    with (gzip.open(fp, "wb", compresslevel = 6) if compress else open(fp, "wb")) as f:
+        for session_id, agents in sessions:
+            f.write(b'{"session": ' + json.dumps(session_id).encode() + b', "chats": ' + export_chats(agents) + b'}\n')
+
+
+def read_sessions(fp):
+    """Read the sessions written by write_sessions (gzipped or not), yielding (session id, {agent name: SavedKani}) pairs."""
+    with open(fp, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    with (gzip.open(fp, "rb") if gzipped else open(fp, "rb")) as f:
+        for line in f:
+            if line.strip():
+                entry = _SavedSession.model_validate_json(line)
+                yield entry.session, entry.chats
+
+
+def _export_chats(compress = False):
+    return export_chats(_created_agents(), compress)
+
+
+## this is the inverse of the above, loading each agent's state as kani's load() would
+def _import_chats(data):
     # reset all agents
     _clear_chat_all_agents()
-    # create a temp dir
-    temp_dir = tempfile.mkdtemp()
-    # create a temp file for each agent
-    for agent_name, agent in parsed_json.items():
-        agent_file = os.path.join(temp_dir, agent_name + ".json")
-        with open(agent_file, "w") as f:
-            json.dump(agent, f)
-
-    # read each agent file as json
-    for agent_name, agent in parsed_json.items():
-        agent_file = os.path.join(temp_dir, agent_name + ".json")
-        st.session_state.agents[agent_name]["agent"].load(agent_file)
-
-    # remove the temp dir
-    shutil.rmtree(temp_dir)
+    for agent_name, state in parse_chats(data).items():
+        if agent_name in st.session_state.agents:
+            get_agent(agent_name).load_state(state)
 
     st.rerun()
 
 
+def _prepare_chats_download():
+    # serialized on request rather than on every rerun
+    st.session_state.chats_download = _export_chats(compress = True)
+
+
+def _render_chat_transfer():
+    """Sidebar controls to download the session's chats and to load chats from a download."""
+    if "chats_download" in st.session_state:
+        st.download_button("💾 Save chats file", data = st.session_state.pop("chats_download"), file_name = "chats.json.gz",
+                           mime = "application/gzip", disabled = st.session_state.lock_widgets)
+    else:
+        st.button("Export Chats", on_click = _prepare_chats_download, disabled = st.session_state.lock_widgets)
+
+    uploaded = st.file_uploader("Import Chats", type = ["json", "gz"], disabled = st.session_state.lock_widgets)
+    if uploaded is None:
+        st.session_state.upload_chats_processed = False
+    elif not st.session_state.upload_chats_processed:
+        # the uploader keeps its file across reruns, so each upload is only imported once
+        st.session_state.upload_chats_processed = True
+        _import_chats(uploaded.getvalue())
+
+
+class _StreamRenderer:
+    """Renders streamed assistant text into a chat message that is updated in place."""
+
+    def __init__(self, avatar):
+        self.avatar = avatar
+        self.placeholder = None
+        self.text = ""
+
+    def write(self, chunk):
+        if self.placeholder is None:
+            with st.chat_message("assistant", avatar=self.avatar):
+                self.placeholder = st.empty()
+        self.text += chunk
+        self.placeholder.markdown(self.text + "▌")
+
+    def finish(self):
+        """Finish the current streamed message, if any; returns whether text was streamed since the last call."""
+        if self.placeholder is None:
+            return False
+        self.placeholder.markdown(self.text)
+        self.placeholder = None
+        self.text = ""
+        return True
+
+
 # Handle chat input and responses
 # chat_input returns a value to prompt when the user enters the message and hits enter
 async def _handle_chat_input():
-    agent = st.session_state.agents[st.session_state.current_agent_name]['agent']
+    agent = get_agent(st.session_state.current_agent_name)
 
     if prompt := st.chat_input(disabled=st.session_state.lock_widgets, on_submit=_lock_ui):
         user_message = ChatMessage.user(prompt)
@@ -256,18 +714,35 @@ async def _handle_chat_input():
 
         st.session_state.current_action = "*Thinking...*"
 
-        while True:
-            try:
-                with st.spinner(st.session_state.current_action):
-                    message = await anext(messages)
-                    agent.display_messages.append(message)
-                    st.session_state.current_action = _render_message(message)
-       
-                    session_id = st.runtime.scriptrunner.add_script_run_ctx().streamlit_script_run_ctx.session_id
-                    info = {"session_id": session_id, "message": message.model_dump(), "agent": st.session_state.current_agent_name}
-                    st.session_state.logger.info(info)
-            except StopAsyncIteration:
-                break
+        # in streaming mode, assistant text is rendered as it is generated rather than once the message is complete
+        stream = _StreamRenderer(st.session_state.agents[st.session_state.current_agent_name].get("avatar", None)) if st.session_state.stream_responses else None
+        agent.stream_callback = stream.write if stream else None
+
+        session_id = _session_id()
+        tool_message = None  # the last message, if it made tool calls, so their progress can be shown
+        try:
+            while True:
+                try:
+                    with st.spinner(st.session_state.current_action):
+                        message = await _next_message(agent, messages, tool_message)
+                        agent.display_messages.append(message)
+                        tool_message = message if message.tool_calls else None
+                        if stream is not None and stream.finish() and not message.tool_calls:
+                            # the streamed text is already on screen
+                            st.session_state.current_action = "*Thinking...*"
+                        elif message.tool_calls:
+                            # rendered with progress by _next_message while the calls run
+                            st.session_state.current_action = f"*Checking sources ({', '.join(tc.function.name for tc in message.tool_calls)})...*"
+                        else:
+                            st.session_state.current_action = _render_message(message, key = len(agent.display_messages) - 1)
+
+                        # only queued here; serialization and writing happen on the chat log's own thread
+                        chat_log.log("message", session_id = session_id, agent = st.session_state.current_agent_name, message = message)
+                except StopAsyncIteration:
+                    break
+
+        finally:
+            agent.stream_callback = None
 
         st.session_state.lock_widgets = False  # Step 5: Unlock the UI
         st.rerun()
@@ -276,6 +751,9 @@ async def _handle_chat_input():
 def _clear_chat_all_agents():
     set_app_agents(st.session_state.agents_func, reinit = True)
 
+def _load_earlier(agent, count = 50):
+    agent.display_window += count
+
 # Lock the UI when user submits input, as widget changes during processing can cause errors
 def _lock_ui():
     st.session_state.lock_widgets = True
@@ -301,22 +779,37 @@ async def _main():
         st.button(label = "Clear All Chats", 
                   on_click=_clear_chat_all_agents, 
                   disabled=st.session_state.lock_widgets)
+
+        _render_chat_transfer()
         
         st.checkbox("🛠️ Show calls to external tools", 
                     key="show_function_calls", 
                     disabled=st.session_state.lock_widgets)
 
+        st.checkbox("⚡ Stream responses", 
+                    key="stream_responses", 
+                    disabled=st.session_state.lock_widgets)
+
+        st.checkbox("📈 Show timings", 
+                    key="show_metrics", 
+                    disabled=st.session_state.lock_widgets)
+
 
 
     st.header(st.session_state.current_agent_name)
-    agent = st.session_state.agents[st.session_state.current_agent_name]['agent']
+    # agents given as functions are created here, the first time they are selected
+    agent = get_agent(st.session_state.current_agent_name)
 
     current_agent_avatar = st.session_state.agents[st.session_state.current_agent_name].get("avatar", None)
     with st.chat_message("assistant", avatar = current_agent_avatar):
         st.write(st.session_state.agents[st.session_state.current_agent_name]['greeting'])
 
-    for message in st.session_state.agents[st.session_state.current_agent_name]["agent"].display_messages:
-        _render_message(message)
+    # only the most recent messages are rendered; earlier ones are loaded on request
+    first = max(len(agent.display_messages) - agent.display_window, 0)
+    if first:
+        st.button(f"⬆️ Load earlier messages ({first} more)", on_click = _load_earlier, args = (agent,), disabled = st.session_state.lock_widgets)
+    for index in range(first, len(agent.display_messages)):
+        _render_message(agent.display_messages[index], key = index)
 
     await _handle_chat_input()
 
@@ -324,4 +817,31 @@ async def _main():
         prompt_cost = st.session_state.agents[st.session_state.current_agent_name]["token_costs"]["prompt"]
         completion_cost = st.session_state.agents[st.session_state.current_agent_name]["token_costs"]["completion"]
         cost = (agent.tokens_used_prompt / 1000.0) * prompt_cost + (agent.tokens_used_completion / 1000.0) * completion_cost
-        st.caption(f"Chat prompt tokens: {agent.tokens_used_prompt}, completion tokens: {agent.tokens_used_completion}, cost: ${cost:.2f}")
+        saved = f", prompt tokens saved: {agent.tokens_saved_prompt}" if agent.tokens_saved_prompt else ""
+        st.caption(f"Chat prompt tokens: {agent.tokens_used_prompt}, completion tokens: {agent.tokens_used_completion}, cost: ${cost:.2f}{saved}")
+
+    if st.session_state.show_metrics:
+        _render_metrics_panel()
+
+
+def _metrics_table(metrics):
+    return [{"span": name, "count": s["count"], "mean ms": round(s["mean_s"] * 1000, 1), "p95 ms": round(s["p95_s"] * 1000, 1), "total s": round(s["total_s"], 2)}
+            for name, s in metrics.snapshot().items()]
+
+
+def _render_metrics_panel():
+    """Sidebar tables of span timings, for this session's agents and for the whole process, and the model request queue."""
+    session_metrics = telemetry.Metrics().merge(*(agent.metrics for agent in _created_agents().values()))
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("**Timings, this session**")
+        st.dataframe(_metrics_table(session_metrics), hide_index = True)
+        st.markdown("**Timings, all sessions**")
+        st.dataframe(_metrics_table(telemetry.process_metrics), hide_index = True)
+        scheduler = llm_scheduler.stats()
+        st.caption(f"Model requests: {scheduler['running']} running, {scheduler['queued']} queued, {scheduler['rate_limited']} rate limited")
+        st.markdown("**Counters, all sessions**")
+        st.dataframe([{"counter": name, "value": round(value, 2)} for name, value in telemetry.gauge_values().items()], hide_index = True)
+        st.download_button("Download timings (JSONL)",
+                           telemetry.to_jsonl(session_metrics, scope = "session") + telemetry.to_jsonl(scope = "process"),
+                           "timings.jsonl")
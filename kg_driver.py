@@ -0,0 +1,83 @@
+## Process-wide, pooled access to the Neo4j knowledge graph.
+##
+## Streamlit gives every session its own asyncio event loop, and neo4j's async driver (and its connection pool)
+## is bound to the loop it was created on. So rather than one driver per agent, we keep a single AsyncDriver
+## living on the background event loop (see background_loop.py), and agents submit work to it from whatever
+## loop they run on. Awaiting that work does not block the caller's loop, so a slow cypher query no longer
+## stalls other coroutines.
+##
+## Configuration (via environment / .env file):
+##   NEO4J_BOLT                              - bolt uri, e.g. bolt://localhost:7687 (required)
+##   NEO4J_USER, NEO4J_PASSWORD              - optional basic auth
+##   NEO4J_MAX_CONNECTION_POOL_SIZE          - max connections in the shared pool (default 50)
+##   NEO4J_CONNECTION_ACQUISITION_TIMEOUT    - seconds to wait for a free connection (default 60)
+
+import os
+import threading
+from neo4j import AsyncGraphDatabase
+import background_loop
+
+
+_lock = threading.Lock()
+_driver = None
+
+
+def driver_config():
+    """Return the driver settings read from the environment."""
+    auth = None
+    if os.environ.get("NEO4J_USER"):
+        auth = (os.environ["NEO4J_USER"], os.environ.get("NEO4J_PASSWORD", ""))
+
+    return {
+        "uri": os.environ["NEO4J_BOLT"],
+        "auth": auth,
+        "max_connection_pool_size": int(os.environ.get("NEO4J_MAX_CONNECTION_POOL_SIZE", 50)),
+        "connection_acquisition_timeout": float(os.environ.get("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60)),
+    }
+
+
+def _get_driver():
+    """Create the shared driver on the background loop, once per process."""
+    global _driver
+
+    with _lock:
+        if _driver is None:
+            config = driver_config()
+            uri = config.pop("uri")
+
+            async def _create():
+                return AsyncGraphDatabase.driver(uri, **config)
+
+            _driver = background_loop.run_sync(_create())
+        return _driver
+
+
+def set_driver(driver):
+    """Use the given driver instead of one created from the environment, e.g. a local stand-in for tests; None reverts to the default.
+    The driver's coroutines run on the background loop, like the default driver's."""
+    global _driver
+
+    with _lock:
+        _driver = driver
+
+
+async def run(work):
+    """Run `work(driver)` (an async callable) against the shared driver and return its result.
+
+    Safe to await from any event loop; the work itself executes on the driver's own loop."""
+    return await background_loop.run(work(_get_driver()))
+
+
+def run_sync(work):
+    """Blocking variant of run(), for scripts and other code outside of an event loop."""
+    return background_loop.run_sync(work(_get_driver()))
+
+
+def close():
+    """Close the shared driver (e.g. at the end of a script)."""
+    global _driver
+
+    with _lock:
+        if _driver is not None:
+            background_loop.run_sync(_driver.close())
+            _driver = None
@@ -0,0 +1,233 @@
+## Process-wide scheduler for model completions, shared by every Streamlit session and every (sub-)agent.
+##
+## All agents share one engine and one API rate limit, so completions are admitted through a single scheduler:
+##   - at most max_concurrent completions are in flight at once, across all sessions and event loops
+##   - waiting requests are served by priority (INTERACTIVE turns before BACKGROUND sub-agent work such as
+##     competency question testing), and within a priority round-robin across sessions, so one session's
+##     burst of requests can't starve the others
+##   - rate-limited (HTTP 429) requests, and ones that failed transiently (HTTP 5xx, timeouts), are retried with
+##     exponential backoff and jitter, giving up their slot while they wait. Engines should be created with retry = 1
+##     (see app.py), so the engine's HTTP client doesn't also retry them itself while holding the slot
+##
+## Sessions run on their own event loops (see kani_streamlit._initialize_session_state), so the scheduler's state
+## is guarded by a thread lock and waiters are woken on their own loop.
+##
+## Time spent queued and backing off is recorded as the llm.queue_wait and llm.backoff spans (see telemetry.py);
+## queue depth, in-flight count and retry counters are in stats(), exported as the llm_scheduler gauges.
+##
+## Configuration (via environment / .env file):
+##   LLM_MAX_CONCURRENT   - maximum completions in flight across the process (default 8)
+##   LLM_MAX_RETRIES      - retries of a rate-limited or transiently failed completion before the error is raised (default 5)
+##   LLM_BACKOFF_BASE     - seconds to wait before the first retry, doubled for each further one (default 1)
+##   LLM_BACKOFF_MAX      - maximum seconds to wait before a retry (default 60)
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import telemetry
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class TransientError(Exception):
+    """A completion request failed in a way that may succeed if retried: an HTTP 5xx error or a timeout.
+    retry_after is the server's suggested wait in seconds, if given."""
+
+    def __init__(self, message, retry_after = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(TransientError):
+    """A completion request was rejected with HTTP 429."""
+
+
+def is_rate_limit(error):
+    """Whether an exception means the request was rate limited; engine errors must be translated to RateLimited by the caller
+    (see StreamlitKani.get_model_completion), so other errors mentioning e.g. "429 tokens" are not retried."""
+    return isinstance(error, RateLimited)
+
+
+def is_transient(error):
+    """Whether an exception means the request may succeed if retried (including being rate limited); as with is_rate_limit(),
+    the caller translates engine errors to TransientError."""
+    return isinstance(error, TransientError)
+
+
+def retry_after_seconds(headers):
+    """The wait in seconds suggested by a response's Retry-After header, or None if it is missing or not a number of seconds."""
+    value = (headers or {}).get("Retry-After")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+
+class _Waiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+
+class LLMScheduler:
+    """Admits completions under a global concurrency cap, by priority and fairly across sessions; see the module notes."""
+
+    def __init__(self, max_concurrent = 8, max_retries = 5, backoff_base = 1.0, backoff_max = 60.0):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._running = 0
+        self._queues = {}  # priority -> OrderedDict of session -> deque of _Waiter; session order is the round-robin order
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.rate_limited = 0
+        self.transient_errors = 0
+        self.failed = 0
+
+
+    def _queued(self):
+        return sum(len(waiters) for sessions in self._queues.values() for waiters in sessions.values())
+
+
+    def _next_waiter(self):
+        """Pop the waiter to run next: highest priority first, then the session that has waited longest for its turn."""
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            session, waiters = next(iter(sessions.items()))
+            waiter = waiters.popleft()
+            # the session goes to the back of the rotation, or leaves it if it has nothing else queued
+            del sessions[session]
+            if waiters:
+                sessions[session] = waiters
+            return waiter
+        return None
+
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+            self._grant()
+
+
+    def _grant(self):
+        """Hand free slots to queued waiters; must be called with the lock held."""
+        while self._running < self.max_concurrent and (waiter := self._next_waiter()) is not None:
+            self._running += 1
+            waiter.granted = True
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+
+    @asynccontextmanager
+    async def slot(self, session = None, priority = INTERACTIVE, metrics = None):
+        """Hold one of the scheduler's slots for the enclosed block, waiting for a turn if they are all in use.
+        Time spent waiting is recorded as an llm.queue_wait span in the process metrics and the given ones."""
+        started = time.perf_counter()
+        with self._lock:
+            if self._running < self.max_concurrent and not self._queued():
+                self._running += 1
+                waiter = None
+            else:
+                waiter = _Waiter(asyncio.get_running_loop())
+                self._queues.setdefault(priority, OrderedDict()).setdefault(session, deque()).append(waiter)
+
+        if waiter is not None:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if not waiter.granted:
+                        sessions = self._queues[priority]
+                        sessions[session].remove(waiter)
+                        if not sessions[session]:
+                            del sessions[session]
+                if waiter.granted:
+                    self._release()
+                raise
+        telemetry.record("llm.queue_wait", time.perf_counter() - started, metrics)
+
+        try:
+            yield
+        finally:
+            self._release()
+
+
+    def backoff(self, attempt, retry_after = None):
+        """Seconds to wait before retry number attempt (from 1): the server's suggestion if given, else exponential with jitter."""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+
+
+    async def run(self, make_request, session = None, priority = INTERACTIVE, metrics = None):
+        """Await make_request() in a slot, retrying with backoff if it is rate limited or fails transiently; make_request must return a new awaitable each call."""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(session, priority, metrics):
+                    result = await make_request()
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+                attempt += 1
+                with self._lock:
+                    if is_rate_limit(e):
+                        self.rate_limited += 1
+                    else:
+                        self.transient_errors += 1
+                # the slot is given up while waiting, so others' requests aren't held up behind the backoff
+                with telemetry.span("llm.backoff", metrics):
+                    await asyncio.sleep(self.backoff(attempt, getattr(e, "retry_after", None)))
+                continue
+
+            with self._lock:
+                self.completed += 1
+            return result
+
+
+    def stats(self):
+        """Counters for monitoring the scheduler."""
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": self._running,
+                "queued": self._queued(),
+                "queued_interactive": sum(len(w) for w in self._queues.get(INTERACTIVE, {}).values()),
+                "queued_background": sum(len(w) for w in self._queues.get(BACKGROUND, {}).values()),
+                "waiting_sessions": len({session for sessions in self._queues.values() for session in sessions}),
+                "completed": self.completed,
+                "rate_limited": self.rate_limited,
+                "transient_errors": self.transient_errors,
+                "failed": self.failed,
+            }
+
+
+
+def _wake(future):
+    # a waiter cancelled in the meantime releases its slot itself (see slot())
+    if not future.done():
+        future.set_result(None)
+
+
+
+# the process-wide scheduler used by StreamlitKani.get_model_completion
+llm_scheduler = LLMScheduler(max_concurrent = int(os.environ.get("LLM_MAX_CONCURRENT", 8)),
+                             max_retries = int(os.environ.get("LLM_MAX_RETRIES", 5)),
+                             backoff_base = float(os.environ.get("LLM_BACKOFF_BASE", 1)),
+                             backoff_max = float(os.environ.get("LLM_BACKOFF_MAX", 60)))
+telemetry.add_gauges("llm_scheduler", llm_scheduler.stats)
@@ -0,0 +1,179 @@
+## Entity search for MonarchAgent, shared by all agents in the process.
+##
+## The backend is configurable with MONARCH_SEARCH_BACKEND:
+##   api    - the Monarch search API (default; MonarchSearch below)
+##   local  - an in-process index built from a node dump (see entity_index.py), at MONARCH_SEARCH_INDEX
+##   neo4j  - a Neo4j full-text index over node names and synonyms, named by MONARCH_SEARCH_FULLTEXT_INDEX
+## All of them return {term: [slim items]}, with items shaped like the API's ({id, category, name, in_taxon_label}).
+##
+## One httpx.AsyncClient (on the background loop, see background_loop.py) keeps connections alive across
+## searches; the terms of a search are looked up concurrently, up to a concurrency cap; and slimmed results
+## are cached per normalized term, so popular terms don't hit the remote API again and again.
+##
+## Configuration of the api backend (via environment / .env file):
+##   MONARCH_API_URL             - search endpoint (default https://api-v3.monarchinitiative.org/v3/api/search)
+##   MONARCH_SEARCH_CONCURRENCY  - max concurrent requests per process (default 4)
+##   MONARCH_SEARCH_TIMEOUT      - seconds per request (default 10)
+##   MONARCH_SEARCH_CACHE_SIZE   - max cached terms (default 1024)
+##   MONARCH_SEARCH_CACHE_TTL    - seconds a cached term stays valid (default 3600)
+
+import asyncio
+import os
+import re
+import httpx
+import background_loop
+import telemetry
+import kg_driver
+from entity_index import EntityIndex
+from query_cache import QueryCache
+
+
+# item fields kept in results shown to the model
+SLIM_FIELDS = ['id', 'category', 'name', 'in_taxon_label']
+
+
+def normalize_term(term):
+    return re.sub(r"\s+", " ", term).strip().lower()
+
+
+def slim_item(item):
+    return {k: v for k, v in item.items() if k in SLIM_FIELDS}
+
+
+
+class MonarchSearch:
+    """Concurrent, cached client for the Monarch search API. Pass an httpx transport (e.g. httpx.MockTransport) to search without the network."""
+
+    def __init__(self, url = "https://api-v3.monarchinitiative.org/v3/api/search", limit = 5, max_concurrency = 4, timeout = 10, retries = 2,
+                 retry_delay = 0.5, cache_size = 1024, cache_ttl = 3600, transport = None):
+        self.url = url
+        self.limit = limit
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay  # seconds before the first retry, doubled for each further one
+        self.transport = transport
+        self.cache = QueryCache(max_entries = cache_size, ttl = cache_ttl)
+
+        # created on first use, on the background loop
+        self._client = None
+        self._semaphore = None
+
+
+    async def search(self, terms):
+        """Search for each term; returns {term: [slim items]}, or {term: {"error": ...}} for terms whose lookup failed."""
+        return await background_loop.run(self._search_all(terms))
+
+
+    async def _search_all(self, terms):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout = self.timeout,
+                                             # retries are made by _search_term, not by the transport, so they don't stack
+                                             transport = self.transport,
+                                             limits = httpx.Limits(max_keepalive_connections = self.max_concurrency))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # repeated terms (after normalization) are only looked up once
+        unique = {normalize_term(term) for term in terms}
+        found = dict(zip(unique, await asyncio.gather(*(self._search_term(term) for term in unique))))
+        return {term: found[normalize_term(term)] for term in terms}
+
+
+    async def _search_term(self, term):
+        if (cached := self.cache.get(term)) is not None:
+            return cached
+
+        params = {"q": term, "limit": self.limit, "offset": 0}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    with telemetry.span("monarch_api.request"):
+                        response = await self._client.get(self.url, params = params)
+                response.raise_for_status()
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                # client errors won't get better by retrying
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500 or e.response.status_code == 429
+                if not retryable or attempt == self.retries:
+                    reason = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+                    return {"error": f"Search for {term!r} failed ({reason}); please try again later."}
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+        items = [slim_item(item) for item in response.json().get('items', [])]
+        self.cache.put(term, items)
+        return items
+
+
+    async def aclose(self):
+        if self._client is not None:
+            await background_loop.run(self._client.aclose())
+            self._client = None
+
+
+
+class LocalSearch:
+    """Search backed by a local EntityIndex; lookups take well under a millisecond, so they run inline."""
+
+    def __init__(self, index_dir, limit = 5):
+        self.index = EntityIndex(index_dir)
+        self.limit = limit
+
+    async def search(self, terms):
+        return {term: self.index.search(term, limit = self.limit) for term in terms}
+
+
+
+class Neo4jSearch:
+    """Search backed by a Neo4j full-text index, e.g. created with
+    CREATE FULLTEXT INDEX node_names FOR (n:`biolink:NamedThing`) ON EACH [n.name, n.synonym]"""
+
+    def __init__(self, index_name, limit = 5):
+        self.index_name = index_name
+        self.limit = limit
+
+    async def search(self, terms):
+        async def work(driver):
+            async with driver.session() as session:
+                found = {}
+                for term in set(terms):
+                    result = await session.run("CALL db.index.fulltext.queryNodes($index, $query) YIELD node "
+                                               "RETURN node.id AS id, node.category AS category, node.name AS name, node.in_taxon_label AS in_taxon_label LIMIT $limit",
+                                               index = self.index_name, query = _lucene_escape(term), limit = self.limit)
+                    found[term] = [_neo4j_item(record.data()) for record in await result.fetch(self.limit)]
+                return found
+
+        found = await kg_driver.run(work)
+        return {term: found[term] for term in terms}
+
+
+
+def _lucene_escape(term):
+    return re.sub(r'([+\-&|!(){}\[\]^"~*?:\\/])', r"\\\1", term)
+
+
+def _neo4j_item(data):
+    # categories are lists in the graph, but single values in the API
+    if isinstance(data.get("category"), list):
+        data["category"] = data["category"][0] if data["category"] else None
+    return {k: v for k, v in data.items() if v is not None}
+
+
+
+def make_search_backend(backend):
+    """Create the search backend named by MONARCH_SEARCH_BACKEND (see module comments)."""
+    if backend == "api":
+        return MonarchSearch(url = os.environ.get("MONARCH_API_URL", "https://api-v3.monarchinitiative.org/v3/api/search"),
+                             max_concurrency = int(os.environ.get("MONARCH_SEARCH_CONCURRENCY", 4)),
+                             timeout = float(os.environ.get("MONARCH_SEARCH_TIMEOUT", 10)),
+                             cache_size = int(os.environ.get("MONARCH_SEARCH_CACHE_SIZE", 1024)),
+                             cache_ttl = float(os.environ.get("MONARCH_SEARCH_CACHE_TTL", 3600)))
+    if backend == "local":
+        return LocalSearch(os.environ.get("MONARCH_SEARCH_INDEX", "entity_index"))
+    if backend == "neo4j":
+        return Neo4jSearch(os.environ.get("MONARCH_SEARCH_FULLTEXT_INDEX", "node_names"))
+    raise ValueError(f"Unknown MONARCH_SEARCH_BACKEND {backend!r}; expected one of api, local, neo4j.")
+
+
+
+# the process-wide search backend used by MonarchAgent.search
+monarch_search = make_search_backend(os.environ.get("MONARCH_SEARCH_BACKEND", "api"))
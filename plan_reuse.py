@@ -0,0 +1,76 @@
+## Tracks how much query planning is saved by lifting literals into parameters (cypher_utils.parameterize).
+##
+## Neo4j caches query plans by query text. Without parameterization, the same query asked about a different
+## entity is a new text, and gets planned from scratch. With it, the query shape is the same, and the cached
+## plan is reused. We can't see planning time directly, but result_available_after (time until the first
+## record is ready) includes it, so we compare the first run of each shape (cold plan cache) with later runs
+## (warm), and count the runs that only got a warm plan because of parameterization.
+## The counters are exported as the plan_reuse gauges (see telemetry.py).
+
+import threading
+from collections import OrderedDict
+from cypher_utils import normalize_query
+import telemetry
+
+
+class PlanReuseStats:
+    """Thread-safe counters of cold vs. warm query plans, bounded to the most recently seen query shapes."""
+
+    def __init__(self, max_shapes = 2048, max_texts_per_shape = 64):
+        self.max_shapes = max_shapes
+        self.max_texts_per_shape = max_texts_per_shape
+
+        self._shapes = OrderedDict()  # normalized parameterized query -> set of hashes of the original query texts
+        self._lock = threading.Lock()
+
+        self.cold_runs = 0
+        self.cold_ms = 0
+        self.warm_runs = 0
+        self.warm_ms = 0
+        self.reused_runs = 0  # warm runs whose original text was new, i.e. would have been cold without parameters
+
+
+    def record(self, original_query, parameterized_query, available_after_ms):
+        """Record one execution, with the server's result_available_after timing in milliseconds."""
+        shape = normalize_query(parameterized_query)
+        text = hash(normalize_query(original_query))
+
+        with self._lock:
+            texts = self._shapes.get(shape)
+            if texts is None:
+                self.cold_runs += 1
+                self.cold_ms += available_after_ms
+                self._shapes[shape] = {text}
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+                return
+
+            self._shapes.move_to_end(shape)
+            self.warm_runs += 1
+            self.warm_ms += available_after_ms
+            if text not in texts:
+                self.reused_runs += 1
+                if len(texts) < self.max_texts_per_shape:
+                    texts.add(text)
+
+
+    def stats(self):
+        """Counters plus an estimate of the planning time saved, in milliseconds."""
+        with self._lock:
+            cold_avg = self.cold_ms / self.cold_runs if self.cold_runs else 0.0
+            warm_avg = self.warm_ms / self.warm_runs if self.warm_runs else 0.0
+            return {
+                "shapes": len(self._shapes),
+                "cold_runs": self.cold_runs,
+                "warm_runs": self.warm_runs,
+                "reused_runs": self.reused_runs,
+                "avg_cold_ms": cold_avg,
+                "avg_warm_ms": warm_avg,
+                "estimated_planning_ms_saved": self.reused_runs * max(0.0, cold_avg - warm_avg),
+            }
+
+
+
+# the process-wide stats updated by KGAgent.query_kg
+plan_reuse = PlanReuseStats()
+telemetry.add_gauges("plan_reuse", plan_reuse.stats)
@@ -0,0 +1,114 @@
+## Process-wide cache of cypher query results, shared by all agents and sessions.
+##
+## Entries are keyed on the normalized query text (see cypher_utils.normalize_query), its parameters, and
+## any other inputs that affect the result (e.g. the token budget it was fetched under). The cache is
+## bounded in size (least-recently-used entries are evicted first), entries expire after a TTL, and
+## everything is invalidated when the KG version/build tag changes: the schema snapshot reports the tag of the graph
+## being served (see schema_snapshot.py) when it loads, and when a periodic check finds that it changed. The process-wide cache's counters are exported as the
+## query_cache gauges (see telemetry.py).
+##
+## Configuration (via environment / .env file):
+##   KG_VERSION              - build tag of the graph being served; changing it invalidates cached results
+##   KG_QUERY_CACHE_SIZE     - maximum number of cached results (default 512, 0 disables caching)
+##   KG_QUERY_CACHE_TTL      - seconds a cached result stays valid (default 3600)
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from cypher_utils import normalize_query
+import telemetry
+
+
+class QueryCache:
+    """A thread-safe LRU cache with per-entry TTL, invalidated when the KG version changes."""
+
+    def __init__(self, max_entries = 512, ttl = 3600, version = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = version
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def make_key(self, query, parameters = None, **extra):
+        """Build a cache key from a query, its parameters, and any extra result-affecting settings."""
+        return (self.version,
+                normalize_query(query),
+                json.dumps(parameters or {}, sort_keys=True, default=str),
+                json.dumps(extra, sort_keys=True, default=str))
+
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries if the cache is full."""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def set_version(self, version):
+        """Record the KG version/build tag currently being served, clearing the cache if it changed."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    def stats(self):
+        """Counters for monitoring the cache's effectiveness."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+
+# the process-wide cache used by KGAgent.query_kg
+query_cache = QueryCache(max_entries = int(os.environ.get("KG_QUERY_CACHE_SIZE", 512)),
+                         ttl = float(os.environ.get("KG_QUERY_CACHE_TTL", 3600)),
+                         version = os.environ.get("KG_VERSION", ""))
+telemetry.add_gauges("query_cache", query_cache.stats)
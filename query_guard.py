@@ -0,0 +1,132 @@
+## Pre-flight checks for agent-generated cypher, run before the query touches the database.
+##
+## 1. enforce_limit() injects a LIMIT into the final RETURN if there is none, or tightens one that is too large.
+## 2. check_plan() inspects the EXPLAIN plan's operators and row estimates, and rejects queries that are likely
+##    to be very expensive (large cartesian products, unbounded variable-length expansions, full node scans)
+##    with feedback the agent can act on.
+## Queries themselves run under a server-side transaction timeout (tx_timeout).
+##
+## Configuration (via environment / .env file):
+##   KG_GUARD_DEFAULT_LIMIT          - LIMIT added to queries that have none (default 1000)
+##   KG_GUARD_MAX_LIMIT              - larger literal LIMITs are lowered to this (default 5000)
+##   KG_GUARD_MAX_ESTIMATED_ROWS     - reject if any operator is estimated to produce more rows (default 10000000)
+##   KG_GUARD_MAX_RISKY_ROWS         - reject if a risky operator (see RISKY_OPERATORS) is estimated above this (default 100000)
+##   KG_TX_TIMEOUT                   - server-side transaction timeout in seconds (default 30)
+
+import os
+import re
+from cypher_utils import mask_quoted, split_quoted
+
+
+# operators that are a common sign of a badly-formed query, with advice for the agent
+RISKY_OPERATORS = {
+    "CartesianProduct": "The query contains disconnected patterns, producing a cartesian product. Connect the patterns with relationships, or split it into separate queries.",
+    "AllNodesScan": "The query scans every node in the graph. Add a label and, ideally, an `id` property to the starting node, e.g. (d:`biolink:Disease` {id: 'MONDO:0007523'}).",
+    "VarLengthExpand": "The query uses an unbounded variable-length relationship. Give it an upper bound, e.g. [:`biolink:subclass_of`*1..3].",
+}
+
+# an unbounded variable-length pattern: [*], [:rel*], [:rel*2..] or [:rel*..]
+_UNBOUNDED_VARLENGTH = re.compile(r"\*\s*(?:\d*\s*\.\.\s*)?\]")
+
+
+class QueryRejected(Exception):
+    """Raised when a query's plan looks too expensive to run."""
+
+
+
+class QueryGuard:
+    """Holds the guard's limits; see module comments for what each one does."""
+
+    def __init__(self, default_limit = 1000, max_limit = 5000, max_estimated_rows = 10_000_000, max_risky_rows = 100_000, tx_timeout = 30):
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.max_estimated_rows = max_estimated_rows
+        self.max_risky_rows = max_risky_rows
+        self.tx_timeout = tx_timeout
+
+
+    def enforce_limit(self, query):
+        """Return (query, note): the query with a LIMIT added to (or tightened on) its final RETURN, and a note for the agent describing any change (or None)."""
+        query = _strip_tail(query)
+        masked = mask_quoted(query)
+
+        # UNION queries need a LIMIT per branch; leave those to the plan check
+        if re.search(r"(?<![\w.:$])UNION(?!\w)", masked, re.IGNORECASE):
+            return query, None
+
+        # find the last RETURN that is not inside a subquery or pattern block
+        final_return = None
+        for match in re.finditer(r"(?<![\w.:$])RETURN(?!\w)", masked, re.IGNORECASE):
+            if masked.count("{", 0, match.start()) == masked.count("}", 0, match.start()):
+                final_return = match
+        if final_return is None:
+            return query, None
+
+        limit = re.search(r"(?<![\w.:$])LIMIT\s+(\S+)\s*$", masked[final_return.start():], re.IGNORECASE)
+        if limit is None:
+            return f"{query} LIMIT {self.default_limit}", f"LIMIT {self.default_limit} was added to the query."
+
+        value = limit.group(1)
+        if value.isdigit() and int(value) > self.max_limit:
+            start = final_return.start() + limit.start(1)
+            return query[:start] + str(self.max_limit) + query[start + len(value):], f"The query's LIMIT was lowered from {value} to {self.max_limit}."
+
+        return query, None
+
+
+    def check_plan(self, plan, query):
+        """Raise QueryRejected if an EXPLAIN plan (summary.plan) looks too expensive to run."""
+        problems = []
+        unbounded = _UNBOUNDED_VARLENGTH.search(mask_quoted(query)) is not None
+
+        for operator, estimated_rows in _plan_operators(plan):
+            if estimated_rows > self.max_estimated_rows:
+                problems.append(f"The {operator} step is estimated to produce {estimated_rows:,.0f} rows. Make the query more specific, e.g. by starting from nodes matched by `id`.")
+
+            risky = RISKY_OPERATORS.get(operator)
+            if risky is None or estimated_rows <= self.max_risky_rows:
+                continue
+            # bounded variable-length expansions are fine if the agent asked for them explicitly
+            if operator == "VarLengthExpand" and not unbounded:
+                continue
+            problems.append(f"{risky} (The {operator} step is estimated to produce {estimated_rows:,.0f} rows.)")
+
+        if problems:
+            feedback = "\n".join(f"- {p}" for p in dict.fromkeys(problems))
+            raise QueryRejected(f"The query was not run, because its plan looks too expensive:\n{feedback}")
+
+
+
+def _strip_tail(query):
+    """Remove trailing whitespace, semicolons and comments, so anything appended to the query is not commented out."""
+    while True:
+        stripped = query.strip().rstrip(";").rstrip()
+        segments = split_quoted(stripped)
+        if segments and segments[-1][1] and segments[-1][0].startswith(("//", "/*")):
+            stripped = stripped[:-len(segments[-1][0])]
+        if stripped == query:
+            return query
+        query = stripped
+
+
+
+def _plan_operators(plan):
+    """Yield (operator name, estimated rows) for every operator in a plan tree."""
+    if not plan:
+        return
+
+    # operator types look like "VarLengthExpand(All)@neo4j"
+    operator = re.split(r"[(@]", plan.get("operatorType", ""), maxsplit=1)[0]
+    yield operator, float(plan.get("args", plan.get("arguments", {})).get("EstimatedRows", 0))
+
+    for child in plan.get("children", []):
+        yield from _plan_operators(child)
+
+
+
+# the process-wide guard used by KGAgent.query_kg
+query_guard = QueryGuard(default_limit = int(os.environ.get("KG_GUARD_DEFAULT_LIMIT", 1000)),
+                         max_limit = int(os.environ.get("KG_GUARD_MAX_LIMIT", 5000)),
+                         max_estimated_rows = float(os.environ.get("KG_GUARD_MAX_ESTIMATED_ROWS", 10_000_000)),
+                         max_risky_rows = float(os.environ.get("KG_GUARD_MAX_RISKY_ROWS", 100_000)),
+                         tx_timeout = float(os.environ.get("KG_TX_TIMEOUT", 30)))
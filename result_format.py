@@ -0,0 +1,56 @@
+## Compact encodings of query results for the model.
+##
+## json.dumps([record.data(), ...]) repeats every column name (`g.id`, `g.name`, ...) on every row. For
+## tabular results we can instead send the column names once, followed by rows of values, and optionally
+## replace long values that repeat across rows (e.g. the disease every row is about) with short references.
+## compact_rows() picks whichever encoding is smallest, so small or irregular results stay as plain records.
+
+import json
+from collections import Counter
+
+
+# repeated strings shorter than this aren't worth replacing with a reference
+MIN_REPEATED_LENGTH = 12
+
+
+def as_table(rows):
+    """Encode rows (dicts with the same keys) as {"columns": [...], "rows": [[...], ...]}, or None if they aren't tabular."""
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        return None
+
+    columns = list(rows[0].keys())
+    if any(list(row.keys()) != columns for row in rows):
+        return None
+
+    return {"columns": columns, "rows": [[row[c] for c in columns] for row in rows]}
+
+
+def with_repeated_values(table):
+    """Replace long string values that occur more than once in a table with "@N" references, listed once under "repeated_values".
+    Returns None if there is nothing to replace (or references would be ambiguous)."""
+    cells = [v for row in table["rows"] for v in row if isinstance(v, str)]
+    if any(v.startswith("@") for v in cells):
+        return None
+
+    repeated = [v for v, n in Counter(cells).most_common() if n > 1 and len(v) >= MIN_REPEATED_LENGTH]
+    if not repeated:
+        return None
+
+    refs = {v: f"@{i + 1}" for i, v in enumerate(repeated)}
+    return {
+        "columns": table["columns"],
+        "repeated_values": {ref: v for v, ref in refs.items()},
+        "rows": [[refs.get(v, v) if isinstance(v, str) else v for v in row] for row in table["rows"]],
+    }
+
+
+def compact_rows(rows, size = lambda obj: len(json.dumps(obj))):
+    """Return the smallest of: the rows as-is, as a table, or as a table with repeated values replaced.
+    size measures an encoding (by default its JSON length in characters; pass a token counter for exact comparisons)."""
+    candidates = [rows]
+    if (table := as_table(rows)) is not None:
+        candidates.append(table)
+        if (deduped := with_repeated_values(table)) is not None:
+            candidates.append(deduped)
+
+    return min(candidates, key=size)
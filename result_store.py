@@ -0,0 +1,53 @@
+## Per-agent store of query results that were too large to return in one response.
+##
+## Instead of asking the model to rewrite and re-run a large query, query_kg returns the first page along
+## with a handle, and the rest of the rows stay here so fetch_page() can serve later pages without running
+## the query again. Each agent (and so each Streamlit session) has its own store, bounded in both the number
+## of results kept (oldest evicted first) and the rows kept per result. A store isn't thread-safe: it is only used
+## from its agent's event loop (query_kg and fetch_page are both coroutines).
+
+from collections import OrderedDict
+
+
+class StoredResult:
+    """Rows of one stored query result; complete is False if the result had more rows than were kept."""
+
+    def __init__(self, query, rows, complete):
+        self.query = query
+        self.rows = rows
+        self.complete = complete
+
+
+
+class ResultStore:
+    """Bounded mapping of handles to stored results, evicting the least recently used."""
+
+    def __init__(self, max_results = 5, max_rows = 2000):
+        self.max_results = max_results
+        self.max_rows = max_rows
+
+        self._results = OrderedDict()
+        self._next_id = 1
+
+
+    def add(self, query, rows, complete):
+        """Store a result and return its handle."""
+        handle = f"r{self._next_id}"
+        self._next_id += 1
+
+        self._results[handle] = StoredResult(query, rows[:self.max_rows], complete and len(rows) <= self.max_rows)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+        return handle
+
+
+    def get(self, handle):
+        """Return the stored result for handle, or None if it is unknown or was evicted."""
+        stored = self._results.get(handle)
+        if stored is not None:
+            self._results.move_to_end(handle)
+        return stored
+
+
+    def clear(self):
+        self._results.clear()
@@ -0,0 +1,250 @@
+## A snapshot of the knowledge graph's schema, introspected from the database and kept on disk.
+##
+## The snapshot lists node labels (with counts, property keys and types, and a few example nodes) and relationship
+## types (with counts, the label pairs they connect, and property keys and types). Counts come from Neo4j's count
+## store, properties from db.schema.nodeTypeProperties()/relTypeProperties(), and endpoint label pairs from a sample
+## of each type's relationships. Multi-labelled nodes are reported under their most specific (least common) label.
+##
+## It is written to KG_SCHEMA_SNAPSHOT (default kg_schema.json) with the graph's build tag, and reused as long as
+## the tag is unchanged: the tag is KG_VERSION if set, otherwise the graph's node and relationship counts.
+##
+## Loading (or building) takes a round trip to the database at least, so it happens once per process in a background
+## thread, started by preload() when the app starts. Agents include get_summary() (the snapshot rendered by
+## summary_markdown(), cached) in their prompts instead of probing the graph; until the snapshot is ready, or if the
+## graph can't be reached, they fall back to a hand-written summary.
+##
+## While the app runs, refresh() (called on every query_kg) re-reads the graph's tag in the background, at most every
+## KG_VERSION_CHECK_INTERVAL seconds (default 60). If the graph was rebuilt, cached query results are dropped (see
+## query_cache.set_version) and the snapshot is rebuilt.
+##
+## To rebuild it by hand (from the repo root, with NEO4J_BOLT set):
+##   python schema_snapshot.py
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+import kg_driver
+from query_cache import query_cache
+
+
+FORMAT_VERSION = 1
+
+# relationships sampled per type to find the label pairs they connect
+ENDPOINT_SAMPLE = 500
+# example nodes kept per label
+EXAMPLES_PER_LABEL = 3
+# after a failure to load or build the snapshot, seconds before get_schema() tries again
+RETRY_AFTER = 300
+# seconds between checks of the graph's tag by refresh()
+CHECK_INTERVAL = float(os.environ.get("KG_VERSION_CHECK_INTERVAL", 60))
+
+
+def _quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+
+async def graph_tag(driver):
+    """The graph's build tag: KG_VERSION if set, otherwise its node and relationship counts (read from the count store, so cheap)."""
+    if version := os.environ.get("KG_VERSION"):
+        return version
+    async with driver.session() as session:
+        nodes = (await (await session.run("MATCH (n) RETURN count(n) AS n")).single())["n"]
+        relationships = (await (await session.run("MATCH ()-[r]->() RETURN count(r) AS n")).single())["n"]
+    return f"{nodes}n-{relationships}r"
+
+
+
+async def introspect(driver):
+    """Read the schema from the database; returns the snapshot dict (without its tag)."""
+    async with driver.session() as session:
+        async def rows(query, **parameters):
+            return await (await session.run(query, parameters)).data()
+
+        label_names = [r["label"] for r in await rows("CALL db.labels() YIELD label RETURN label")]
+        type_names = [r["relationshipType"] for r in await rows("CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")]
+
+        labels = {}
+        for label in label_names:
+            count = (await rows(f"MATCH (n:{_quote(label)}) RETURN count(n) AS n"))[0]["n"]
+            labels[label] = {"count": count, "properties": {}, "examples": []}
+
+        def most_specific(node_labels):
+            known = [l for l in node_labels if l in labels]
+            return min(known, key = lambda l: labels[l]["count"]) if known else None
+
+        for r in await rows("CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName, propertyTypes "
+                            "RETURN nodeLabels, propertyName, propertyTypes"):
+            if r["propertyName"] and (label := most_specific(r["nodeLabels"])):
+                types = labels[label]["properties"].setdefault(r["propertyName"], [])
+                types.extend(t for t in r["propertyTypes"] or [] if t not in types)
+
+        for label in labels:
+            labels[label]["examples"] = await rows(f"MATCH (n:{_quote(label)}) RETURN n.id AS id, n.name AS name LIMIT $limit", limit = EXAMPLES_PER_LABEL)
+
+        relationships = {}
+        for rel_type in type_names:
+            count = (await rows(f"MATCH ()-[r:{_quote(rel_type)}]->() RETURN count(r) AS n"))[0]["n"]
+            pairs = Counter()
+            for r in await rows(f"MATCH (a)-[r:{_quote(rel_type)}]->(b) WITH a, b LIMIT $limit RETURN labels(a) AS source, labels(b) AS target",
+                                limit = ENDPOINT_SAMPLE):
+                pairs[(most_specific(r["source"]), most_specific(r["target"]))] += 1
+            relationships[rel_type] = {"count": count,
+                                       "endpoints": [[source, target, n] for (source, target), n in pairs.most_common()],
+                                       "properties": {}}
+
+        for r in await rows("CALL db.schema.relTypeProperties() YIELD relType, propertyName, propertyTypes "
+                            "RETURN relType, propertyName, propertyTypes"):
+            # relType looks like ":`biolink:causes`"
+            rel_type = r["relType"].lstrip(":").strip("`").replace("``", "`")
+            if r["propertyName"] and rel_type in relationships:
+                types = relationships[rel_type]["properties"].setdefault(r["propertyName"], [])
+                types.extend(t for t in r["propertyTypes"] or [] if t not in types)
+
+    return {"format": FORMAT_VERSION, "labels": labels, "relationships": relationships}
+
+
+
+def load_or_build(path):
+    """Blocking; see _load_or_build()."""
+    return kg_driver.run_sync(lambda driver: _load_or_build(driver, path))
+
+
+
+async def _load_or_build(driver, path):
+    """Return the snapshot at path if it was built for the graph's current tag, otherwise introspect the graph and write a new one."""
+    tag = await graph_tag(driver)
+    if os.path.exists(path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get("format") == FORMAT_VERSION and snapshot.get("kg_version") == tag:
+            return snapshot
+
+    snapshot = {"kg_version": tag, "built_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), **await introspect(driver)}
+    # write to a temp file first, so a concurrent reader never sees a partial snapshot
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f, indent = 1)
+    os.replace(path + ".tmp", path)
+    return snapshot
+
+
+
+def summary_markdown(snapshot, max_examples = 1):
+    """Render a snapshot as compact markdown for a system prompt."""
+    lines = [f"## Node Labels (graph version {snapshot['kg_version']})", ""]
+    for label, info in sorted(snapshot["labels"].items(), key = lambda item: -item[1]["count"]):
+        properties = ", ".join(f"`{p}` ({'/'.join(t)})" for p, t in sorted(info["properties"].items()))
+        examples = "; ".join(f"`{e['id']}` {e['name']}" for e in info["examples"][:max_examples] if e.get("id"))
+        lines.append(f"- `{label}`: {info['count']} nodes" + (f"; properties: {properties}" if properties else "") + (f"; e.g. {examples}" if examples else ""))
+
+    lines += ["", "## Relationship Types", ""]
+    for rel_type, info in sorted(snapshot["relationships"].items(), key = lambda item: -item[1]["count"]):
+        endpoints = ", ".join(f"`{s}`->`{t}`" for s, t, _ in info["endpoints"][:5])
+        properties = ", ".join(f"`{p}`" for p in sorted(info["properties"]))
+        lines.append(f"- `{rel_type}`: {info['count']} relationships" + (f"; connects {endpoints}" if endpoints else "") + (f"; properties: {properties}" if properties else ""))
+
+    return "\n".join(lines)
+
+
+
+_lock = threading.Lock()
+_schema = None
+_summary = None  # summary_markdown(_schema), rendered once
+_loading = None  # the thread loading the snapshot
+_failed_at = None
+_checking = None  # the thread checking the graph's tag, see refresh()
+_checked_at = None
+
+
+def _load():
+    global _schema, _summary, _failed_at
+
+    try:
+        schema = load_or_build(os.environ.get("KG_SCHEMA_SNAPSHOT", "kg_schema.json"))
+        summary = summary_markdown(schema)
+    except Exception as e:
+        with _lock:
+            _failed_at = time.monotonic()
+        logging.getLogger(__name__).warning(f"Could not load or build the schema snapshot: {e}")
+        return
+
+    with _lock:
+        _schema, _summary = schema, summary
+    # cached query results from another build of the graph are dropped
+    query_cache.set_version(schema["kg_version"])
+
+
+def preload():
+    """Start loading (or building) the process-wide snapshot in a background thread, unless it is loaded, loading, or failed
+    less than RETRY_AFTER seconds ago. Returns the loading thread, if any."""
+    global _loading
+
+    with _lock:
+        if _schema is None and not (_loading is not None and _loading.is_alive()) and (_failed_at is None or time.monotonic() - _failed_at > RETRY_AFTER):
+            _loading = threading.Thread(target = _load, name = "schema-snapshot", daemon = True)
+            _loading.start()
+        return _loading if _schema is None else None
+
+
+def _check():
+    try:
+        tag = kg_driver.run_sync(graph_tag)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not check the graph's version: {e}")
+        return
+
+    if tag != (_schema or {}).get("kg_version"):
+        logging.getLogger(__name__).info(f"The graph's version changed to {tag}; rebuilding the schema snapshot")
+        # cached results are dropped straight away, even if rebuilding the snapshot then fails
+        query_cache.set_version(tag)
+        _load()
+
+
+def refresh():
+    """Start a background check of the graph's tag, if the snapshot is loaded and the last check was at least CHECK_INTERVAL
+    seconds ago; if the tag changed, cached query results are dropped and the snapshot is rebuilt. Never blocks.
+    Returns the checking thread, if one was started."""
+    global _checking, _checked_at
+
+    if _schema is None:
+        preload()
+        return None
+    with _lock:
+        now = time.monotonic()
+        if (_checking is not None and _checking.is_alive()) or (_checked_at is not None and now - _checked_at < CHECK_INTERVAL):
+            return None
+        _checked_at = now
+        _checking = threading.Thread(target = _check, name = "schema-snapshot-check", daemon = True)
+        _checking.start()
+        return _checking
+
+
+def get_schema(wait = None):
+    """The process-wide schema snapshot, or None if it isn't loaded (yet), in which case loading is started (see preload()).
+    Never blocks, unless wait is given: then a load in progress is waited for, up to wait seconds."""
+    if (loading := preload()) is not None and wait:
+        loading.join(wait)
+    return _schema
+
+
+def get_summary(wait = None):
+    """The snapshot rendered as markdown (see summary_markdown()), or None if it isn't loaded; see get_schema()."""
+    get_schema(wait)
+    return _summary
+
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv()
+
+    path = os.environ.get("KG_SCHEMA_SNAPSHOT", "kg_schema.json")
+    if os.path.exists(path):
+        os.remove(path)
+    snapshot = load_or_build(path)
+    kg_driver.close()
+    print(f"Wrote {path}: {len(snapshot['labels'])} labels, {len(snapshot['relationships'])} relationship types, graph version {snapshot['kg_version']}")
@@ -0,0 +1,188 @@
+## Timing spans on the hot path: model completions, tool calls, Neo4j execution, entity search, tokenization
+## and result serialization.
+##
+## Spans are aggregated by name (count, total, max, and percentiles over a window of recent samples) in a
+## process-wide Metrics, and in the Metrics of the agent they ran for (so per session, as each session has its
+## own agents). Neo4j's own timings from the result summary are recorded as spans too:
+##   neo4j.available_after  - server time until the first record was available (planning and start of execution)
+##   neo4j.consumed_after   - server time from then until the result was consumed
+##
+## Components with their own counters (e.g. the LLM scheduler's queue depth) register them with add_gauges().
+##
+## Export: prometheus_text() renders metrics and gauges in the Prometheus text format, served at /metrics by
+## serve_prometheus() (started by the app if METRICS_PORT is set), and to_jsonl() renders one JSON line per span.
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SpanStats:
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen = max_samples)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def quantile(self, q):
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+
+class Metrics:
+    """Span timings aggregated by name; thread-safe, since spans end on the driver's loop and in tool threads too."""
+
+    def __init__(self, max_samples = 1024):
+        self.max_samples = max_samples
+        self._spans = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, name, seconds):
+        with self._lock:
+            if (stats := self._spans.get(name)) is None:
+                stats = self._spans[name] = SpanStats(self.max_samples)
+            stats.add(seconds)
+
+
+    def snapshot(self):
+        """Return {span name: {count, total_s, mean_s, p50_s, p95_s, max_s}}, sorted by total time."""
+        with self._lock:
+            snapshot = {name: {"count": s.count,
+                               "total_s": s.total,
+                               "mean_s": s.total / s.count,
+                               "p50_s": s.quantile(0.5),
+                               "p95_s": s.quantile(0.95),
+                               "max_s": s.max} for name, s in self._spans.items()}
+        return dict(sorted(snapshot.items(), key = lambda item: item[1]["total_s"], reverse = True))
+
+
+    def merge(self, *others):
+        """Add the spans of other Metrics into this one (e.g. to total a session's agents); returns self."""
+        for other in others:
+            with other._lock:
+                spans = [(name, list(s.samples), s.count, s.total, s.max) for name, s in other._spans.items()]
+            with self._lock:
+                for name, samples, count, total, max_ in spans:
+                    if (stats := self._spans.get(name)) is None:
+                        stats = self._spans[name] = SpanStats(self.max_samples)
+                    stats.count += count
+                    stats.total += total
+                    stats.max = max(stats.max, max_)
+                    stats.samples.extend(samples)
+        return self
+
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+
+# spans of the whole process
+process_metrics = Metrics()
+
+
+def record(name, seconds, *metrics):
+    """Record a span that was timed elsewhere (e.g. by the server) in the process metrics and the given ones."""
+    process_metrics.record(name, seconds)
+    for m in metrics:
+        if m is not None:
+            m.record(name, seconds)
+
+
+@contextmanager
+def span(name, *metrics):
+    """Time the enclosed block as a span, recorded in the process metrics and the given ones (e.g. an agent's)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, *metrics)
+
+
+
+# group name -> function returning {name: number}, read when metrics are exported
+gauges = {}
+
+
+def add_gauges(group, stats):
+    """Export the numbers returned by stats() (e.g. a queue's depth) alongside the spans, as gauges named group_name."""
+    gauges[group] = stats
+
+
+def gauge_values():
+    """Return {group_name: value} of the current values of all registered gauges."""
+    return {f"{group}_{name}": value for group, stats in gauges.items() for name, value in stats().items()
+            if isinstance(value, (int, float))}
+
+
+
+def prometheus_text(metrics = process_metrics, prefix = "kg_agent"):
+    """Render span timings in the Prometheus text exposition format, as a summary per span, followed by the registered gauges."""
+    lines = [f"# HELP {prefix}_span_seconds Time spent in instrumented spans.", f"# TYPE {prefix}_span_seconds summary"]
+    for name, s in metrics.snapshot().items():
+        label = json.dumps(name)
+        lines.append(f'{prefix}_span_seconds{{span={label},quantile="0.5"}} {s["p50_s"]:.6f}')
+        lines.append(f'{prefix}_span_seconds{{span={label},quantile="0.95"}} {s["p95_s"]:.6f}')
+        lines.append(f'{prefix}_span_seconds_sum{{span={label}}} {s["total_s"]:.6f}')
+        lines.append(f'{prefix}_span_seconds_count{{span={label}}} {s["count"]}')
+    if metrics is process_metrics:
+        for name, value in gauge_values().items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def to_jsonl(metrics = process_metrics, **fields):
+    """Render span timings as JSON lines, one per span, with a timestamp and any extra fields (e.g. a session id)."""
+    now = time.time()
+    return "".join(json.dumps({"time": now, **fields, "span": name, **stats}) + "\n" for name, stats in metrics.snapshot().items())
+
+
+def write_jsonl(path, metrics = process_metrics, **fields):
+    """Append the current span timings to a JSON lines file."""
+    with open(path, "a") as f:
+        f.write(to_jsonl(metrics, **fields))
+
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_prometheus(port):
+    """Serve the process metrics at http://0.0.0.0:port/metrics from a background thread; only the first call starts a server."""
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target = _server.serve_forever, name = "metrics-server", daemon = True).start()
+    return _server
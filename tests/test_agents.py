@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import threading
+import pytest
+
+pytest.importorskip("kani")
+pytest.importorskip("neo4j")
+pytest.importorskip("streamlit")
+os.environ.setdefault("NEO4J_BOLT", "bolt://stand-in")
+
+import kg_driver
+import kani_streamlit
+from agents import KGAgent
+from query_cache import query_cache
+from benchmarks.stand_ins import FakeDriver, ScriptedEngine
+
+
+@pytest.fixture
+def agent():
+    kg_driver.set_driver(FakeDriver(rows_per_query = 3000))
+    query_cache.clear()
+    yield KGAgent(ScriptedEngine([]), max_response_tokens = 1000)
+    kg_driver.set_driver(None)
+    query_cache.clear()
+
+
+def test_rows_are_fitted_exactly_off_the_driver_loop(agent, monkeypatch):
+    threads = set()
+    message_len = kani_streamlit.token_lengths.message_len
+
+    def recording(engine, message):
+        threads.add(threading.current_thread().name)
+        return message_len(engine, message)
+
+    monkeypatch.setattr(kani_streamlit.token_lengths, "message_len", recording)
+    rows, overflow, complete = asyncio.run(agent._fetch_within_budget("MATCH (g:`biolink:Gene`) RETURN g.id AS id, g.name AS name, g.category AS category", 1000))
+
+    assert "background-loop" not in threads
+    count, used = agent._fit_rows(rows + overflow, 1000)
+    assert count == len(rows) and 900 < used <= 1000
+    # the rest is kept for paging, up to the result store's limit
+    assert len(rows) + len(overflow) == agent.result_store.max_rows
+    assert not complete
+
+
+def test_small_results_are_read_whole(agent):
+    rows, overflow, complete = asyncio.run(agent._fetch_within_budget("MATCH (g:`biolink:Gene`) RETURN g.id AS id LIMIT 5", 1000))
+    assert len(rows) == 5 and overflow == [] and complete
+
+
+def test_query_kg_reports_overflow_handle(agent):
+    result = asyncio.run(agent.query_kg("MATCH (g:`biolink:Gene`) RETURN g.id AS id, g.name AS name"))
+    assert "call fetch_page with handle 'r1'" in result
+    page = asyncio.run(agent.fetch_page("r1", 10))
+    assert json.loads(page.split("\n\nNOTE:")[0])
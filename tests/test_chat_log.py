@@ -0,0 +1,72 @@
+import io
+import json
+import threading
+import pytest
+from chat_log import ChatLog, truncate
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_written_as_json_lines_on_stop():
+    stream = io.StringIO()
+    log = ChatLog(stream = stream, max_chars = 10)
+    for i in range(100):
+        log.log("message", session = "s1", index = i, text = "x" * 50)
+    # stop() flushes everything still queued before returning
+    log.stop()
+
+    entries = lines(stream)
+    assert [e["index"] for e in entries] == list(range(100))
+    assert entries[0]["event"] == "message" and entries[0]["level"] == "INFO" and entries[0]["session"] == "s1"
+    assert entries[0]["text"] == "x" * 10 + "... [truncated 40 characters]"
+
+
+def test_pydantic_models_are_dumped():
+    kani = pytest.importorskip("kani")
+    stream = io.StringIO()
+    log = ChatLog(stream = stream)
+    log.log("message", message = kani.ChatMessage.user("Which genes?"))
+    log.stop()
+    assert lines(stream)[0]["message"]["content"] == "Which genes?"
+
+
+def test_records_are_dropped_when_the_queue_is_full():
+    class BlockedStream(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.writing = threading.Event()
+            self.release = threading.Event()
+
+        def write(self, text):
+            self.writing.set()
+            self.release.wait(5)
+            return super().write(text)
+
+    stream = BlockedStream()
+    log = ChatLog(stream = stream, queue_size = 2)
+    log.log("first")
+    # the writer is stuck on the first record, so two more fill the queue and the rest are dropped
+    assert stream.writing.wait(5)
+    for i in range(5):
+        log.log("more", index = i)
+    assert log.dropped == 3
+
+    stream.release.set()
+    log.stop()
+    assert [e["event"] for e in lines(stream)] == ["first", "more", "more"]
+
+
+def test_log_restarts_after_stop():
+    stream = io.StringIO()
+    log = ChatLog(stream = stream)
+    log.log("one")
+    log.stop()
+    log.log("two")
+    log.stop()
+    assert [e["event"] for e in lines(stream)] == ["one", "two"]
+
+
+def test_truncate_nested_values():
+    assert truncate({"a": ["xxxx", {"b": "yy"}], "n": 12345}, 2) == {"a": ["xx... [truncated 2 characters]", {"b": "yy"}], "n": 12345}
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("neo4j")
+
+import kg_driver
+from competency_runner import run_questions
+
+
+class _Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, n):
+        return self.rows[:n]
+
+    async def consume(self):
+        pass
+
+
+class _Driver:
+    """Queries containing BROKEN fail while broken is set; others return three rows, or none if they contain EMPTY."""
+
+    def __init__(self):
+        self.broken = True
+        self.queries = []
+
+    def session(self, **kwargs):
+        driver = self
+
+        class Session:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def run(self, query, parameters = None):
+                driver.queries.append(query.text)
+                if driver.broken and "BROKEN" in query.text:
+                    raise RuntimeError("database unavailable")
+                return _Result([{}] * (0 if "EMPTY" in query.text else 3))
+
+        return Session()
+
+
+QUESTIONS = [{"question": "ok?", "query": "RETURN 1"}, {"question": "empty?", "query": "RETURN EMPTY"}, {"question": "broken?", "query": "RETURN BROKEN"}]
+
+
+@pytest.fixture
+def driver():
+    driver = _Driver()
+    kg_driver.set_driver(driver)
+    yield driver
+    kg_driver.set_driver(None)
+
+
+def test_report_and_progress(driver, tmp_path):
+    seen = []
+    report = asyncio.run(run_questions(QUESTIONS, str(tmp_path / "report"), on_result = seen.append))
+    assert [r["status"] for r in report["results"]] == ["pass", "fail", "error"]
+    assert sorted(e["question"] for e in seen) == ["broken?", "empty?", "ok?"]
+    assert report["summary"]["passed"] == 1
+    assert json.loads((tmp_path / "report.json").read_text())["summary"]["errors"] == 1
+
+
+def test_resume_reruns_only_errors(driver, tmp_path):
+    asyncio.run(run_questions(QUESTIONS, str(tmp_path / "report")))
+    driver.broken = False
+    driver.queries.clear()
+    report = asyncio.run(run_questions(QUESTIONS, str(tmp_path / "report"), resume = True))
+    assert driver.queries == ["RETURN BROKEN"]
+    assert [r["status"] for r in report["results"]] == ["pass", "fail", "pass"]
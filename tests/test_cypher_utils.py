@@ -0,0 +1,64 @@
+from cypher_utils import mask_quoted, normalize_query, parameterize
+
+
+def test_lifts_strings_and_numbers():
+    query, params = parameterize("MATCH (d {id: 'MONDO:0007523'}) WHERE d.score > 0.5 RETURN d LIMIT 10")
+    assert query == "MATCH (d {id: $lit0}) WHERE d.score > $lit1 RETURN d LIMIT $lit2"
+    assert params == {"lit0": "MONDO:0007523", "lit1": 0.5, "lit2": 10}
+
+
+def test_repeated_literals_share_a_parameter():
+    query, params = parameterize("MATCH (a {id: 'X'}), (b {id: 'X'}) RETURN a, b")
+    assert query == "MATCH (a {id: $lit0}), (b {id: $lit0}) RETURN a, b"
+    assert params == {"lit0": "X"}
+
+
+def test_same_shape_for_different_entities():
+    assert parameterize("MATCH (d {id: 'A'}) RETURN d")[0] == parameterize("MATCH (d {id: \"B\"}) RETURN d")[0]
+
+
+def test_variable_length_bounds_are_kept():
+    for pattern in ["[r*1..2]", "[r* 1 .. 2]", "[:`biolink:subclass_of`*..3]", "[* 2]", "[r*2.. ]"]:
+        query = f"MATCH (a)-{pattern}->(b) RETURN b"
+        assert parameterize(query) == (query, {})
+
+
+def test_identifiers_properties_and_parameters_are_kept():
+    query = "MATCH (n1)-[:R]->(n2) WHERE n1.x2 = $p0 RETURN n1.a1"
+    assert parameterize(query) == (query, {})
+
+
+def test_escapes_and_unsupported_escapes():
+    assert parameterize(r"MATCH (n) WHERE n.name = 'it\'s' RETURN n")[1] == {"lit0": "it's"}
+    assert parameterize(r"MATCH (n) WHERE n.name = '\q' RETURN n") == (r"MATCH (n) WHERE n.name = '\q' RETURN n", {})
+
+
+def test_projection_literals_are_kept():
+    # the text of an unaliased expression is its column's name
+    for query in ["MATCH (n) RETURN count(*) > 5", "MATCH (n) RETURN n.name STARTS WITH 'Fan', 'label' AS kind, n.score * 100",
+                  "MATCH (n) WITH n, 2 AS k RETURN n", "MATCH (n) RETURN [m IN n.list WHERE m > 3 | m]", "RETURN 1 UNION RETURN 2"]:
+        assert parameterize(query) == (query, {})
+
+
+def test_literals_after_projections_are_lifted():
+    query, params = parameterize("MATCH (n) WITH n, 'x' AS k WHERE n.score > 0.5 MATCH (n)-->(m {id: 'A'}) "
+                                 "RETURN m.name STARTS WITH 'Fan' ORDER BY m.score DESC SKIP 5 LIMIT 10")
+    assert query == ("MATCH (n) WITH n, 'x' AS k WHERE n.score > $lit0 MATCH (n)-->(m {id: $lit1}) "
+                     "RETURN m.name STARTS WITH 'Fan' ORDER BY m.score DESC SKIP $lit2 LIMIT $lit3")
+    assert params == {"lit0": 0.5, "lit1": "A", "lit2": 5, "lit3": 10}
+    # STARTS WITH is an operator, not a WITH clause
+    assert parameterize("MATCH (n) WHERE n.name STARTS WITH 'Fan' RETURN n")[1] == {"lit0": "Fan"}
+    # a subquery's RETURN ends with its block
+    assert parameterize("CALL { MATCH (n {id: 'X'}) RETURN n } MATCH (n)-->(m {id: 'Y'}) RETURN m") == \
+        ("CALL { MATCH (n {id: $lit0}) RETURN n } MATCH (n)-->(m {id: $lit1}) RETURN m", {"lit0": "X", "lit1": "Y"})
+
+
+def test_comments_and_backticks_untouched():
+    query, params = parameterize("MATCH (n:`label 1`) // 42\nRETURN n")
+    assert query == "MATCH (n:`label 1`) // 42\nRETURN n"
+    assert params == {}
+
+
+def test_normalize_and_mask():
+    assert normalize_query("match (n)   return n; ") == "MATCH (n) RETURN n"
+    assert mask_quoted("RETURN 'ab' // c") == "RETURN ____ ____"
@@ -0,0 +1,53 @@
+import itertools
+import pytest
+from entity_index import EntityIndex, build_index
+
+
+NODES = [
+    {"id": "HP:0001337", "name": "Tremor", "category": ["biolink:PhenotypicFeature"]},
+    {"id": "MONDO:0009061", "name": "cystic fibrosis", "synonym": ["mucoviscidosis"], "category": "biolink:Disease"},
+    {"id": "MONDO:0019391", "name": "Fanconi anemia", "category": "biolink:Disease"},
+    {"id": "HGNC:1884", "name": "CFTR", "category": "biolink:Gene", "in_taxon_label": "Homo sapiens"},
+]
+
+
+@pytest.fixture(scope = "module")
+def index(tmp_path_factory):
+    # thousands of filler terms sharing the first letters of the real ones, so recall can't depend on vocabulary position
+    filler = ["t" + "".join(letters) for letters in itertools.product("abcdefghijklmnopq", repeat = 3)]
+    filler += ["c" + "".join(letters) for letters in itertools.product("abcdefghijklmnopq", repeat = 3)]
+    nodes = NODES + [{"id": f"X:{i}", "name": word} for i, word in enumerate(filler)]
+    index_dir = tmp_path_factory.mktemp("entity_index")
+    build_index(nodes, str(index_dir))
+    return EntityIndex(str(index_dir))
+
+
+def ids(results):
+    return [item["id"] for item in results]
+
+
+def test_exact_match(index):
+    assert ids(index.search("cystic fibrosis"))[0] == "MONDO:0009061"
+
+
+def test_prefix_of_last_word(index):
+    assert ids(index.search("fanconi an"))[0] == "MONDO:0019391"
+
+
+def test_synonym(index):
+    assert ids(index.search("mucoviscidosis")) == ["MONDO:0009061"]
+
+
+def test_one_typo(index):
+    assert ids(index.search("tremer"))[0] == "HP:0001337"     # substitution
+    assert ids(index.search("tremorr"))[0] == "HP:0001337"    # insertion
+    assert ids(index.search("cystc fibrosis"))[0] == "MONDO:0009061"  # deletion
+
+
+def test_two_typos_do_not_match(index):
+    assert "HP:0001337" not in ids(index.search("trenar"))
+
+
+def test_slim_items(index):
+    assert index.search("cftr") == [{"id": "HGNC:1884", "category": "biolink:Gene", "name": "CFTR", "in_taxon_label": "Homo sapiens"}]
+    assert index.search("  ") == []
@@ -0,0 +1,38 @@
+from example_retrieval import ExampleRetriever, tokenize
+
+
+EXAMPLES = [
+    {"question": "What genes are associated with cystic fibrosis?", "search_terms": ["cystic fibrosis"]},
+    {"question": "Which phenotypes does Marfan syndrome have?", "search_terms": ["Marfan syndrome"]},
+    {"question": "What diseases are caused by mutations in the FBN1 gene?", "search_terms": ["FBN1"]},
+    {"question": "Which genes are orthologous to the mouse gene Pax6?", "search_terms": ["Pax6"]},
+]
+
+retriever = ExampleRetriever(EXAMPLES)
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What are the genes of FBN1?") == ["genes", "fbn1"]
+
+
+def test_most_relevant_first():
+    assert retriever.top_k("Which phenotypes are seen in Marfan syndrome patients?", k = 1) == [EXAMPLES[1]]
+    assert retriever.top_k("genes for cystic fibrosis", k = 2)[0] == EXAMPLES[0]
+
+
+def test_search_terms_are_indexed():
+    assert retriever.top_k("tell me about pax6", k = 1) == [EXAMPLES[3]]
+
+
+def test_rare_words_outweigh_common_ones():
+    # "genes" is in two examples, "fbn1" in one
+    assert retriever.top_k("genes fbn1", k = 1) == [EXAMPLES[2]]
+
+
+def test_only_matching_examples_are_returned():
+    assert retriever.top_k("Marfan syndrome", k = 3) == [EXAMPLES[1]]
+
+
+def test_falls_back_to_the_first_examples_if_nothing_matches():
+    assert retriever.top_k("zebrafish", k = 2) == EXAMPLES[:2]
+    assert ExampleRetriever([]).top_k("anything") == []
@@ -0,0 +1,46 @@
+import pytest
+from hierarchy_index import HierarchyIndex, build_index
+
+
+#        disease
+#        /     \
+#   genetic   rare
+#     |    \   |
+#   fanconi  cf
+EDGES = [
+    {"child": "MONDO:genetic", "child_name": "genetic disease", "parent": "MONDO:disease", "parent_name": "disease"},
+    {"child": "MONDO:rare", "child_name": "rare disease", "parent": "MONDO:disease", "parent_name": "disease"},
+    {"child": "MONDO:fanconi", "child_name": "Fanconi anemia", "parent": "MONDO:genetic", "parent_name": "genetic disease"},
+    {"child": "MONDO:cf", "child_name": "cystic fibrosis", "parent": "MONDO:genetic", "parent_name": "genetic disease"},
+    {"child": "MONDO:cf", "child_name": "cystic fibrosis", "parent": "MONDO:rare", "parent_name": "rare disease"},
+]
+
+
+@pytest.fixture(scope = "module")
+def index(tmp_path_factory):
+    index_dir = tmp_path_factory.mktemp("hierarchy_index")
+    build_index(iter(EDGES), str(index_dir))
+    return HierarchyIndex(str(index_dir))
+
+
+def test_ancestors_nearest_first(index):
+    assert index.ancestors("MONDO:cf") == [{"id": "MONDO:genetic", "name": "genetic disease", "depth": 1},
+                                           {"id": "MONDO:rare", "name": "rare disease", "depth": 1},
+                                           {"id": "MONDO:disease", "name": "disease", "depth": 2}]
+
+
+def test_descendants_with_max_depth(index):
+    assert [n["id"] for n in index.descendants("MONDO:disease")] == ["MONDO:genetic", "MONDO:rare", "MONDO:cf", "MONDO:fanconi"]
+    assert [n["id"] for n in index.descendants("MONDO:disease", max_depth = 1)] == ["MONDO:genetic", "MONDO:rare"]
+    assert index.descendants("MONDO:cf") == []
+
+
+def test_shared_ancestors_most_specific_first(index):
+    assert [(n["id"], n["depths"]) for n in index.shared_ancestors(["MONDO:cf", "MONDO:fanconi"])] == [("MONDO:genetic", [1, 1]), ("MONDO:disease", [2, 2])]
+    # a node counts as its own ancestor
+    assert index.shared_ancestors(["MONDO:cf", "MONDO:genetic"])[0]["id"] == "MONDO:genetic"
+
+
+def test_unknown_nodes(index):
+    assert index.ancestors("MONDO:unknown") is None
+    assert index.shared_ancestors(["MONDO:cf", "MONDO:unknown"]) is None
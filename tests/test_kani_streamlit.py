@@ -0,0 +1,251 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("kani")
+pytest.importorskip("streamlit")
+from kani import ChatMessage
+from kani.engines.base import BaseEngine, Completion
+from kani.engines.openai import OpenAIEngine
+from kani.exceptions import HTTPStatusException, MessageTooLong
+import kani_streamlit
+from kani_streamlit import StreamlitKani, export_chats, parse_chats, write_sessions, read_sessions
+from llm_scheduler import llm_scheduler
+
+
+class Engine(BaseEngine):
+    """Counts a token per character; predict() raises the queued errors first, then answers.
+    Agents leave 450 tokens of the context for the response (kani's desired_response_tokens), so prompts get 1550."""
+
+    max_context_size = 2000
+
+    def __init__(self, errors = ()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def message_len(self, message):
+        return len(message.text or "")
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return Completion(ChatMessage.assistant("OK."), prompt_tokens = 10, completion_tokens = 3)
+
+
+def http_error(status):
+    return HTTPStatusException(SimpleNamespace(status = status, headers = {}), f"{status} error")
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "backoff_base", 0.001)
+
+
+def test_server_error_is_retried_by_the_scheduler(fast_backoff):
+    engine = Engine([http_error(503)])
+    completion = asyncio.run(StreamlitKani(engine).get_model_completion())
+    assert completion.message.text == "OK."
+    assert engine.calls == 2
+
+
+def test_client_errors_are_not_retried(fast_backoff):
+    engine = Engine([http_error(400)])
+    with pytest.raises(HTTPStatusException):
+        asyncio.run(StreamlitKani(engine).get_model_completion())
+    assert engine.calls == 1
+
+
+def make_agent(*texts):
+    agent = StreamlitKani(Engine(), system_prompt = "You answer questions.")
+    agent.chat_history = [ChatMessage.user(text) for text in texts]
+    agent.conversation_started = bool(texts)
+    return agent
+
+
+def test_export_round_trip():
+    agents = {"Monarch Assistant": make_agent("Which genes?", "And diseases?"), "Unused": make_agent()}
+    for compress in (False, True):
+        chats = parse_chats(export_chats(agents, compress))
+        assert list(chats) == ["Monarch Assistant"]
+        target = StreamlitKani(Engine())
+        target.load_state(chats["Monarch Assistant"])
+        assert [m.text for m in target.chat_history] == ["Which genes?", "And diseases?"]
+        assert target.always_included_messages[0].text == "You answer questions."
+        assert target.conversation_started
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_sessions_round_trip(tmp_path, compress):
+    path = tmp_path / "sessions.jsonl"
+    sessions = [(f"session {i}", {"Monarch Assistant": make_agent(f"question {i}")}) for i in range(3)]
+    write_sessions(path, iter(sessions), compress)
+
+    read = list(read_sessions(path))
+    assert [session for session, _ in read] == ["session 0", "session 1", "session 2"]
+    assert [chats["Monarch Assistant"].chat_history[0].text for _, chats in read] == ["question 0", "question 1", "question 2"]
+
+
+class StreamResponse:
+    """Just enough of an aiohttp response to stream server-sent events from."""
+
+    def __init__(self, chunks):
+        self.status = 200
+        self.reason = "OK"
+        self.headers = {}
+        self.lines = [f"data: {json.dumps(chunk)}\n".encode() for chunk in chunks] + [b"data: [DONE]\n"]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    @property
+    def content(self):
+        async def lines():
+            for line in self.lines:
+                yield line
+        return lines()
+
+
+class StreamHttp:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.payloads = []
+
+    def post(self, url, json = None, headers = None):
+        self.payloads.append(json)
+        return StreamResponse(self.chunks)
+
+
+class CharTokenizer:
+    """A token per character, so OpenAIEngine works without downloading tiktoken's encodings."""
+
+    def encode(self, text):
+        return list(text)
+
+
+@pytest.fixture
+def offline_tokenizer(monkeypatch):
+    monkeypatch.setattr(OpenAIEngine, "_load_tokenizer", lambda engine: setattr(engine, "tokenizer", CharTokenizer()))
+
+
+def stream(chunks):
+    engine = OpenAIEngine("sk-test", model = "gpt-4-1106-preview", retry = 1)
+    engine.client.http = http = StreamHttp(chunks)
+    agent = StreamlitKani(engine)
+    agent.chat_history = [ChatMessage.user("Hello?")]
+    streamed = []
+    agent.stream_callback = streamed.append
+    return asyncio.run(agent._stream_completion()), streamed, http.payloads[0]
+
+
+def text_chunk(text):
+    return {"choices": [{"index": 0, "delta": {"content": text}}]}
+
+
+def test_streamed_usage_is_read_from_the_last_chunk(offline_tokenizer):
+    completion, streamed, payload = stream([text_chunk("Hel"), text_chunk("lo."), {"choices": [], "usage": {"prompt_tokens": 57, "completion_tokens": 4}}])
+    assert payload["stream_options"] == {"include_usage": True}
+    assert streamed == ["Hel", "lo."]
+    assert completion.message.text == "Hello."
+    assert (completion.prompt_tokens, completion.completion_tokens) == (57, 4)
+
+
+def test_streamed_usage_is_estimated_if_not_reported(offline_tokenizer):
+    completion, _, _ = stream([text_chunk("Hello.")])
+    assert completion.prompt_tokens > 0 and completion.completion_tokens > 0
+
+
+def test_message_token_len_is_memoized(monkeypatch):
+    agent = StreamlitKani(Engine())
+    calls = []
+    monkeypatch.setattr(kani_streamlit.token_lengths, "message_len", lambda engine, message: calls.append(message) or 7)
+    message = ChatMessage.user("Which genes?")
+    assert agent.message_token_len(message) == 7
+    assert agent.message_token_len(message) == 7
+    assert calls == [message]
+
+
+def test_history_token_len_follows_edits():
+    agent = StreamlitKani(Engine())
+
+    def expected():
+        return sum(len(m.text) for m in agent.chat_history)
+
+    agent.chat_history.extend(ChatMessage.user("x" * n) for n in (10, 20, 30))
+    assert agent.history_token_len() == expected() == 60
+    agent.chat_history.append(ChatMessage.assistant("y" * 5))
+    assert agent.history_token_len() == expected()
+
+    # replaced in place
+    agent.chat_history[1] = ChatMessage.user("z" * 200)
+    assert agent.history_token_len() == expected()
+
+    # trimmed at the front, then as many appended, so the length is unchanged
+    del agent.chat_history[:2]
+    agent.chat_history.extend([ChatMessage.user("a" * 40), ChatMessage.user("b" * 400)])
+    assert len(agent.chat_history) == 4
+    assert agent.history_token_len() == expected()
+
+    agent.chat_history = [ChatMessage.user("c")]
+    assert agent.history_token_len() == expected() == 1
+
+
+def result(text, call_id):
+    return ChatMessage.function("query_kg", text, tool_call_id = call_id)
+
+
+def turns_agent():
+    """Three user turns, each with a 250-token function result."""
+    agent = StreamlitKani(Engine())
+    agent.compact_min_tokens = 100
+    agent.compact_preview_chars = 20
+    for turn in range(3):
+        agent.chat_history += [ChatMessage.user(f"question {turn}"), result(str(turn) * 250, f"call_{turn}"), ChatMessage.assistant(f"answer {turn}")]
+    return agent
+
+
+def test_results_older_than_kept_turns_are_compacted():
+    agent = turns_agent()
+    agent.compact_threshold_tokens = 10_000
+    history = agent.compacted_history()
+    assert [m.text == o.text for m, o in zip(history, agent.chat_history)] == [True, False, True] + [True] * 6
+    assert history[1].text.startswith("[Earlier result of query_kg, compacted")
+    assert agent.chat_history[1].text == "0" * 250  # the original is kept
+
+    agent.compact_keep_turns = 1
+    assert [m.text == o.text for m, o in zip(agent.compacted_history(), agent.chat_history)] == [True, False, True, True, False, True, True, True, True]
+
+    agent.compact_keep_turns = 0
+    with pytest.raises(ValueError):
+        agent.compacted_history()
+
+
+def test_over_threshold_only_the_current_turn_is_kept():
+    agent = turns_agent()
+    agent.compact_threshold_tokens = 500
+    history = agent.compacted_history()
+    assert [m.text == o.text for m, o in zip(history, agent.chat_history)] == [True, False, True, True, False, True, True, True, True]
+    assert 0 < agent._compaction_saved_tokens == sum(250 - len(history[i].text) for i in (1, 4))
+
+
+def test_get_prompt_sends_compacted_history():
+    agent = turns_agent()
+    agent.compact_threshold_tokens = 10_000
+    prompt = asyncio.run(agent.get_prompt())
+    assert len(prompt) == 9
+    assert prompt[1].text.startswith("[Earlier result of query_kg") and "It began: 00000" in prompt[1].text
+    assert [m.text for m in prompt[3:]] == [m.text for m in agent.chat_history[3:]]
+
+
+def test_get_prompt_drops_what_does_not_fit():
+    agent = StreamlitKani(Engine())
+    agent.chat_history = [ChatMessage.user("a" * 1300), ChatMessage.user("b" * 300)]
+    assert [m.text for m in asyncio.run(agent.get_prompt())] == ["b" * 300]
+
+    agent.chat_history.append(ChatMessage.user("c" * 1600))
+    with pytest.raises(MessageTooLong):
+        asyncio.run(agent.get_prompt())
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import pytest
+from llm_scheduler import LLMScheduler, RateLimited, TransientError, INTERACTIVE, BACKGROUND, is_rate_limit, is_transient, retry_after_seconds
+
+
+def run_all(scheduler, jobs, hold = 0.05):
+    """Run (session, priority, tag) jobs while one blocking request holds the only slot; returns the tags in the order they ran."""
+    order = []
+
+    async def job(session, priority, tag, delay = 0.01):
+        async def request():
+            order.append(tag)
+            await asyncio.sleep(delay)
+        await scheduler.run(request, session, priority)
+
+    async def main():
+        blocker = asyncio.create_task(job("blocker", INTERACTIVE, "blocker", hold))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(blocker, *(job(*j) for j in jobs))
+
+    asyncio.run(main())
+    return order
+
+
+def test_round_robin_across_sessions():
+    order = run_all(LLMScheduler(max_concurrent = 1), [("a", INTERACTIVE, "a1"), ("a", INTERACTIVE, "a2"), ("a", INTERACTIVE, "a3"), ("b", INTERACTIVE, "b1")])
+    assert order == ["blocker", "a1", "b1", "a2", "a3"]
+
+
+def test_interactive_before_background():
+    order = run_all(LLMScheduler(max_concurrent = 1), [("a", BACKGROUND, "bg1"), ("b", BACKGROUND, "bg2"), ("c", INTERACTIVE, "chat")])
+    assert order == ["blocker", "chat", "bg1", "bg2"]
+
+
+def test_concurrency_cap_across_event_loops():
+    scheduler = LLMScheduler(max_concurrent = 2)
+    running = peak = 0
+    lock = threading.Lock()
+
+    async def request():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        with lock:
+            running -= 1
+
+    # each thread has its own event loop, like each Streamlit session
+    threads = [threading.Thread(target = lambda i = i: asyncio.run(scheduler.run(request, i))) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 2
+    assert scheduler.stats()["completed"] == 6
+    assert scheduler.stats()["running"] == 0
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = LLMScheduler(max_concurrent = 1)
+
+    async def main():
+        async def slow():
+            await asyncio.sleep(0.05)
+        blocker = asyncio.create_task(scheduler.run(slow, "a"))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(scheduler.run(slow, "b"))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queued"] == 1
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 0
+        await blocker
+
+    asyncio.run(main())
+    assert scheduler.stats()["running"] == 0
+
+
+def test_rate_limited_requests_are_retried():
+    scheduler = LLMScheduler(max_concurrent = 1, backoff_base = 0.001)
+    attempts = 0
+
+    async def request():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise RateLimited("429 Too Many Requests")
+        return "ok"
+
+    assert asyncio.run(scheduler.run(request)) == "ok"
+    assert attempts == 3
+    assert scheduler.stats()["rate_limited"] == 2
+
+
+def test_transient_errors_are_retried():
+    scheduler = LLMScheduler(max_concurrent = 1, backoff_base = 0.001)
+    attempts = 0
+
+    async def request():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise TransientError("503 Service Unavailable")
+        return "ok"
+
+    assert asyncio.run(scheduler.run(request)) == "ok"
+    assert attempts == 2
+    assert scheduler.stats()["transient_errors"] == 1
+    assert scheduler.stats()["rate_limited"] == 0
+
+
+def test_retries_give_up_and_other_errors_are_not_retried():
+    scheduler = LLMScheduler(max_concurrent = 1, max_retries = 2, backoff_base = 0.001)
+    attempts = 0
+
+    async def limited():
+        nonlocal attempts
+        attempts += 1
+        raise RateLimited("429")
+
+    with pytest.raises(RateLimited):
+        asyncio.run(scheduler.run(limited))
+    assert attempts == 3
+
+    async def failing():
+        raise ValueError("prompt is 14290 tokens, rate limit of 429 exceeded")
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.run(failing))
+    assert scheduler.stats()["failed"] == 2
+
+
+def test_rate_limit_detection():
+    assert is_rate_limit(RateLimited("slow down"))
+    assert not is_rate_limit(Exception("The prompt has 14290 tokens"))
+    assert not is_rate_limit(Exception("rate limit"))
+    assert not is_rate_limit(TransientError("503"))
+    assert is_transient(RateLimited("slow down")) and is_transient(TransientError("503"))
+
+
+def test_retry_after():
+    assert retry_after_seconds({"Retry-After": "2.5"}) == 2.5
+    assert retry_after_seconds({"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"}) is None
+    assert retry_after_seconds({}) is None
+    assert LLMScheduler(backoff_max = 10).backoff(1, retry_after = 30) == 10
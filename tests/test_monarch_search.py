@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("neo4j")
+
+from monarch_search import MonarchSearch
+
+
+def items(term):
+    return {"items": [{"id": f"X:{term}", "name": term, "category": "biolink:Disease", "description": "dropped"}]}
+
+
+def make_search(handler, **kwargs):
+    return MonarchSearch(url = "https://monarch.test/search", retry_delay = 0, transport = httpx.MockTransport(handler), **kwargs)
+
+
+def test_results_are_slimmed_and_cached():
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.params["q"])
+        return httpx.Response(200, json = items(request.url.params["q"]))
+
+    search = make_search(handler)
+    first = asyncio.run(search.search(["Tremor", " tremor ", "anemia"]))
+    assert first["Tremor"] == first[" tremor "] == [{"id": "X:tremor", "name": "tremor", "category": "biolink:Disease"}]
+    asyncio.run(search.search(["TREMOR"]))
+    assert sorted(requested) == ["anemia", "tremor"]
+
+
+def test_concurrency_is_capped():
+    running = peak = 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return httpx.Response(200, json = items(request.url.params["q"]))
+
+    results = asyncio.run(make_search(handler, max_concurrency = 2).search([f"term {i}" for i in range(6)]))
+    assert len(results) == 6
+    assert peak == 2
+
+
+def test_client_errors_are_not_retried():
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(404)
+
+    result = asyncio.run(make_search(handler).search(["tremor"]))["tremor"]
+    assert "HTTP 404" in result["error"]
+    assert calls == 1
+
+
+def test_server_errors_are_retried():
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(503) if calls < 3 else httpx.Response(200, json = items("tremor"))
+
+    result = asyncio.run(make_search(handler, retries = 2).search(["tremor"]))["tremor"]
+    assert result[0]["id"] == "X:tremor"
+    assert calls == 3
+
+
+def test_transport_errors_give_up_after_retries():
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        raise httpx.ConnectError("unreachable", request = request)
+
+    result = asyncio.run(make_search(handler, retries = 2).search(["tremor"]))["tremor"]
+    assert "ConnectError" in result["error"]
+    assert calls == 3
@@ -0,0 +1,41 @@
+import telemetry
+from query_cache import QueryCache
+
+
+def test_keys_ignore_formatting():
+    cache = QueryCache()
+    assert cache.make_key("match (n)  return n;", {"a": 1}) == cache.make_key("MATCH (n) RETURN n", {"a": 1})
+    assert cache.make_key("MATCH (n) RETURN n", {"a": 1}) != cache.make_key("MATCH (n) RETURN n", {"a": 2})
+
+
+def test_evicts_least_recently_used():
+    cache = QueryCache(max_entries = 2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire():
+    cache = QueryCache(ttl = -1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_new_version_clears_entries():
+    cache = QueryCache(version = "v1")
+    cache.put(cache.make_key("RETURN 1"), [1])
+    cache.set_version("v1")
+    assert cache.get(cache.make_key("RETURN 1")) == [1]
+    cache.set_version("v2")
+    assert cache.stats()["entries"] == 0
+    assert cache.make_key("RETURN 1")[0] == "v2"
+
+
+def test_process_cache_stats_are_gauges():
+    assert "query_cache_hit_rate" in telemetry.gauge_values()
+    assert "kg_agent_query_cache_entries" in telemetry.prometheus_text()
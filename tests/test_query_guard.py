@@ -0,0 +1,72 @@
+import pytest
+from query_guard import QueryGuard, QueryRejected
+
+
+guard = QueryGuard(default_limit = 1000, max_limit = 5000, max_estimated_rows = 1_000_000, max_risky_rows = 10_000)
+
+
+def test_adds_limit():
+    assert guard.enforce_limit("MATCH (n) RETURN n;") == ("MATCH (n) RETURN n LIMIT 1000", "LIMIT 1000 was added to the query.")
+
+
+def test_keeps_small_limit():
+    assert guard.enforce_limit("MATCH (n) RETURN n LIMIT 10") == ("MATCH (n) RETURN n LIMIT 10", None)
+
+
+def test_lowers_large_limit():
+    query, note = guard.enforce_limit("MATCH (n) RETURN n LIMIT 100000")
+    assert query == "MATCH (n) RETURN n LIMIT 5000"
+    assert "lowered" in note
+
+
+def test_limit_not_added_after_trailing_comment():
+    assert guard.enforce_limit("MATCH (n) RETURN n // all")[0] == "MATCH (n) RETURN n LIMIT 1000"
+    assert guard.enforce_limit("MATCH (n) RETURN n; /* all */\n// of them\n")[0] == "MATCH (n) RETURN n LIMIT 1000"
+
+
+def test_existing_limit_found_before_trailing_comment():
+    assert guard.enforce_limit("MATCH (n) RETURN n LIMIT 10 // ten") == ("MATCH (n) RETURN n LIMIT 10", None)
+
+
+def test_comment_markers_in_strings_are_kept():
+    query, _ = guard.enforce_limit("MATCH (n) WHERE n.url = 'http://x' RETURN n")
+    assert query == "MATCH (n) WHERE n.url = 'http://x' RETURN n LIMIT 1000"
+
+
+def test_ignores_return_in_subquery_and_union():
+    query, _ = guard.enforce_limit("MATCH (n) CALL { WITH n RETURN n AS m } RETURN m")
+    assert query.endswith("RETURN m LIMIT 1000")
+    assert guard.enforce_limit("RETURN 1 UNION RETURN 2") == ("RETURN 1 UNION RETURN 2", None)
+
+
+def plan(operator, rows, *children):
+    """A stand-in for summary.plan from an EXPLAIN, as the driver returns it."""
+    return {"operatorType": f"{operator}@neo4j", "args": {"EstimatedRows": float(rows)}, "children": list(children)}
+
+
+def test_accepts_cheap_plan():
+    guard.check_plan(plan("ProduceResults", 10, plan("Expand(All)", 10, plan("NodeIndexSeek", 1))),
+                     "MATCH (d {id: $lit0})-[]->(g) RETURN g")
+    assert guard.check_plan(None, "RETURN 1") is None
+
+
+def test_rejects_large_estimate():
+    with pytest.raises(QueryRejected, match = "Expand step is estimated to produce 5,000,000 rows"):
+        guard.check_plan(plan("ProduceResults", 10, plan("Expand(All)", 5_000_000, plan("NodeByLabelScan", 1000))), "MATCH (d)-[]->(g) RETURN g")
+
+
+def test_rejects_risky_operators_with_advice():
+    with pytest.raises(QueryRejected, match = "cartesian product") as rejected:
+        guard.check_plan(plan("ProduceResults", 10, plan("CartesianProduct", 50_000), plan("AllNodesScan", 20_000)), "MATCH (a), (b) RETURN a, b")
+    assert "scans every node" in str(rejected.value)
+    # small risky steps are fine
+    guard.check_plan(plan("ProduceResults", 10, plan("CartesianProduct", 100)), "MATCH (a:A), (b:B) RETURN a, b")
+
+
+def test_var_length_expand_rejected_only_if_unbounded():
+    expensive = plan("ProduceResults", 10, plan("VarLengthExpand(All)", 50_000))
+    with pytest.raises(QueryRejected, match = "upper bound"):
+        guard.check_plan(expensive, "MATCH (a)-[:`biolink:subclass_of`*]->(b) RETURN b")
+    with pytest.raises(QueryRejected, match = "upper bound"):
+        guard.check_plan(expensive, "MATCH (a)-[:`biolink:subclass_of`*2..]->(b) RETURN b")
+    guard.check_plan(expensive, "MATCH (a)-[:`biolink:subclass_of`*1..3]->(b) RETURN b")
@@ -0,0 +1,28 @@
+import json
+from result_format import as_table, compact_rows, with_repeated_values
+
+
+DISEASE = "Fanconi anemia complementation group A"
+ROWS = [{"g.id": f"HGNC:{i}", "g.name": f"FANC{i}", "d.name": DISEASE} for i in range(5)]
+
+
+def test_table():
+    assert as_table(ROWS)["columns"] == ["g.id", "g.name", "d.name"]
+    assert as_table(ROWS)["rows"][0] == ["HGNC:0", "FANC0", DISEASE]
+    assert as_table([{"a": 1}, {"b": 2}]) is None
+    assert as_table([]) is None
+
+
+def test_repeated_values():
+    table = with_repeated_values(as_table(ROWS))
+    assert table["repeated_values"] == {"@1": DISEASE}
+    assert all(row[2] == "@1" for row in table["rows"])
+    # values that already look like references would be ambiguous
+    assert with_repeated_values(as_table([{"a": "@1"}, {"a": DISEASE}, {"a": DISEASE}])) is None
+
+
+def test_compact_rows_picks_smallest():
+    compact = compact_rows(ROWS)
+    assert "repeated_values" in compact
+    assert len(json.dumps(compact)) < len(json.dumps(ROWS))
+    assert compact_rows([{"n": 1}]) == [{"n": 1}]
@@ -0,0 +1,38 @@
+from result_store import ResultStore
+
+
+def test_handles_are_unique_and_rows_kept():
+    store = ResultStore()
+    first = store.add("q1", [{"n": 1}], True)
+    second = store.add("q2", [{"n": 2}], True)
+    assert first != second
+    assert store.get(first).rows == [{"n": 1}]
+    assert store.get(second).query == "q2"
+
+
+def test_evicts_least_recently_used():
+    store = ResultStore(max_results = 2)
+    r1 = store.add("q1", [], True)
+    r2 = store.add("q2", [], True)
+    store.get(r1)  # r2 is now the least recently used
+    r3 = store.add("q3", [], True)
+    assert store.get(r2) is None
+    assert store.get(r1) is not None and store.get(r3) is not None
+
+
+def test_full_batch_fits():
+    store = ResultStore(max_results = 15)
+    handles = [store.add(f"q{i}", [{"i": i}], True) for i in range(10)]
+    assert all(store.get(h) is not None for h in handles)
+
+
+def test_rows_beyond_max_rows_are_dropped():
+    store = ResultStore(max_rows = 3)
+    stored = store.get(store.add("q", [{"i": i} for i in range(5)], True))
+    assert len(stored.rows) == 3
+    assert not stored.complete
+    assert store.get(store.add("q", [{"i": 1}], False)).complete is False
+
+
+def test_unknown_handle():
+    assert ResultStore().get("r99") is None
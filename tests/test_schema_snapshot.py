@@ -0,0 +1,88 @@
+import json
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("kani")
+
+import kg_driver
+import schema_snapshot
+from query_cache import query_cache
+from benchmarks.stand_ins import FakeDriver
+
+
+@pytest.fixture
+def snapshot_state(tmp_path, monkeypatch):
+    """A stand-in graph tagged by KG_VERSION, with the module's process-wide state reset around the test."""
+    monkeypatch.setenv("KG_VERSION", "build-1")
+    monkeypatch.setenv("KG_SCHEMA_SNAPSHOT", str(tmp_path / "kg_schema.json"))
+    for name in ("_schema", "_summary", "_loading", "_failed_at", "_checking", "_checked_at"):
+        monkeypatch.setattr(schema_snapshot, name, None)
+    monkeypatch.setattr(query_cache, "version", "")
+    driver = FakeDriver()
+    kg_driver.set_driver(driver)
+    yield tmp_path / "kg_schema.json", driver
+    kg_driver.set_driver(None)
+    query_cache.clear()
+
+
+def test_refresh_notices_a_rebuilt_graph(snapshot_state, monkeypatch):
+    monkeypatch.setattr(schema_snapshot, "CHECK_INTERVAL", 0)
+    assert schema_snapshot.get_schema(wait = 30)["kg_version"] == "build-1"
+    assert query_cache.version == "build-1"
+
+    key = query_cache.make_key("MATCH (n) RETURN n")
+    query_cache.put(key, [1])
+    schema_snapshot.refresh().join(30)
+    assert query_cache.get(key) == [1]  # same graph, nothing dropped
+
+    monkeypatch.setenv("KG_VERSION", "build-2")
+    schema_snapshot.refresh().join(30)
+    assert query_cache.version == "build-2"
+    assert query_cache.get(key) is None
+    assert schema_snapshot.get_schema()["kg_version"] == "build-2"
+    assert "graph version build-2" in schema_snapshot.get_summary()
+
+
+def test_refresh_is_rate_limited(snapshot_state, monkeypatch):
+    monkeypatch.setattr(schema_snapshot, "CHECK_INTERVAL", 3600)
+    # nothing to check before the snapshot is loaded; that starts loading it
+    assert schema_snapshot.refresh() is None
+    assert schema_snapshot.get_schema(wait = 30) is not None
+    checking = schema_snapshot.refresh()
+    assert checking is not None
+    assert schema_snapshot.refresh() is None
+    checking.join(30)
+
+
+def test_snapshot_is_reused_until_the_tag_changes(snapshot_state, monkeypatch):
+    path, driver = snapshot_state
+    built = schema_snapshot.load_or_build(str(path))
+    assert built["kg_version"] == "build-1"
+    assert built["relationships"]["biolink:causes"]["endpoints"][0][:2] == ["biolink:Gene", "biolink:Disease"]
+    assert set(built["labels"]["biolink:Gene"]["properties"]) == {"id", "name", "category", "in_taxon_label"}
+    assert json.loads(path.read_text()) == built
+
+    # same tag: read from disk, without introspecting the graph
+    queries = driver.queries
+    assert schema_snapshot.load_or_build(str(path)) == built
+    assert driver.queries == queries
+
+    monkeypatch.setenv("KG_VERSION", "build-2")
+    rebuilt = schema_snapshot.load_or_build(str(path))
+    assert rebuilt["kg_version"] == "build-2"
+    assert driver.queries > queries
+    assert json.loads(path.read_text())["kg_version"] == "build-2"
+
+
+def test_snapshot_of_another_format_is_rebuilt(snapshot_state):
+    path, driver = snapshot_state
+    path.write_text(json.dumps({"format": schema_snapshot.FORMAT_VERSION - 1, "kg_version": "build-1", "labels": {}, "relationships": {}}))
+    assert schema_snapshot.load_or_build(str(path))["labels"]
+    assert driver.queries > 0
+
+
+def test_summary_markdown(snapshot_state):
+    path, _ = snapshot_state
+    summary = schema_snapshot.summary_markdown(schema_snapshot.load_or_build(str(path)))
+    assert summary.startswith("## Node Labels (graph version build-1)")
+    assert "`biolink:causes`" in summary and "connects `biolink:Gene`->`biolink:Disease`" in summary
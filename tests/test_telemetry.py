@@ -0,0 +1,78 @@
+import json
+import urllib.request
+import pytest
+import telemetry
+from telemetry import Metrics
+
+
+def test_span_records_in_process_and_given_metrics():
+    agent_metrics = Metrics()
+    before = telemetry.process_metrics.snapshot().get("test.span", {}).get("count", 0)
+    with pytest.raises(ValueError):
+        with telemetry.span("test.span", agent_metrics, None):
+            raise ValueError("spans are recorded even if the block fails")
+    assert agent_metrics.snapshot()["test.span"]["count"] == 1
+    assert telemetry.process_metrics.snapshot()["test.span"]["count"] == before + 1
+
+
+def test_snapshot_stats_sorted_by_total():
+    metrics = Metrics()
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        metrics.record("slow", seconds)
+    metrics.record("fast", 0.5)
+    snapshot = metrics.snapshot()
+    assert list(snapshot) == ["slow", "fast"]
+    assert snapshot["slow"] == {"count": 4, "total_s": 10.0, "mean_s": 2.5, "p50_s": 3.0, "p95_s": 4.0, "max_s": 4.0}
+
+
+def test_merge():
+    a, b = Metrics(), Metrics()
+    a.record("x", 1.0)
+    b.record("x", 3.0)
+    b.record("y", 2.0)
+    merged = Metrics().merge(a, b).snapshot()
+    assert merged["x"]["count"] == 2 and merged["x"]["total_s"] == 4.0 and merged["x"]["max_s"] == 3.0
+    assert merged["y"]["count"] == 1
+
+
+def test_prometheus_text(monkeypatch):
+    monkeypatch.setattr(telemetry, "gauges", {"queue": lambda: {"depth": 3, "name": "not a number"}})
+    metrics = Metrics()
+    metrics.record("neo4j.query", 0.25)
+    text = telemetry.prometheus_text(metrics)
+    assert 'kg_agent_span_seconds{span="neo4j.query",quantile="0.5"} 0.250000' in text
+    assert 'kg_agent_span_seconds_count{span="neo4j.query"} 1' in text
+    # gauges are only exported with the process metrics
+    assert "queue_depth" not in text
+
+    text = telemetry.prometheus_text()
+    assert "# TYPE kg_agent_queue_depth gauge\nkg_agent_queue_depth 3\n" in text
+    assert "queue_name" not in text
+
+
+def test_jsonl(tmp_path):
+    metrics = Metrics()
+    metrics.record("tool.search", 0.1)
+    metrics.record("llm.completion", 2.0)
+    path = tmp_path / "timings.jsonl"
+    telemetry.write_jsonl(path, metrics, session = "s1")
+    telemetry.write_jsonl(path, metrics, session = "s2")
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(e["session"], e["span"]) for e in entries] == [("s1", "llm.completion"), ("s1", "tool.search"), ("s2", "llm.completion"), ("s2", "tool.search")]
+    assert entries[0]["count"] == 1 and entries[0]["total_s"] == 2.0
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(telemetry, "_server", None)
+    server = telemetry.serve_prometheus(0)
+    try:
+        assert telemetry.serve_prometheus(0) is server
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode().startswith("# HELP kg_agent_span_seconds")
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()